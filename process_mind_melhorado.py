@@ -5,18 +5,42 @@ Versão Melhorada com mapas interativos e ChatGPT
 """
 
 import streamlit as st
+import streamlit.components.v1 as components
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
+import numpy as np
 import sqlite3
 import hashlib
+import html
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import folium
+from folium.plugins import FastMarkerCluster, HeatMap, HeatMapWithTime
 from streamlit_folium import st_folium
 import PyPDF2
 import io
+import math
 import os
+import sys
+import time
+import queue
+import random
+import argparse
+import functools
+import inspect
+import re
+import tempfile
+import threading
+import unicodedata
+import urllib.parse
+import urllib.request
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Configuração da API OpenAI
 try:
@@ -33,22 +57,90 @@ try:
 except ImportError:
     OPENAI_DISPONIVEL = False
 
-# Configuração do Streamlit
+# SciPy (requirements.txt) fornece a KD-tree dos vizinhos mais próximos; sem ele, a busca usa força bruta vetorizada
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_DISPONIVEL = True
+except ImportError:
+    SCIPY_DISPONIVEL = False
 
-# Configuração da página
-st.set_page_config(
-    page_title="PROCESS MIND - Sistema Integrado",
-    page_icon="🏛️",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# Configuração do banco de dados
+DB_PATH = os.getenv('PROCESS_MIND_DB_PATH', 'process_mind_melhorado.db')
+DB_POOL_TAMANHO = int(os.getenv('PROCESS_MIND_DB_POOL_TAMANHO', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('PROCESS_MIND_DB_POOL_TIMEOUT', '10'))
+DB_POOL_VERIFICACAO = float(os.getenv('PROCESS_MIND_DB_POOL_VERIFICACAO', '30'))
+DB_PERFIL_PRAGMA = os.getenv('PROCESS_MIND_DB_PERFIL', 'wal')
+CACHE_RESULTADOS_MB = float(os.getenv('PROCESS_MIND_CACHE_MB', '64'))
+CACHE_VERSAO_TTL = float(os.getenv('PROCESS_MIND_CACHE_VERSAO_TTL', '1'))
+NAVEGACAO_MODO = os.getenv('PROCESS_MIND_NAVEGACAO', 'sob_demanda')
+TEMPOS_AMOSTRAS = 20
+# Widgets dos módulos (chave exata ou prefixo) cujo valor sobrevive enquanto o módulo não é exibido
+CHAVES_ESTADO_MODULOS = ('camadas_', 'celula_', 'tipos_', 'area_visivel_', 'heatmap_visualizacao', 'heatmap_tipos',
+                         'chat_ignorar_cache')
+MAPA_LIMITE_MARCADORES = int(os.getenv('PROCESS_MIND_MAPA_LIMITE_MARCADORES', '500'))
+MAPA_MODO = os.getenv('PROCESS_MIND_MAPA_MODO', 'estatico')
+MAPA_CACHE_MB = float(os.getenv('PROCESS_MIND_MAPA_CACHE_MB', '32'))
+MAPA_CACHE_DISCO_MB = float(os.getenv('PROCESS_MIND_MAPA_CACHE_DISCO_MB', '256'))
+MAPA_CACHE_DIR = os.getenv('PROCESS_MIND_MAPA_CACHE_DIR', '.cache_mapas')
+LLM_MODELO = os.getenv('PROCESS_MIND_LLM_MODELO', 'gpt-3.5-turbo')
+LLM_TIMEOUT = float(os.getenv('PROCESS_MIND_LLM_TIMEOUT', '20'))
+LLM_PRAZO_TOTAL = float(os.getenv('PROCESS_MIND_LLM_PRAZO_TOTAL', '45'))
+LLM_TENTATIVAS = int(os.getenv('PROCESS_MIND_LLM_TENTATIVAS', '3'))
+LLM_ESPERA_BASE = 0.5
+LLM_DISJUNTOR_FALHAS = int(os.getenv('PROCESS_MIND_LLM_DISJUNTOR_FALHAS', '5'))
+LLM_DISJUNTOR_ESPERA = float(os.getenv('PROCESS_MIND_LLM_DISJUNTOR_ESPERA', '30'))
+LLM_CONCORRENCIA = int(os.getenv('PROCESS_MIND_LLM_CONCORRENCIA', '4'))
+LLM_STREAMING = os.getenv('PROCESS_MIND_LLM_STREAMING', '1') == '1'
+LLM_STREAMING_INTERVALO = 0.05
+LLM_CACHE_MB = float(os.getenv('PROCESS_MIND_LLM_CACHE_MB', '16'))
+LLM_CACHE_VALIDADE_HORAS = float(os.getenv('PROCESS_MIND_LLM_CACHE_VALIDADE_HORAS', '24'))
+PDF_CACHE_MB = float(os.getenv('PROCESS_MIND_PDF_CACHE_MB', '64'))
+PDF_CACHE_DISCO_MB = float(os.getenv('PROCESS_MIND_PDF_CACHE_DISCO_MB', '512'))
+TILES_URL = os.getenv('PROCESS_MIND_TILES_URL', '')
+TILES_ATRIBUICAO = os.getenv('PROCESS_MIND_TILES_ATRIBUICAO', '&copy; OpenStreetMap contributors')
+TILES_ARQUIVO = os.getenv('PROCESS_MIND_TILES_ARQUIVO', 'tiles.mbtiles')
+TILES_ORIGEM = os.getenv('PROCESS_MIND_TILES_ORIGEM', '')
+TILES_POR_SEGUNDO = float(os.getenv('PROCESS_MIND_TILES_POR_SEGUNDO', '2'))
+TILES_MAXIMO = int(os.getenv('PROCESS_MIND_TILES_MAXIMO', '50000'))
+RECURSOS_URL = os.getenv('PROCESS_MIND_RECURSOS_URL', '')
+TILES_ZOOM_MAX = int(os.getenv('PROCESS_MIND_TILES_ZOOM_MAX', '15'))
+TILES_RAIO_KM = float(os.getenv('PROCESS_MIND_TILES_RAIO_KM', '15'))
+
+# Perfis de PRAGMA aplicados a cada nova conexão (sobrescrevíveis por PROCESS_MIND_DB_PRAGMA_<NOME>)
+PERFIS_PRAGMA = {
+    # Comportamento padrão do SQLite: journal de rollback, escrita bloqueia leitores
+    'padrao': {
+        'busy_timeout': 5000,
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL'
+    },
+    # Leitores não bloqueiam durante escritas; fsync apenas nos checkpoints
+    'wal': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,
+        'temp_store': 'MEMORY',
+        'mmap_size': 268435456
+    },
+    # Painéis com muitos usuários simultâneos e base grande
+    'leitura_intensiva': {
+        'busy_timeout': 10000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -131072,
+        'temp_store': 'MEMORY',
+        'mmap_size': 1073741824
+    }
+}
+PRAGMAS_SUPORTADOS = ('busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'temp_store', 'mmap_size')
 
 # Configurar OpenAI
 openai.api_key = os.getenv('OPENAI_API_KEY')
 openai.api_base = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
 
-# CSS customizado melhorado
-st.markdown("""
+# CSS customizado melhorado (aplicado por iniciar_aplicacao)
+ESTILO_CSS = """
 <style>
     .main-header {
         background: linear-gradient(90deg, #1e3a8a 0%, #3b82f6 100%);
@@ -144,18 +236,1252 @@ st.markdown("""
         margin: 1rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Consultas de leitura do ProcessMindDB (planos verificados pelo comando "verificar-planos")
+CONSULTAS = {
+    'autenticar_usuario': '''
+        SELECT u.id, u.municipio_id, u.nome, m.nome, m.uf, m.latitude, m.longitude 
+        FROM usuarios u 
+        JOIN municipios m ON u.municipio_id = m.id 
+        WHERE u.email = ? AND u.senha_hash = ? AND u.ativo = 1
+    ''',
+    'obter_dados_saude': '''
+        SELECT * FROM dados_saude 
+        WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+        ORDER BY ano, mes
+    ''',
+    'obter_estabelecimentos_saude': '''
+        SELECT * FROM estabelecimentos_saude 
+        WHERE municipio_id = ?
+        ORDER BY nome_fantasia
+    ''',
+    'obter_dados_educacao': '''
+        SELECT * FROM dados_educacao 
+        WHERE municipio_id = ?
+        ORDER BY ano DESC
+    ''',
+    'obter_escolas': '''
+        SELECT * FROM escolas 
+        WHERE municipio_id = ?
+        ORDER BY nome
+    ''',
+    'obter_dados_seguranca': '''
+        SELECT * FROM dados_seguranca 
+        WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+        ORDER BY ano, mes, regiao
+    ''',
+    'obter_unidades_seguranca': '''
+        SELECT * FROM unidades_seguranca 
+        WHERE municipio_id = ?
+        ORDER BY nome
+    ''',
+    'obter_dados_demograficos': '''
+        SELECT * FROM dados_demograficos 
+        WHERE municipio_id = ?
+        ORDER BY ano DESC
+    ''',
+    'obter_kpis_saude': '''
+        SELECT COALESCE(SUM(internacoes), 0) AS internacoes, COALESCE(SUM(obitos), 0) AS obitos,
+               COALESCE(SUM(altas), 0) AS altas, COALESCE(SUM(atendimentos_ubs), 0) AS atendimentos_ubs,
+               COALESCE(SUM(registros), 0) AS registros
+        FROM rollup_saude_anual
+        WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+    ''',
+    'obter_saude_mensal': '''
+        SELECT ano, mes, internacoes, obitos, altas, atendimentos_ubs
+        FROM rollup_saude_mensal
+        WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+        ORDER BY ano, mes
+    ''',
+    'obter_kpis_seguranca': '''
+        SELECT COALESCE(SUM(homicidios), 0) AS homicidios, COALESCE(SUM(roubos), 0) AS roubos,
+               COALESCE(SUM(furtos), 0) AS furtos, COALESCE(SUM(violencia_domestica), 0) AS violencia_domestica,
+               COALESCE(SUM(acidentes_transito), 0) AS acidentes_transito, COALESCE(SUM(registros), 0) AS registros
+        FROM rollup_seguranca_anual
+        WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+    ''',
+    'obter_seguranca_mensal': '''
+        SELECT ano, mes, regiao, homicidios, roubos, furtos, violencia_domestica, acidentes_transito
+        FROM rollup_seguranca_mensal
+        WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+        ORDER BY ano, mes, regiao
+    ''',
+    'obter_seguranca_por_regiao': '''
+        SELECT regiao, SUM(homicidios) AS homicidios, SUM(roubos) AS roubos, SUM(furtos) AS furtos,
+               SUM(violencia_domestica) AS violencia_domestica, SUM(acidentes_transito) AS acidentes_transito
+        FROM rollup_seguranca_anual
+        WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+        GROUP BY regiao
+        ORDER BY regiao
+    '''
+}
+
+# Tipos de ocorrência que podem compor o peso do mapa de calor (coluna -> rótulo)
+TIPOS_CRIME = {
+    'homicidios': 'Homicídios',
+    'roubos': 'Roubos',
+    'furtos': 'Furtos',
+    'violencia_domestica': 'Violência Doméstica',
+    'acidentes_transito': 'Acidentes de Trânsito'
+}
+TIPOS_CRIME_PADRAO = ('homicidios', 'roubos', 'furtos', 'violencia_domestica')
+TAMANHOS_CELULA_METROS = [100, 250, 500, 1000, 2000]
+HEATMAP_QUADRO_CELULA_M = 500
+METROS_POR_GRAU = 111320.0
+
+# Grade do mapa de calor: células a partir de (-90, -180), então a divisão é sempre positiva
+# e CAST trunca como floor. O GROUP BY sobre expressões sempre usa B-tree temporária, por isso
+# esta consulta fica fora de CONSULTAS (e da verificação de planos)
+CONSULTA_GRADE_CRIMINALIDADE = f'''
+    SELECT CAST((latitude + 90.0) / ? AS INTEGER) AS celula_lat,
+           CAST((longitude + 180.0) / ? AS INTEGER) AS celula_lon,
+           SUM({' + '.join(f'COALESCE({coluna}, 0) * ?' for coluna in TIPOS_CRIME)}) AS peso
+    FROM dados_seguranca
+    WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+      AND latitude IS NOT NULL AND longitude IS NOT NULL
+    GROUP BY celula_lat, celula_lon
+    HAVING peso > 0
+'''
+
+# Ocorrências dos meses pendentes de recálculo do heatmap animado ({filtro} restringe o município)
+CONSULTA_QUADROS_PENDENTES = f'''
+    SELECT s.municipio_id, s.ano, s.mes, s.latitude, s.longitude,
+           {', '.join(f's.{coluna}' for coluna in TIPOS_CRIME)},
+           COALESCE(m.latitude, 0.0) AS lat_referencia
+    FROM quadros_heatmap_pendentes p
+    JOIN dados_seguranca s ON s.municipio_id = p.municipio_id AND s.ano = p.ano AND s.mes = p.mes
+    LEFT JOIN municipios m ON m.id = s.municipio_id
+    WHERE s.latitude IS NOT NULL AND s.longitude IS NOT NULL {{filtro}}
+'''
+
+# Índices compostos: filtro por município + ordenação de cada consulta acima
+INDICES = [
+    'CREATE INDEX IF NOT EXISTS idx_dados_saude_municipio_periodo ON dados_saude (municipio_id, ano, mes)',
+    'CREATE INDEX IF NOT EXISTS idx_estabelecimentos_saude_municipio_nome ON estabelecimentos_saude (municipio_id, nome_fantasia)',
+    'CREATE INDEX IF NOT EXISTS idx_dados_educacao_municipio_ano ON dados_educacao (municipio_id, ano)',
+    'CREATE INDEX IF NOT EXISTS idx_escolas_municipio_nome ON escolas (municipio_id, nome)',
+    'CREATE INDEX IF NOT EXISTS idx_dados_seguranca_municipio_periodo ON dados_seguranca (municipio_id, ano, mes, regiao)',
+    'CREATE INDEX IF NOT EXISTS idx_unidades_seguranca_municipio_nome ON unidades_seguranca (municipio_id, nome)',
+    'CREATE INDEX IF NOT EXISTS idx_dados_demograficos_municipio_ano ON dados_demograficos (municipio_id, ano)',
+    'CREATE INDEX IF NOT EXISTS idx_chat_conversas_municipio ON chat_conversas (municipio_id, data_conversa)'
+]
+
+# Tabelas lidas pelas consultas em cache: toda escrita nelas incrementa a versão dos dados (por trigger).
+# Rollups e R*Tree são mantidos a partir destas tabelas e não precisam de trigger próprio
+TABELAS_VERSIONADAS = (
+    'municipios', 'dados_saude', 'estabelecimentos_saude', 'dados_educacao', 'escolas',
+    'dados_seguranca', 'unidades_seguranca', 'dados_demograficos', 'quadros_heatmap'
+)
+
+# Tabelas de agregação mantidas por triggers: fato -> métricas somadas e chave de cada rollup
+ROLLUPS = {
+    'dados_saude': {
+        'metricas': ['internacoes', 'obitos', 'altas', 'atendimentos_ubs'],
+        'tabelas': {
+            'rollup_saude_mensal': ['municipio_id', 'ano', 'mes'],
+            'rollup_saude_anual': ['municipio_id', 'ano']
+        }
+    },
+    'dados_seguranca': {
+        'metricas': ['homicidios', 'roubos', 'furtos', 'violencia_domestica', 'acidentes_transito'],
+        'tabelas': {
+            'rollup_seguranca_mensal': ['municipio_id', 'ano', 'mes', 'regiao'],
+            # Região antes do ano: o agrupamento por região sai ordenado pela própria chave
+            'rollup_seguranca_anual': ['municipio_id', 'regiao', 'ano']
+        }
+    }
+}
+
+# Índices espaciais R*Tree (tabela base -> tabela virtual), sincronizados com a base por triggers
+INDICES_ESPACIAIS = {
+    'estabelecimentos_saude': 'rtree_estabelecimentos_saude',
+    'escolas': 'rtree_escolas',
+    'unidades_seguranca': 'rtree_unidades_seguranca',
+    'dados_seguranca': 'rtree_dados_seguranca'
+}
+RAIO_TERRA_KM = 6371.0088
+
+# Tabelas de pontos da análise de proximidade: (coluna de nome, coluna de tipo)
+TABELAS_PROXIMIDADE = {
+    'escolas': ('nome', 'tipo_escola'),
+    'estabelecimentos_saude': ('nome_fantasia', 'tipo_estabelecimento'),
+    'unidades_seguranca': ('nome', 'tipo_unidade')
+}
+RAIOS_COBERTURA_KM = (0.5, 1, 2, 5, 10)
+
+# Camadas do mapa integrado (chave -> rótulo), na ordem de sobreposição
+CAMADAS_MAPA = {
+    'estabelecimentos': '🏥 Estabelecimentos de saúde',
+    'escolas': '🎓 Escolas',
+    'unidades_seguranca': '🚔 Unidades de segurança',
+    'heatmap_crimes': '🔥 Mapa de calor da criminalidade'
+}
+
+# Camadas de pontos do mapa integrado -> tabela com índice espacial
+TABELAS_CAMADAS = {
+    'estabelecimentos': 'estabelecimentos_saude',
+    'escolas': 'escolas',
+    'unidades_seguranca': 'unidades_seguranca'
+}
+ROTULOS_TABELAS = {
+    'estabelecimentos_saude': 'Estabelecimentos de saúde',
+    'escolas': 'Escolas',
+    'unidades_seguranca': 'Unidades de segurança'
+}
+
+# O R*Tree guarda float32 arredondado para fora: a segunda faixa refina pelas colunas originais.
+# Varre a tabela virtual pelo índice (SCAN ... VIRTUAL TABLE), por isso fica fora de CONSULTAS
+CONSULTA_AREA = '''
+    SELECT t.* FROM {rtree} r
+    JOIN {tabela} t ON t.id = r.id
+    WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+      AND t.latitude BETWEEN ? AND ? AND t.longitude BETWEEN ? AND ? {filtro}
+    ORDER BY t.id
+'''
+
+# Migrações de esquema: (versão, descrição, método do ProcessMindDB que recebe o cursor)
+MIGRACOES = [
+    (1, 'Tabelas iniciais', 'criar_tabelas'),
+    (2, 'Índices das consultas de leitura', 'criar_indices'),
+    (3, 'Municípios, usuários e dados iniciais', 'inserir_dados_iniciais'),
+    (4, 'Chave natural de dados_saude (município, mês, tipo)', 'criar_chave_dados_saude'),
+    (5, 'Chaves únicas de CNES e código INEP', 'criar_chaves_cadastros'),
+    (6, 'Rollups mensais/anuais de saúde e segurança', 'criar_rollups'),
+    (7, 'Versão dos dados para invalidação de caches', 'criar_metadados'),
+    (8, 'Quadros mensais pré-calculados do heatmap de segurança', 'criar_quadros_heatmap'),
+    (9, 'Índices espaciais R*Tree das tabelas com coordenadas', 'criar_indices_espaciais'),
+    (10, 'Cache persistente de respostas do chatbot', 'criar_cache_respostas'),
+    (11, 'Texto extraído de PDFs por hash do conteúdo', 'criar_cache_pdfs'),
+    (12, 'Versão dos dados incrementada por triggers nas tabelas de origem', 'criar_triggers_versao_dados')
+]
+
+# Bancos já migrados neste processo e repositórios compartilhados por caminho
+_BANCOS_MIGRADOS = set()
+_LOCK_MIGRACOES = threading.Lock()
+_REPOSITORIOS = {}
+_LOCK_REPOSITORIOS = threading.Lock()
+
+def carregar_perfil_pragma(nome=None):
+    """Montar o perfil de PRAGMA a partir do nome e das variáveis de ambiente"""
+    nome = nome or DB_PERFIL_PRAGMA
+    if nome not in PERFIS_PRAGMA:
+        raise ValueError(f"Perfil de PRAGMA desconhecido: {nome} (opções: {', '.join(PERFIS_PRAGMA)})")
+    
+    perfil = dict(PERFIS_PRAGMA[nome])
+    for pragma in PRAGMAS_SUPORTADOS:
+        valor = os.getenv(f'PROCESS_MIND_DB_PRAGMA_{pragma.upper()}')
+        if valor:
+            perfil[pragma] = valor
+    
+    for pragma, valor in perfil.items():
+        if pragma not in PRAGMAS_SUPORTADOS or not re.fullmatch(r'-?[A-Za-z0-9_]+', str(valor)):
+            raise ValueError(f"PRAGMA inválido: {pragma}={valor}")
+    return perfil
+
+class PoolConexoes:
+    """Pool de conexões SQLite de longa duração, compartilhado entre threads"""
+
+    def __init__(self, db_path, tamanho=DB_POOL_TAMANHO, timeout=DB_POOL_TIMEOUT,
+                 intervalo_verificacao=DB_POOL_VERIFICACAO, pragmas=None):
+        self.db_path = db_path
+        self.pragmas = pragmas or {}
+        self.tamanho = max(1, tamanho)
+        self.timeout = timeout
+        self.intervalo_verificacao = intervalo_verificacao
+
+        # Conexões livres como (conexão, último uso); LIFO mantém o cache de páginas "quente"
+        self._livres = queue.LifoQueue(maxsize=self.tamanho)
+        self._lock = threading.Lock()
+        self._abertas = 0
+        self._fechado = False
+        self.estatisticas = {'criadas': 0, 'reutilizadas': 0, 'descartadas': 0, 'esperas': 0}
+
+    def _criar_conexao(self):
+        """Abrir uma nova conexão utilizável por qualquer thread"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        for pragma, valor in self.pragmas.items():
+            conn.execute(f'PRAGMA {pragma} = {valor}')
+        self.estatisticas['criadas'] += 1
+        return conn
+
+    def _conexao_saudavel(self, conn):
+        """Verificar se a conexão ainda responde"""
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _descartar(self, conn):
+        """Fechar uma conexão defeituosa e liberar sua vaga no pool"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._abertas -= 1
+        self.estatisticas['descartadas'] += 1
+
+    def _retirar(self):
+        """Retirar uma conexão livre, criando uma nova se houver vaga"""
+        if self._fechado:
+            raise RuntimeError("Pool de conexões já foi fechado")
+
+        while True:
+            try:
+                conn, ultimo_uso = self._livres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    pode_criar = self._abertas < self.tamanho
+                    if pode_criar:
+                        self._abertas += 1
+                if pode_criar:
+                    try:
+                        return self._criar_conexao()
+                    except sqlite3.Error:
+                        with self._lock:
+                            self._abertas -= 1
+                        raise
+
+                # Pool esgotado: aguardar uma conexão ser devolvida
+                self.estatisticas['esperas'] += 1
+                try:
+                    conn, ultimo_uso = self._livres.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"Nenhuma conexão disponível após {self.timeout}s")
+
+            # Verificação de saúde apenas em conexões ociosas há algum tempo
+            if time.monotonic() - ultimo_uso > self.intervalo_verificacao and not self._conexao_saudavel(conn):
+                self._descartar(conn)
+                continue
+
+            self.estatisticas['reutilizadas'] += 1
+            return conn
+
+    def _devolver(self, conn):
+        """Devolver a conexão ao pool, desfazendo transações pendentes"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._descartar(conn)
+            return
+
+        if self._fechado:
+            self._descartar(conn)
+            return
+        self._livres.put_nowait((conn, time.monotonic()))
+
+    @contextmanager
+    def conexao(self):
+        """Context manager que retira e devolve uma conexão do pool"""
+        conn = self._retirar()
+        try:
+            yield conn
+        finally:
+            self._devolver(conn)
+
+    def fechar(self):
+        """Fechar todas as conexões livres e recusar novos pedidos"""
+        self._fechado = True
+        while True:
+            try:
+                conn, _ = self._livres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conn)
+
+class CacheResultados:
+    """Cache LRU de resultados de consultas, limitado pela memória ocupada"""
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_usados = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    @staticmethod
+    def _tamanho(valor):
+        """Memória aproximada ocupada por um resultado"""
+        if isinstance(valor, pd.DataFrame):
+            return int(valor.memory_usage(deep=True).sum())
+        return sys.getsizeof(valor)
+
+    def obter(self, chave):
+        """Retornar (encontrado, valor), marcando o item como usado recentemente"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.falhas += 1
+                return False, None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return True, item[0]
+
+    def guardar(self, chave, valor):
+        """Guardar um resultado, removendo os menos usados até caber no limite"""
+        tamanho = self._tamanho(valor)
+        if tamanho > self.limite_bytes:
+            return
+        removidos = []
+        with self._lock:
+            if chave in self._itens:
+                self.bytes_usados -= self._itens.pop(chave)[1]
+            self._itens[chave] = (valor, tamanho)
+            self.bytes_usados += tamanho
+            while self.bytes_usados > self.limite_bytes:
+                chave_removida, (valor_removido, tamanho_removido) = self._itens.popitem(last=False)
+                self.bytes_usados -= tamanho_removido
+                self.remocoes += 1
+                removidos.append((chave_removida, valor_removido))
+        for chave_removida, valor_removido in removidos:
+            self._ao_remover(chave_removida, valor_removido)
+
+    def _ao_remover(self, chave, valor):
+        """Ponto de extensão chamado, fora do lock, para cada item removido por falta de espaço"""
+
+    def limpar(self):
+        """Esvaziar o cache (os contadores são mantidos)"""
+        with self._lock:
+            self._itens.clear()
+            self.bytes_usados = 0
+
+    def estatisticas(self):
+        """Contadores de uso para exibição"""
+        total = self.acertos + self.falhas
+        return {
+            'itens': len(self._itens),
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acerto': self.acertos / total if total else 0.0,
+            'remocoes': self.remocoes,
+            'mb_usados': self.bytes_usados / 1024 / 1024,
+            'mb_limite': self.limite_bytes / 1024 / 1024
+        }
+
+class CacheMapas(CacheResultados):
+    """Cache LRU do HTML de mapas renderizados; o que sai da memória é gravado em disco"""
+
+    def __init__(self, limite_bytes, diretorio=MAPA_CACHE_DIR, limite_disco_bytes=0):
+        super().__init__(limite_bytes)
+        self.diretorio = diretorio
+        self.limite_disco_bytes = limite_disco_bytes
+        self.acertos_disco = 0
+        if limite_disco_bytes > 0:
+            os.makedirs(diretorio, exist_ok=True)
+
+    def _arquivo(self, chave):
+        """Caminho do arquivo em disco correspondente a uma chave"""
+        return os.path.join(self.diretorio, hashlib.sha256(repr(chave).encode('utf-8')).hexdigest() + '.html')
+
+    def _ao_remover(self, chave, valor):
+        """Gravar em disco o HTML removido da memória"""
+        if self.limite_disco_bytes <= 0 or len(valor) > self.limite_disco_bytes:
+            return
+        caminho = self._arquivo(chave)
+        temporario = f"{caminho}.{threading.get_ident()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(valor)
+        os.replace(temporario, caminho)
+        self._podar_disco()
+
+    def _podar_disco(self):
+        """Apagar os arquivos usados há mais tempo até o diretório caber no limite"""
+        arquivos = []
+        for entrada in os.scandir(self.diretorio):
+            if entrada.name.endswith('.html'):
+                try:
+                    estado = entrada.stat()
+                except FileNotFoundError:
+                    continue
+                arquivos.append((estado.st_mtime, estado.st_size, entrada.path))
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= self.limite_disco_bytes:
+                break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+
+    def obter(self, chave):
+        """Retornar (encontrado, html) da memória ou, em seguida, do disco"""
+        encontrado, valor = super().obter(chave)
+        if encontrado or self.limite_disco_bytes <= 0:
+            return encontrado, valor
+        caminho = self._arquivo(chave)
+        try:
+            with open(caminho, encoding='utf-8') as arquivo:
+                valor = arquivo.read()
+            os.utime(caminho)
+        except FileNotFoundError:
+            return False, None
+        with self._lock:
+            self.falhas -= 1
+            self.acertos += 1
+            self.acertos_disco += 1
+        self.guardar(chave, valor)
+        return True, valor
+
+    def estatisticas(self):
+        """Contadores de uso, incluindo os acertos servidos do disco"""
+        return {**super().estatisticas(), 'acertos_disco': self.acertos_disco}
+
+class CacheRespostasLLM:
+    """Cache persistente (SQLite) das respostas do ChatGPT, com validade e limite de tamanho"""
+
+    def __init__(self, repositorio, limite_bytes, validade_segundos):
+        self.repositorio = repositorio
+        self.limite_bytes = limite_bytes
+        self.validade_segundos = validade_segundos
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.expirados = 0
+        self.ignorados = 0
+        self.remocoes = 0
+
+    @staticmethod
+    def chave(pergunta, municipio_id, contexto_pdf, contexto_dados, modelo=LLM_MODELO):
+        """Chave da resposta: pergunta normalizada, município, conteúdo do PDF, contexto dos dados e modelo"""
+        partes = [
+            normalizar_texto(pergunta).strip(' ?!.'),
+            str(municipio_id),
+            hashlib.sha256(contexto_pdf.encode('utf-8')).hexdigest() if contexto_pdf else '',
+            hashlib.sha256(contexto_dados.encode('utf-8')).hexdigest(),
+            modelo
+        ]
+        return hashlib.sha256('\x1f'.join(partes).encode('utf-8')).hexdigest()
+
+    def _contar(self, contador, quantidade=1):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + quantidade)
+
+    def obter(self, chave, ignorar=False):
+        """Retornar (encontrado, resposta); com ignorar=True a consulta à API é forçada"""
+        if ignorar:
+            self._contar('ignorados')
+            return False, None
+        agora = time.time()
+        with self.repositorio.conexao() as conn:
+            linha = conn.execute('SELECT resposta, criado_em FROM cache_respostas WHERE chave = ?', (chave,)).fetchone()
+            if linha is not None and agora - linha[1] > self.validade_segundos:
+                conn.execute('DELETE FROM cache_respostas WHERE chave = ?', (chave,))
+                self._contar('expirados')
+                linha = None
+            elif linha is not None:
+                conn.execute('UPDATE cache_respostas SET acessado_em = ?, acertos = acertos + 1 WHERE chave = ?',
+                             (agora, chave))
+        self._contar('acertos' if linha is not None else 'falhas')
+        return (True, linha[0]) if linha is not None else (False, None)
+
+    def guardar(self, chave, municipio_id, pergunta, resposta):
+        """Guardar uma resposta, descartando as expiradas e as menos usadas até caber no limite"""
+        tamanho = len(resposta.encode('utf-8'))
+        if tamanho > self.limite_bytes:
+            return
+        agora = time.time()
+        with self.repositorio.conexao() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO cache_respostas
+                    (chave, municipio_id, pergunta, resposta, tamanho, criado_em, acessado_em, acertos)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+            ''', (chave, municipio_id, normalizar_texto(pergunta), resposta, tamanho, agora, agora))
+            removidas = conn.execute('DELETE FROM cache_respostas WHERE criado_em < ?',
+                                     (agora - self.validade_segundos,)).rowcount
+            removidas += conn.execute('''
+                DELETE FROM cache_respostas WHERE chave IN (
+                    SELECT chave FROM (
+                        SELECT chave, SUM(tamanho) OVER (ORDER BY acessado_em DESC, chave) AS acumulado
+                        FROM cache_respostas
+                    ) WHERE acumulado > ?
+                )
+            ''', (self.limite_bytes,)).rowcount
+        self._contar('remocoes', removidas)
+
+    def limpar(self):
+        """Apagar todas as respostas guardadas (os contadores são mantidos)"""
+        with self.repositorio.conexao() as conn:
+            conn.execute('DELETE FROM cache_respostas')
+
+    def estatisticas(self):
+        """Contadores desta instância e ocupação da tabela"""
+        with self.repositorio.conexao() as conn:
+            itens, tamanho, acertos_total = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(tamanho), 0), COALESCE(SUM(acertos), 0) FROM cache_respostas'
+            ).fetchone()
+        consultas = self.acertos + self.falhas
+        return {
+            'itens': itens,
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acerto': self.acertos / consultas if consultas else 0.0,
+            'expirados': self.expirados,
+            'ignorados': self.ignorados,
+            'remocoes': self.remocoes,
+            'acertos_total': acertos_total,
+            'mb_usados': tamanho / 1024 / 1024,
+            'mb_limite': self.limite_bytes / 1024 / 1024
+        }
+
+class DisjuntorAberto(RuntimeError):
+    """A API do ChatGPT está marcada como indisponível; a chamada nem foi tentada"""
+
+# Erros de rede, limite de taxa e 5xx merecem nova tentativa; os demais (chave inválida, pedido inválido) não
+ERROS_LLM_TRANSITORIOS = (TimeoutError, ConnectionError) + tuple(
+    getattr(openai, nome) for nome in ('APITimeoutError', 'APIConnectionError', 'RateLimitError', 'InternalServerError')
+    if hasattr(openai, nome)
+)
+
+class FluxoAcompanhado:
+    """Fluxo de resposta do ChatGPT que devolve a vaga ao terminar, ao ser fechado ou ao ser descartado sem leitura"""
+    
+    def __init__(self, cliente, fluxo, inicio):
+        self._cliente = cliente
+        self._fluxo = fluxo
+        self._eventos = iter(fluxo)
+        self._inicio = inicio
+        self._encerrado = False
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if self._encerrado:
+            raise StopIteration
+        try:
+            return next(self._eventos)
+        except StopIteration:
+            self._encerrar(True)
+            raise
+        except BaseException:
+            self._encerrar(False)
+            raise
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *excecao):
+        self.close()
+    
+    def __del__(self):
+        self.close()
+    
+    def close(self):
+        """Interromper o fluxo (sucesso só é registrado se ele chegou ao fim)"""
+        self._encerrar(False)
+    
+    def _encerrar(self, concluido):
+        with self._cliente._lock:
+            if self._encerrado:
+                return
+            self._encerrado = True
+        try:
+            if hasattr(self._fluxo, 'close'):
+                self._fluxo.close()
+        finally:
+            self._cliente._liberar_vaga()
+            self._cliente._registrar(concluido, self._inicio)
+
+class ClienteLLMResiliente:
+    """Chamadas ao ChatGPT com prazo, novas tentativas com jitter e disjuntor compartilhado pelo processo"""
+
+    FAIXAS_LATENCIA_MS = (250, 500, 1000, 2000, 5000, 10000, 20000, float('inf'))
+
+    def __init__(self, cliente, timeout=LLM_TIMEOUT, tentativas=LLM_TENTATIVAS, prazo_total=LLM_PRAZO_TOTAL,
+                 espera_base=LLM_ESPERA_BASE, limite_falhas=LLM_DISJUNTOR_FALHAS, espera_disjuntor=LLM_DISJUNTOR_ESPERA,
+                 concorrencia=LLM_CONCORRENCIA):
+        self.cliente = cliente
+        self.timeout = timeout
+        self.tentativas = max(1, tentativas)
+        self.prazo_total = prazo_total
+        self.espera_base = espera_base
+        self.limite_falhas = limite_falhas
+        self.espera_disjuntor = espera_disjuntor
+        self._lock = threading.Lock()
+        
+        # Vagas para chamadas simultâneas à API, somando todas as sessões do processo
+        self.concorrencia = max(1, concorrencia)
+        self._vagas = threading.BoundedSemaphore(self.concorrencia)
+        self.em_uso = 0
+        self.aguardando = 0
+        self.desistencias = 0
+        self.esperas_ms = deque(maxlen=200)
+        
+        # Disjuntor: fechado (normal) -> aberto (curto-circuita) -> meio_aberto (uma chamada de teste)
+        self.estado = 'fechado'
+        self.falhas_seguidas = 0
+        self._aberto_ate = 0.0
+        self._teste_em_andamento = False
+        
+        self.chamadas = 0
+        self.sucessos = 0
+        self.falhas = 0
+        self.retentativas = 0
+        self.curto_circuitos = 0
+        self.histograma = [0] * len(self.FAIXAS_LATENCIA_MS)
+
+    def _liberar_chamada(self):
+        """Decidir, pelo estado do disjuntor, se a chamada pode ir à API"""
+        with self._lock:
+            if self.estado == 'aberto' and time.monotonic() >= self._aberto_ate:
+                self.estado = 'meio_aberto'
+                self._teste_em_andamento = False
+            if self.estado == 'aberto' or (self.estado == 'meio_aberto' and self._teste_em_andamento):
+                self.curto_circuitos += 1
+                raise DisjuntorAberto(f"ChatGPT indisponível; nova tentativa em {max(0.0, self._aberto_ate - time.monotonic()):.0f}s")
+            if self.estado == 'meio_aberto':
+                self._teste_em_andamento = True
+            self.chamadas += 1
+
+    def _cancelar_chamada(self, curto_circuito=False):
+        """Desfazer uma chamada liberada pelo disjuntor que não chegou à API"""
+        with self._lock:
+            self.chamadas -= 1
+            self.curto_circuitos += curto_circuito
+            if self.estado == 'meio_aberto':
+                self._teste_em_andamento = False
+
+    def _registrar(self, sucesso, inicio):
+        """Atualizar histograma, contadores e estado do disjuntor ao fim de uma chamada"""
+        latencia_ms = (time.monotonic() - inicio) * 1000
+        with self._lock:
+            self.histograma[next(i for i, limite in enumerate(self.FAIXAS_LATENCIA_MS) if latencia_ms <= limite)] += 1
+            if sucesso:
+                self.sucessos += 1
+                self.falhas_seguidas = 0
+                self.estado = 'fechado'
+            else:
+                self.falhas += 1
+                self.falhas_seguidas += 1
+                if self.estado == 'meio_aberto' or self.falhas_seguidas >= self.limite_falhas:
+                    self.estado = 'aberto'
+                    self._aberto_ate = time.monotonic() + self.espera_disjuntor
+            self._teste_em_andamento = False
+
+    def _ocupar_vaga(self, prazo):
+        """Aguardar uma vaga de chamada simultânea até o prazo, registrando o tempo de espera na fila"""
+        inicio = time.monotonic()
+        with self._lock:
+            self.aguardando += 1
+        try:
+            obtida = self._vagas.acquire(timeout=max(0.0, prazo - inicio))
+        finally:
+            with self._lock:
+                self.aguardando -= 1
+                self.esperas_ms.append((time.monotonic() - inicio) * 1000)
+                if obtida:
+                    self.em_uso += 1
+                else:
+                    self.desistencias += 1
+        if not obtida:
+            raise TimeoutError(f"Sem vaga para chamar o ChatGPT dentro do prazo de {self.prazo_total:g}s "
+                               f"({self.concorrencia} chamadas simultâneas)")
+
+    def _liberar_vaga(self):
+        with self._lock:
+            self.em_uso -= 1
+        self._vagas.release()
+
+    def criar(self, **parametros):
+        """Equivalente a client.chat.completions.create; com stream=True devolve um iterador acompanhado"""
+        # Um único prazo total para a espera na fila e as tentativas
+        prazo = time.monotonic() + self.prazo_total
+        # Disjuntor antes da fila: com a API indisponível, a resposta local sai sem esperar vaga
+        self._liberar_chamada()
+        try:
+            self._ocupar_vaga(prazo)
+        except BaseException:
+            self._cancelar_chamada()
+            raise
+        try:
+            # O disjuntor pode ter aberto enquanto a chamada aguardava vaga
+            with self._lock:
+                aberto = self.estado == 'aberto'
+            if aberto:
+                self._cancelar_chamada(curto_circuito=True)
+                raise DisjuntorAberto("ChatGPT ficou indisponível enquanto a chamada aguardava vaga")
+            inicio = time.monotonic()
+            resposta = self._tentar(parametros, inicio, prazo)
+        except BaseException:
+            self._liberar_vaga()
+            raise
+        
+        # Em fluxo, a vaga só é devolvida quando a resposta termina de chegar (ou o fluxo é fechado/descartado)
+        if parametros.get('stream'):
+            return FluxoAcompanhado(self, resposta, inicio)
+        self._liberar_vaga()
+        self._registrar(True, inicio)
+        return resposta
+
+    def _tentar(self, parametros, inicio, prazo):
+        """Chamar a API com novas tentativas para erros transitórios, dentro do prazo total"""
+        tentativa = 0
+        while True:
+            restante = prazo - time.monotonic()
+            try:
+                # As novas tentativas ficam a cargo desta classe, não do SDK
+                cliente = self.cliente.with_options(timeout=min(self.timeout, restante), max_retries=0) \
+                    if hasattr(self.cliente, 'with_options') else self.cliente
+                return cliente.chat.completions.create(**parametros)
+            except ERROS_LLM_TRANSITORIOS:
+                tentativa += 1
+                # Jitter completo: espera aleatória entre 0 e base * 2^tentativa, sem passar do prazo total
+                espera = random.uniform(0, self.espera_base * 2 ** tentativa)
+                if tentativa >= self.tentativas or time.monotonic() + espera >= prazo:
+                    self._registrar(False, inicio)
+                    raise
+                with self._lock:
+                    self.retentativas += 1
+                time.sleep(espera)
+            except Exception:
+                self._registrar(False, inicio)
+                raise
+
+    def estatisticas(self):
+        """Contadores, taxa de erro, estado do disjuntor, fila de vagas e histograma de latência"""
+        with self._lock:
+            concluidas = self.sucessos + self.falhas
+            esperas = np.asarray(self.esperas_ms) if self.esperas_ms else np.zeros(1)
+            return {
+                'concorrencia': self.concorrencia,
+                'em_uso': self.em_uso,
+                'aguardando': self.aguardando,
+                'desistencias': self.desistencias,
+                'espera_media_ms': float(esperas.mean()),
+                'espera_p95_ms': float(np.percentile(esperas, 95)),
+                'espera_max_ms': float(esperas.max()),
+                'estado': self.estado,
+                'falhas_seguidas': self.falhas_seguidas,
+                'reabre_em_s': max(0.0, self._aberto_ate - time.monotonic()) if self.estado == 'aberto' else 0.0,
+                'chamadas': self.chamadas,
+                'sucessos': self.sucessos,
+                'falhas': self.falhas,
+                'taxa_erro': self.falhas / concluidas if concluidas else 0.0,
+                'retentativas': self.retentativas,
+                'curto_circuitos': self.curto_circuitos,
+                'histograma': dict(zip(self.FAIXAS_LATENCIA_MS, self.histograma))
+            }
+
+class ChamadasUnificadas:
+    """Single-flight: pedidos idênticos simultâneos, de qualquer sessão, compartilham uma única chamada"""
+
+    def __init__(self, intervalo=LLM_STREAMING_INTERVALO):
+        self.intervalo = intervalo
+        self._voos = {}
+        self._lock = threading.Lock()
+        self.pedidos = 0
+        self.unificados = 0
+
+    def executar(self, chave, funcao, ao_receber=None):
+        """Executar funcao(publicar) uma vez por chave em andamento; os demais pedidos recebem o mesmo resultado
+
+        Quem espera também recebe, por ao_receber, o texto parcial que a chamada em andamento publicar.
+        Se a chamada em andamento for abortada sem resultado nem erro, quem esperava tenta de novo.
+        """
+        with self._lock:
+            self.pedidos += 1
+        unificado = False
+        while True:
+            with self._lock:
+                voo = self._voos.get(chave)
+                lider = voo is None
+                if lider:
+                    voo = self._voos[chave] = {
+                        'situacao': 'andamento', 'parcial': None, 'resultado': None, 'erro': None,
+                        'concluido': threading.Event()
+                    }
+                elif not unificado:
+                    unificado = True
+                    self.unificados += 1
+            
+            if lider:
+                return self._liderar(chave, voo, funcao, ao_receber)
+            
+            exibido = None
+            while not voo['concluido'].wait(self.intervalo):
+                if ao_receber is not None and voo['parcial'] is not None and voo['parcial'] != exibido:
+                    exibido = voo['parcial']
+                    ao_receber(exibido)
+            if voo['situacao'] == 'concluido':
+                return voo['resultado']
+            if voo['situacao'] == 'erro':
+                raise voo['erro']
+            # 'abortado': o líder foi interrompido (rerun/parada da sessão dele); a próxima volta assume a chamada
+
+    def _liderar(self, chave, voo, funcao, ao_receber):
+        """Executar a chamada compartilhada; interrupções da interface de quem lidera não a cancelam"""
+        interrupcoes = []
+        
+        def publicar(parcial):
+            voo['parcial'] = parcial
+            if ao_receber is None or interrupcoes:
+                return
+            try:
+                ao_receber(parcial)
+            except BaseException as e:
+                # Ex.: RerunException da sessão líder ao atualizar o balão; repassada só ao final
+                interrupcoes.append(e)
+        
+        try:
+            voo['resultado'] = funcao(publicar)
+            voo['situacao'] = 'concluido'
+        except Exception as e:
+            voo['erro'] = e
+            voo['situacao'] = 'erro'
+            raise
+        except BaseException:
+            voo['situacao'] = 'abortado'
+            raise
+        finally:
+            with self._lock:
+                del self._voos[chave]
+            voo['concluido'].set()
+        
+        if interrupcoes:
+            raise interrupcoes[0]
+        return voo['resultado']
+
+    def estatisticas(self):
+        """Pedidos recebidos, quantos aproveitaram uma chamada em andamento e chamadas em andamento"""
+        with self._lock:
+            return {
+                'pedidos': self.pedidos,
+                'unificados': self.unificados,
+                'em_andamento': len(self._voos)
+            }
+
+class CacheTextoPDF:
+    """Texto extraído de PDFs, por hash do conteúdo: memória (LRU) e banco, gravado página a página"""
+
+    def __init__(self, repositorio, limite_memoria_bytes, limite_disco_bytes, paginas_por_lote=20):
+        self.repositorio = repositorio
+        self.memoria = CacheResultados(limite_memoria_bytes)
+        self.limite_disco_bytes = limite_disco_bytes
+        self.paginas_por_lote = paginas_por_lote
+        self._unificadas = ChamadasUnificadas()
+        self._lock = threading.Lock()
+        self.acertos_disco = 0
+        self.extracoes = 0
+        self.retomadas = 0
+        self.paginas_extraidas = 0
+
+    def _contar(self, contador, quantidade=1):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + quantidade)
+
+    def extrair(self, conteudo, nome=None, ao_progredir=None):
+        """Texto do PDF; cada documento é lido uma única vez, mesmo com envios simultâneos de várias sessões"""
+        chave = hashlib.sha256(conteudo).hexdigest()
+        encontrado, texto = self.memoria.obter(chave)
+        if encontrado:
+            return chave, texto
+        
+        publicar = (lambda progresso: ao_progredir(*progresso)) if ao_progredir is not None else None
+        # Uma extração compartilhada que terminar sem texto conta como falha: extrai de novo, nunca guarda None
+        texto = None
+        while texto is None:
+            texto = self._unificadas.executar(
+                chave, lambda progredir: self._extrair(chave, conteudo, nome, progredir), publicar
+            )
+        self.memoria.guardar(chave, texto)
+        return chave, texto
+
+    def _extrair(self, chave, conteudo, nome, progredir):
+        """Ler do banco as páginas já extraídas e extrair só as que faltam, gravando a cada lote"""
+        agora = time.time()
+        with self.repositorio.conexao() as conn:
+            documento = conn.execute('SELECT paginas, extraidas FROM pdf_documentos WHERE hash = ?', (chave,)).fetchone()
+            if documento is not None:
+                conn.execute('UPDATE pdf_documentos SET acessado_em = ? WHERE hash = ?', (agora, chave))
+                # Páginas já gravadas (todas, se o documento estiver completo)
+                textos = [texto for (texto,) in conn.execute(
+                    'SELECT texto FROM pdf_paginas WHERE hash = ? AND pagina < ? ORDER BY pagina', (chave, documento[1])
+                )]
+            else:
+                textos = []
+        
+        if documento is None or documento[1] < documento[0]:
+            leitor = PyPDF2.PdfReader(io.BytesIO(conteudo))
+            total = len(leitor.pages)
+            inicio = 0 if documento is None else documento[1]
+            self._contar('extracoes')
+            if inicio:
+                # Extração interrompida antes (erro, queda do processo): continua de onde parou
+                self._contar('retomadas')
+            if documento is None:
+                with self.repositorio.conexao() as conn:
+                    conn.execute('''
+                        INSERT OR REPLACE INTO pdf_documentos (hash, nome, tamanho, paginas, extraidas, tamanho_texto, criado_em, acessado_em)
+                        VALUES (?, ?, ?, ?, 0, 0, ?, ?)
+                    ''', (chave, nome, len(conteudo), total, agora, agora))
+            
+            for lote_inicio in range(inicio, total, self.paginas_por_lote):
+                lote = [
+                    (chave, pagina, leitor.pages[pagina].extract_text() or '')
+                    for pagina in range(lote_inicio, min(lote_inicio + self.paginas_por_lote, total))
+                ]
+                with self.repositorio.conexao() as conn:
+                    conn.executemany('INSERT OR REPLACE INTO pdf_paginas (hash, pagina, texto) VALUES (?, ?, ?)', lote)
+                    conn.execute('''
+                        UPDATE pdf_documentos SET extraidas = ?, tamanho_texto = tamanho_texto + ? WHERE hash = ?
+                    ''', (lote[-1][1] + 1, sum(len(texto) for _, _, texto in lote), chave))
+                textos.extend(texto for _, _, texto in lote)
+                self._contar('paginas_extraidas', len(lote))
+                if progredir is not None:
+                    progredir((lote[-1][1] + 1, total))
+            # O documento recém-extraído nunca é podado, mesmo que sozinho passe do limite
+            self._podar_disco(preservar=chave)
+        else:
+            self._contar('acertos_disco')
+        
+        return ''.join(textos)
+
+    def _podar_disco(self, preservar=None):
+        """Remover os documentos menos acessados até o texto guardado caber no limite"""
+        with self.repositorio.conexao() as conn:
+            excedentes = [linha[0] for linha in conn.execute('''
+                SELECT hash FROM (
+                    SELECT hash, SUM(tamanho_texto) OVER (ORDER BY acessado_em DESC, hash) AS acumulado
+                    FROM pdf_documentos
+                ) WHERE acumulado > ? AND hash IS NOT ?
+            ''', (self.limite_disco_bytes, preservar))]
+            for chave in excedentes:
+                conn.execute('DELETE FROM pdf_paginas WHERE hash = ?', (chave,))
+                conn.execute('DELETE FROM pdf_documentos WHERE hash = ?', (chave,))
+
+    def estatisticas(self):
+        """Acertos em memória e no banco, extrações e ocupação"""
+        with self.repositorio.conexao() as conn:
+            documentos, tamanho = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(tamanho_texto), 0) FROM pdf_documentos'
+            ).fetchone()
+        memoria = self.memoria.estatisticas()
+        return {
+            'acertos_memoria': memoria['acertos'],
+            'acertos_disco': self.acertos_disco,
+            'extracoes': self.extracoes,
+            'retomadas': self.retomadas,
+            'paginas_extraidas': self.paginas_extraidas,
+            'documentos': documentos,
+            'mb_disco': tamanho / 1024 / 1024,
+            'mb_memoria': memoria['mb_usados']
+        }
+
+def _valor_chave(valor):
+    """Argumento utilizável em chave de cache: listas viram tuplas e conjuntos, tuplas ordenadas"""
+    if isinstance(valor, (list, tuple)):
+        return tuple(_valor_chave(item) for item in valor)
+    if isinstance(valor, (set, frozenset)):
+        return tuple(sorted((_valor_chave(item) for item in valor), key=repr))
+    return valor
+
+def consulta_em_cache(metodo):
+    """Servir o resultado do cache do ProcessMindDB quando método, parâmetros e versão dos dados coincidem"""
+    assinatura = inspect.signature(metodo)
+    
+    @functools.wraps(metodo)
+    def envoltorio(self, *args, **kwargs):
+        if self.cache is None:
+            return metodo(self, *args, **kwargs)
+        
+        # Parâmetros normalizados: chamadas posicionais, nomeadas e com padrões geram a mesma chave
+        parametros = assinatura.bind(self, *args, **kwargs)
+        parametros.apply_defaults()
+        argumentos = tuple(_valor_chave(valor) for valor in parametros.arguments.values())[1:]
+        chave = (metodo.__name__, argumentos, self.versao_dados())
+        
+        encontrado, valor = self.cache.obter(chave)
+        if not encontrado:
+            valor = metodo(self, *args, **kwargs)
+            self.cache.guardar(chave, valor)
+        # Cópia: os módulos acrescentam colunas aos DataFrames recebidos
+        return valor.copy() if isinstance(valor, pd.DataFrame) else valor
+    
+    return envoltorio
+
+# Grade espacial e quadros do heatmap (usados também pelas migrações)
+def distancia_haversine_km(lat1, lon1, lat2, lon2):
+    """Distância de grande círculo em km (vetorizada; aceita escalares e arrays com broadcast)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(valor, dtype=float)) for valor in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def coordenadas_esfera(lat, lon):
+    """Pontos (x, y, z) na esfera unitária: a distância euclidiana cresce junto com a de grande círculo"""
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def vizinhos_mais_proximos(origem_lat, origem_lon, destino_lat, destino_lon, k=1):
+    """k destinos mais próximos de cada origem: (distâncias em km, índices nos destinos), ambos (n, k)"""
+    origem_lat, origem_lon = np.asarray(origem_lat, dtype=float), np.asarray(origem_lon, dtype=float)
+    destino_lat, destino_lon = np.asarray(destino_lat, dtype=float), np.asarray(destino_lon, dtype=float)
+    n, k = len(origem_lat), min(k, len(destino_lat))
+    if n == 0 or k == 0:
+        return np.empty((n, 0)), np.empty((n, 0), dtype=np.int64)
+    
+    if SCIPY_DISPONIVEL:
+        # KD-tree sobre a esfera unitária; a corda é convertida de volta em arco
+        cordas, indices = cKDTree(coordenadas_esfera(destino_lat, destino_lon)).query(
+            coordenadas_esfera(origem_lat, origem_lon), k=k
+        )
+        cordas, indices = np.reshape(cordas, (n, k)), np.reshape(indices, (n, k))
+        return 2 * RAIO_TERRA_KM * np.arcsin(np.clip(cordas / 2, 0.0, 1.0)), indices
+    
+    # Matriz de distâncias por blocos de origens (~2 milhões de pares por bloco)
+    distancias, indices = np.empty((n, k)), np.empty((n, k), dtype=np.int64)
+    bloco = max(1, 2_000_000 // len(destino_lat))
+    for inicio in range(0, n, bloco):
+        fatia = slice(inicio, inicio + bloco)
+        matriz = distancia_haversine_km(origem_lat[fatia, None], origem_lon[fatia, None], destino_lat, destino_lon)
+        proximos = np.argpartition(matriz, k - 1, axis=1)[:, :k]
+        parcial = np.take_along_axis(matriz, proximos, axis=1)
+        ordem = np.argsort(parcial, axis=1)
+        indices[fatia] = np.take_along_axis(proximos, ordem, axis=1)
+        distancias[fatia] = np.take_along_axis(parcial, ordem, axis=1)
+    return distancias, indices
+
+def calcular_cobertura(df_distancias, raios_km=RAIOS_COBERTURA_KM):
+    """Quantos pontos de origem têm o destino mais próximo a até cada raio (e o percentual)"""
+    mais_proximo = df_distancias.loc[df_distancias['ordem'] == 1, 'distancia_km'].to_numpy(dtype=float)
+    cobertos = [int((mais_proximo <= raio).sum()) for raio in raios_km]
+    return pd.DataFrame({
+        'raio_km': raios_km,
+        'cobertos': cobertos,
+        'percentual': [100.0 * c / len(mais_proximo) if len(mais_proximo) else 0.0 for c in cobertos]
+    })
+
+def tamanho_celula_graus(tamanho_celula_m, lat_referencia):
+    """Lados (lat, lon) em graus de uma célula quadrada de tamanho_celula_m metros na latitude dada"""
+    tamanho_lat = tamanho_celula_m / METROS_POR_GRAU
+    tamanho_lon = tamanho_celula_m / (METROS_POR_GRAU * np.maximum(np.cos(np.radians(lat_referencia)), 0.01))
+    return tamanho_lat, tamanho_lon
+
+def celulas_para_coordenadas(celula_lat, celula_lon, peso, tamanho_lat, tamanho_lon):
+    """DataFrame com o centro de cada célula e seu peso"""
+    return pd.DataFrame({
+        'latitude': (celula_lat + 0.5) * tamanho_lat - 90.0,
+        'longitude': (celula_lon + 0.5) * tamanho_lon - 180.0,
+        'peso': peso
+    })
+
+def codificar_quadro(celulas):
+    """Matriz int32 [célula_lat, célula_lon, contagem por tipo...] comprimida com zlib"""
+    return zlib.compress(np.ascontiguousarray(celulas, dtype=np.int32).tobytes())
+
+def decodificar_quadro(dados):
+    """Inverso de codificar_quadro"""
+    return np.frombuffer(zlib.decompress(dados), dtype=np.int32).reshape(-1, 2 + len(TIPOS_CRIME))
+
+def recalcular_quadros_heatmap(cursor, municipio_id=None):
+    """Recalcular os quadros dos meses pendentes (de todos os municípios ou de um); retorna quantos meses"""
+    filtro, parametros = ('AND p.municipio_id = ?', (municipio_id,)) if municipio_id is not None else ('', ())
+    pendentes_filtro = f'SELECT p.municipio_id, p.ano, p.mes FROM quadros_heatmap_pendentes p WHERE 1 = 1 {filtro}'
+    pendentes = cursor.execute(f'SELECT COUNT(*) FROM ({pendentes_filtro})', parametros).fetchone()[0]
+    if not pendentes:
+        return 0
+    
+    # Todas as ocorrências pendentes de uma vez; células e somas vetorizadas no pandas
+    df = pd.read_sql_query(CONSULTA_QUADROS_PENDENTES.format(filtro=filtro), cursor.connection, params=parametros)
+    tamanho_lat, tamanho_lon = tamanho_celula_graus(HEATMAP_QUADRO_CELULA_M, df['lat_referencia'].to_numpy())
+    df['celula_lat'] = ((df['latitude'].to_numpy() + 90.0) // tamanho_lat).astype(np.int64)
+    df['celula_lon'] = ((df['longitude'].to_numpy() + 180.0) // tamanho_lon).astype(np.int64)
+    df['tamanho_lon'] = tamanho_lon
+    agregado = (df.groupby(['municipio_id', 'ano', 'mes', 'celula_lat', 'celula_lon'], sort=True)
+                  .agg(**{coluna: (coluna, 'sum') for coluna in TIPOS_CRIME}, tamanho_lon=('tamanho_lon', 'first'))
+                  .reset_index())
+    
+    # Um quadro por (município, ano, mês): fatias contíguas do resultado ordenado
+    periodos = agregado[['municipio_id', 'ano', 'mes']].to_numpy()
+    celulas = agregado[['celula_lat', 'celula_lon', *TIPOS_CRIME]].to_numpy()
+    inicios = np.flatnonzero(np.r_[True, (periodos[1:] != periodos[:-1]).any(axis=1)])[:len(periodos)]
+    fins = np.r_[inicios[1:], len(agregado)]
+    quadros = [
+        (int(periodos[inicio, 0]), int(periodos[inicio, 1]), int(periodos[inicio, 2]), tamanho_lat,
+         float(agregado['tamanho_lon'].iat[inicio]), int(fim - inicio), codificar_quadro(celulas[inicio:fim]))
+        for inicio, fim in zip(inicios, fins)
+    ]
+    
+    # Meses pendentes sem ocorrências ficam sem quadro
+    cursor.execute(f'DELETE FROM quadros_heatmap WHERE (municipio_id, ano, mes) IN ({pendentes_filtro})', parametros)
+    cursor.executemany('''
+        INSERT INTO quadros_heatmap (municipio_id, ano, mes, tamanho_lat, tamanho_lon, celulas, dados)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', quadros)
+    cursor.execute(f'DELETE FROM quadros_heatmap_pendentes WHERE (municipio_id, ano, mes) IN ({pendentes_filtro})',
+                   parametros)
+    return pendentes
 
 class ProcessMindDB:
-    def __init__(self):
-        self.db_path = 'process_mind_melhorado.db'
+    def __init__(self, db_path=None, tamanho_pool=DB_POOL_TAMANHO, perfil_pragma=None, cache_mb=CACHE_RESULTADOS_MB):
+        self.db_path = db_path or DB_PATH
+        self.perfil_pragma = carregar_perfil_pragma(perfil_pragma)
+        self.pool = PoolConexoes(self.db_path, tamanho=tamanho_pool, pragmas=self.perfil_pragma)
+        self.cache = CacheResultados(int(cache_mb * 1024 * 1024)) if cache_mb > 0 else None
+        self._versao_dados = None
+        self._versao_lida_em = 0.0
         self.init_database()
+
+    @contextmanager
+    def conexao(self):
+        """Conexão do pool com commit ao final (ou rollback em caso de erro)"""
+        with self.pool.conexao() as conn:
+            alteracoes = conn.total_changes
+            with conn:
+                yield conn
+            # Só depois do commit: a versão relida já inclui os incrementos feitos pelos triggers
+            if conn.total_changes != alteracoes:
+                self._versao_dados = None
+
+    def versao_dados(self):
+        """Versão atual dos dados (relida do banco no máximo a cada CACHE_VERSAO_TTL segundos)"""
+        agora = time.monotonic()
+        if self._versao_dados is None or agora - self._versao_lida_em > CACHE_VERSAO_TTL:
+            with self.conexao() as conn:
+                linha = conn.execute("SELECT valor FROM metadados WHERE chave = 'versao_dados'").fetchone()
+            self._versao_dados = linha[0] if linha else 0
+            self._versao_lida_em = agora
+        return self._versao_dados
     
     def init_database(self):
-        """Inicializar banco de dados com todas as tabelas"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """Inicializar banco de dados aplicando as migrações pendentes (uma vez por processo)"""
+        chave = os.path.abspath(self.db_path)
+        with _LOCK_MIGRACOES:
+            if chave in _BANCOS_MIGRADOS:
+                return
+            self.aplicar_migracoes()
+            _BANCOS_MIGRADOS.add(chave)
+    
+    def versao_esquema(self):
+        """Versão do esquema registrada em PRAGMA user_version"""
+        with self.conexao() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+    
+    def aplicar_migracoes(self):
+        """Aplicar, em ordem e cada uma em sua transação, as migrações ainda não registradas"""
+        aplicadas = []
+        with self.pool.conexao() as conn:
+            for versao, descricao, metodo in MIGRACOES:
+                # BEGIN IMMEDIATE serializa migrações concorrentes de outros processos
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if conn.execute('PRAGMA user_version').fetchone()[0] < versao:
+                        getattr(self, metodo)(conn.cursor())
+                        conn.execute(f'PRAGMA user_version = {versao}')
+                        aplicadas.append((versao, descricao))
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+        return aplicadas
+
+    def criar_tabelas(self, cursor):
+        """Criar todas as tabelas do sistema"""
         # Tabela de municípios com coordenadas
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS municipios (
@@ -342,18 +1668,212 @@ class ProcessMindDB:
                 FOREIGN KEY (municipio_id) REFERENCES municipios (id)
             )
         ''')
+    
+    def criar_indices(self, cursor):
+        """Criar os índices usados pelas consultas de leitura"""
+        for sql in INDICES:
+            cursor.execute(sql)
+    
+    def criar_chave_dados_saude(self, cursor):
+        """Um registro por município, mês e tipo de dado (permite upsert de dados reais)"""
+        cursor.execute('''
+            DELETE FROM dados_saude WHERE id NOT IN (
+                SELECT MAX(id) FROM dados_saude GROUP BY municipio_id, ano, mes, tipo_dado
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_dados_saude_municipio_periodo_tipo
+            ON dados_saude (municipio_id, ano, mes, tipo_dado)
+        ''')
+    
+    def criar_chaves_cadastros(self, cursor):
+        """CNES e código INEP únicos, removendo duplicatas de cargas anteriores"""
+        for tabela, chave in (('estabelecimentos_saude', 'cnes'), ('escolas', 'codigo_inep')):
+            cursor.execute(f'''
+                DELETE FROM {tabela} WHERE {chave} IS NOT NULL AND id NOT IN (
+                    SELECT MAX(id) FROM {tabela} WHERE {chave} IS NOT NULL GROUP BY {chave}
+                )
+            ''')
+            cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{tabela}_{chave} ON {tabela} ({chave})')
+    
+    def criar_rollups(self, cursor):
+        """Criar as tabelas de rollup, os triggers que as mantêm e preenchê-las com os dados atuais"""
+        for fato, spec in ROLLUPS.items():
+            metricas = spec['metricas']
+            for tabela, chave in spec['tabelas'].items():
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {tabela} (
+                        {', '.join(chave)},
+                        {', '.join(f'{m} INTEGER NOT NULL DEFAULT 0' for m in metricas)},
+                        registros INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY ({', '.join(chave)})
+                    ) WITHOUT ROWID
+                ''')
+                cursor.execute(f'''
+                    INSERT OR REPLACE INTO {tabela} ({', '.join(chave)}, {', '.join(metricas)}, registros)
+                    SELECT {', '.join(chave)}, {', '.join(f'COALESCE(SUM({m}), 0)' for m in metricas)}, COUNT(*)
+                    FROM {fato} GROUP BY {', '.join(chave)}
+                ''')
+                
+                def aplicar(linha, sinal):
+                    """Upsert que soma (ou subtrai) as métricas da linha do fato no rollup"""
+                    return f'''
+                        INSERT INTO {tabela} ({', '.join(chave)}, {', '.join(metricas)}, registros)
+                        VALUES ({', '.join(f'{linha}.{c}' for c in chave)},
+                                {', '.join(f'{sinal}COALESCE({linha}.{m}, 0)' for m in metricas)}, {sinal}1)
+                        ON CONFLICT ({', '.join(chave)}) DO UPDATE SET
+                            {', '.join(f'{m} = {m} + excluded.{m}' for m in metricas)},
+                            registros = registros + excluded.registros;
+                    '''
+                
+                limpar = f'''
+                    DELETE FROM {tabela} WHERE registros <= 0 AND {' AND '.join(f'{c} IS OLD.{c}' for c in chave)};
+                '''
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_{tabela}_insert AFTER INSERT ON {fato}
+                    BEGIN {aplicar('NEW', '')} END
+                ''')
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_{tabela}_delete AFTER DELETE ON {fato}
+                    BEGIN {aplicar('OLD', '-')} {limpar} END
+                ''')
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_{tabela}_update AFTER UPDATE OF {', '.join(chave + metricas)} ON {fato}
+                    BEGIN {aplicar('OLD', '-')} {aplicar('NEW', '')} {limpar} END
+                ''')
+    
+    def criar_metadados(self, cursor):
+        """Tabela de metadados com a versão dos dados usada pelos caches"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS metadados (
+                chave TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO metadados (chave, valor) VALUES ('versao_dados', 0)")
+    
+    def criar_triggers_versao_dados(self, cursor):
+        """Triggers que incrementam a versão dos dados a cada escrita nas tabelas lidas pelas consultas em cache"""
+        incrementar = "UPDATE metadados SET valor = valor + 1 WHERE chave = 'versao_dados';"
+        for tabela in TABELAS_VERSIONADAS:
+            for evento in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.lower()} AFTER {evento} ON {tabela}
+                    BEGIN {incrementar} END
+                ''')
+    
+    def criar_quadros_heatmap(self, cursor):
+        """Quadros mensais do heatmap animado, fila de meses a recalcular e triggers que a alimentam"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS quadros_heatmap (
+                municipio_id INTEGER NOT NULL,
+                ano INTEGER NOT NULL,
+                mes INTEGER NOT NULL,
+                tamanho_lat REAL NOT NULL,
+                tamanho_lon REAL NOT NULL,
+                celulas INTEGER NOT NULL,
+                dados BLOB NOT NULL,
+                PRIMARY KEY (municipio_id, ano, mes)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS quadros_heatmap_pendentes (
+                municipio_id INTEGER NOT NULL,
+                ano INTEGER NOT NULL,
+                mes INTEGER NOT NULL,
+                PRIMARY KEY (municipio_id, ano, mes)
+            ) WITHOUT ROWID
+        ''')
         
-        conn.commit()
-        conn.close()
+        # Os triggers só marcam o mês; a agregação roda em lote nos carregadores
+        colunas = ['municipio_id', 'ano', 'mes', 'latitude', 'longitude', *TIPOS_CRIME]
+        for evento, linhas in (('INSERT', ['NEW']), ('DELETE', ['OLD']), ('UPDATE', ['OLD', 'NEW'])):
+            alvo = f"UPDATE OF {', '.join(colunas)}" if evento == 'UPDATE' else evento
+            marcar = ' '.join(
+                f'INSERT OR IGNORE INTO quadros_heatmap_pendentes VALUES ({linha}.municipio_id, {linha}.ano, {linha}.mes);'
+                for linha in linhas
+            )
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_quadros_heatmap_{evento.lower()} AFTER {alvo} ON dados_seguranca
+                BEGIN {marcar} END
+            ''')
         
-        # Inserir dados iniciais se não existirem
-        self.inserir_dados_iniciais()
+        cursor.execute('''
+            INSERT OR IGNORE INTO quadros_heatmap_pendentes
+            SELECT DISTINCT municipio_id, ano, mes FROM dados_seguranca
+        ''')
+        recalcular_quadros_heatmap(cursor)
     
-    def inserir_dados_iniciais(self):
+    def criar_indices_espaciais(self, cursor):
+        """Criar as tabelas R*Tree, preenchê-las e manter a sincronia com a tabela base por triggers"""
+        for tabela, rtree in INDICES_ESPACIAIS.items():
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO {rtree} (id, min_lat, max_lat, min_lon, max_lon)
+                SELECT id, latitude, latitude, longitude, longitude FROM {tabela}
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            ''')
+            
+            inserir = f'''
+                INSERT OR REPLACE INTO {rtree} (id, min_lat, max_lat, min_lon, max_lon)
+                SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+                WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+            '''
+            remover = f'DELETE FROM {rtree} WHERE id = OLD.id;'
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{rtree}_insert AFTER INSERT ON {tabela}
+                BEGIN {inserir} END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{rtree}_delete AFTER DELETE ON {tabela}
+                BEGIN {remover} END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{rtree}_update AFTER UPDATE OF id, latitude, longitude ON {tabela}
+                BEGIN {remover} {inserir} END
+            ''')
+    
+    def criar_cache_respostas(self, cursor):
+        """Tabela de respostas do ChatGPT em cache, com índice para descartar as menos acessadas"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_respostas (
+                chave TEXT PRIMARY KEY,
+                municipio_id INTEGER,
+                pergunta TEXT NOT NULL,
+                resposta TEXT NOT NULL,
+                tamanho INTEGER NOT NULL,
+                criado_em REAL NOT NULL,
+                acessado_em REAL NOT NULL,
+                acertos INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cache_respostas_acesso ON cache_respostas (acessado_em)')
+    
+    def criar_cache_pdfs(self, cursor):
+        """Documentos PDF já lidos (por hash do conteúdo) e o texto de cada página"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pdf_documentos (
+                hash TEXT PRIMARY KEY,
+                nome TEXT,
+                tamanho INTEGER NOT NULL,
+                paginas INTEGER NOT NULL,
+                extraidas INTEGER NOT NULL DEFAULT 0,
+                tamanho_texto INTEGER NOT NULL DEFAULT 0,
+                criado_em REAL NOT NULL,
+                acessado_em REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pdf_paginas (
+                hash TEXT NOT NULL,
+                pagina INTEGER NOT NULL,
+                texto TEXT NOT NULL,
+                PRIMARY KEY (hash, pagina)
+            ) WITHOUT ROWID
+        ''')
+    
+    def inserir_dados_iniciais(self, cursor):
         """Inserir dados iniciais dos municípios e usuários"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # Verificar se já existem municípios
         cursor.execute('SELECT COUNT(*) FROM municipios')
         if cursor.fetchone()[0] == 0:
@@ -364,12 +1884,12 @@ class ProcessMindDB:
                 ('Santa Quitéria', '211100', 'MA', 38159, 2735.8, 13.9, 12890, 0.587, -3.5333, -43.3500),
                 ('São Bernardo', '211150', 'MA', 26604, 1049.1, 25.4, 11234, 0.542, -3.2833, -44.8167)
             ]
-            
+        
             cursor.executemany('''
                 INSERT INTO municipios (nome, codigo_ibge, uf, populacao, area_km2, densidade_demografica, pib_per_capita, idhm, latitude, longitude)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', municipios)
-            
+        
             # Inserir usuários
             usuarios = [
                 (1, 'admin@guaraciaba.ce.gov.br', 'Administrador Guaraciaba'),
@@ -377,14 +1897,14 @@ class ProcessMindDB:
                 (3, 'admin@santaquiteria.ma.gov.br', 'Administrador Santa Quitéria'),
                 (4, 'admin@saobernardo.ma.gov.br', 'Administrador São Bernardo')
             ]
-            
+        
             for municipio_id, email, nome in usuarios:
                 senha_hash = hashlib.sha256(f"{email.split('@')[0]}123".encode()).hexdigest()
                 cursor.execute('''
                     INSERT INTO usuarios (municipio_id, email, senha_hash, nome)
                     VALUES (?, ?, ?, ?)
                 ''', (municipio_id, email, senha_hash, nome))
-            
+        
             # Inserir dados simulados
             self.inserir_dados_saude_simulados(cursor)
             self.inserir_estabelecimentos_saude_reais(cursor)
@@ -393,9 +1913,6 @@ class ProcessMindDB:
             self.inserir_dados_seguranca_simulados(cursor)
             self.inserir_unidades_seguranca_simuladas(cursor)
             self.inserir_dados_demograficos(cursor)
-        
-        conn.commit()
-        conn.close()
     
     def inserir_dados_saude_simulados(self, cursor):
         """Inserir dados de saúde simulados baseados em padrões reais"""
@@ -654,19 +2171,13 @@ class ProcessMindDB:
     
     def autenticar_usuario(self, email, senha):
         """Autenticar usuário"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         senha_hash = hashlib.sha256(senha.encode()).hexdigest()
-        cursor.execute('''
-            SELECT u.id, u.municipio_id, u.nome, m.nome, m.uf, m.latitude, m.longitude 
-            FROM usuarios u 
-            JOIN municipios m ON u.municipio_id = m.id 
-            WHERE u.email = ? AND u.senha_hash = ? AND u.ativo = 1
-        ''', (email, senha_hash))
         
-        resultado = cursor.fetchone()
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(CONSULTAS['autenticar_usuario'], (email, senha_hash))
+            
+            resultado = cursor.fetchone()
         
         if resultado:
             return {
@@ -680,116 +2191,239 @@ class ProcessMindDB:
             }
         return None
     
+    @consulta_em_cache
     def obter_dados_saude(self, municipio_id, ano_inicio=2023, ano_fim=2025):
         """Obter dados de saúde do município"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
-            SELECT * FROM dados_saude 
-            WHERE municipio_id = ? AND ano BETWEEN ? AND ?
-            ORDER BY ano, mes
-        ''', conn, params=(municipio_id, ano_inicio, ano_fim))
-        
-        conn.close()
-        return df
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_dados_saude'], conn, params=(municipio_id, ano_inicio, ano_fim))
     
+    @consulta_em_cache
     def obter_estabelecimentos_saude(self, municipio_id):
         """Obter estabelecimentos de saúde do município"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
-            SELECT * FROM estabelecimentos_saude 
-            WHERE municipio_id = ?
-            ORDER BY nome_fantasia
-        ''', conn, params=(municipio_id,))
-        
-        conn.close()
-        return df
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_estabelecimentos_saude'], conn, params=(municipio_id,))
     
+    @consulta_em_cache
     def obter_dados_educacao(self, municipio_id):
         """Obter dados de educação do município"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
-            SELECT * FROM dados_educacao 
-            WHERE municipio_id = ?
-            ORDER BY ano DESC
-        ''', conn, params=(municipio_id,))
-        
-        conn.close()
-        return df
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_dados_educacao'], conn, params=(municipio_id,))
     
+    @consulta_em_cache
     def obter_escolas(self, municipio_id):
         """Obter escolas do município"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
-            SELECT * FROM escolas 
-            WHERE municipio_id = ?
-            ORDER BY nome
-        ''', conn, params=(municipio_id,))
-        
-        conn.close()
-        return df
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_escolas'], conn, params=(municipio_id,))
     
+    @consulta_em_cache
     def obter_dados_seguranca(self, municipio_id, ano_inicio=2023, ano_fim=2025):
         """Obter dados de segurança do município"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
-            SELECT * FROM dados_seguranca 
-            WHERE municipio_id = ? AND ano BETWEEN ? AND ?
-            ORDER BY ano, mes, regiao
-        ''', conn, params=(municipio_id, ano_inicio, ano_fim))
-        
-        conn.close()
-        return df
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_dados_seguranca'], conn, params=(municipio_id, ano_inicio, ano_fim))
     
+    @consulta_em_cache
     def obter_unidades_seguranca(self, municipio_id):
         """Obter unidades de segurança do município"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
-            SELECT * FROM unidades_seguranca 
-            WHERE municipio_id = ?
-            ORDER BY nome
-        ''', conn, params=(municipio_id,))
-        
-        conn.close()
-        return df
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_unidades_seguranca'], conn, params=(municipio_id,))
     
+    @consulta_em_cache
     def obter_dados_demograficos(self, municipio_id):
         """Obter dados demográficos do município"""
-        conn = sqlite3.connect(self.db_path)
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_dados_demograficos'], conn, params=(municipio_id,))
+    
+    @consulta_em_cache
+    def obter_kpis_saude(self, municipio_id, ano_inicio=2023, ano_fim=2025):
+        """Totais de saúde do período (rollup anual)"""
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_kpis_saude'], conn, params=(municipio_id, ano_inicio, ano_fim))
+    
+    @consulta_em_cache
+    def obter_saude_mensal(self, municipio_id, ano_inicio=2023, ano_fim=2025):
+        """Série mensal de saúde do período (rollup mensal)"""
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_saude_mensal'], conn, params=(municipio_id, ano_inicio, ano_fim))
+    
+    @consulta_em_cache
+    def obter_kpis_seguranca(self, municipio_id, ano_inicio=2023, ano_fim=2025):
+        """Totais de ocorrências do período (rollup anual)"""
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_kpis_seguranca'], conn, params=(municipio_id, ano_inicio, ano_fim))
+    
+    @consulta_em_cache
+    def obter_seguranca_mensal(self, municipio_id, ano_inicio=2023, ano_fim=2025):
+        """Ocorrências por mês e região (rollup mensal)"""
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_seguranca_mensal'], conn, params=(municipio_id, ano_inicio, ano_fim))
+    
+    @consulta_em_cache
+    def obter_seguranca_por_regiao(self, municipio_id, ano_inicio=2023, ano_fim=2025):
+        """Ocorrências do período por região (rollup anual)"""
+        with self.conexao() as conn:
+            return pd.read_sql_query(CONSULTAS['obter_seguranca_por_regiao'], conn, params=(municipio_id, ano_inicio, ano_fim))
+    
+    @consulta_em_cache
+    def obter_grade_criminalidade(self, municipio_id, ano_inicio=2023, ano_fim=2025, tamanho_celula_m=500,
+                                  lat_referencia=0.0, tipos=TIPOS_CRIME_PADRAO):
+        """Ocorrências agregadas em células quadradas (só células com peso), calculadas no SQLite"""
+        tamanho_lat, tamanho_lon = tamanho_celula_graus(tamanho_celula_m, lat_referencia)
+        pesos = tuple(int(coluna in tipos) for coluna in TIPOS_CRIME)
+        with self.conexao() as conn:
+            df = pd.read_sql_query(CONSULTA_GRADE_CRIMINALIDADE, conn,
+                                   params=(tamanho_lat, tamanho_lon, *pesos, municipio_id, ano_inicio, ano_fim))
+        return celulas_para_coordenadas(df['celula_lat'].to_numpy(), df['celula_lon'].to_numpy(),
+                                        df['peso'].to_numpy(dtype=float), tamanho_lat, tamanho_lon)
+    
+    def obter_quadros_heatmap(self, municipio_id, ano_inicio=2023, ano_fim=2025):
+        """Quadros mensais pré-calculados do heatmap: [(ano, mes, células, tamanho_lat, tamanho_lon)]"""
+        with self.conexao() as conn:
+            # Escritas que não passaram por um carregador ficam na fila; completar antes de servir
+            if conn.execute('SELECT 1 FROM quadros_heatmap_pendentes WHERE municipio_id = ? LIMIT 1',
+                            (municipio_id,)).fetchone():
+                recalcular_quadros_heatmap(conn.cursor(), municipio_id)
+            linhas = conn.execute('''
+                SELECT ano, mes, tamanho_lat, tamanho_lon, dados FROM quadros_heatmap
+                WHERE municipio_id = ? AND ano BETWEEN ? AND ?
+                ORDER BY ano, mes
+            ''', (municipio_id, ano_inicio, ano_fim)).fetchall()
+        return [(ano, mes, decodificar_quadro(dados), tamanho_lat, tamanho_lon)
+                for ano, mes, tamanho_lat, tamanho_lon, dados in linhas]
+    
+    @consulta_em_cache
+    def obter_pontos_na_area(self, tabela, min_lat, min_lon, max_lat, max_lon, municipio_id=None):
+        """Registros de uma tabela com coordenadas dentro do retângulo (viewport), pelo índice R*Tree"""
+        if tabela not in INDICES_ESPACIAIS:
+            raise ValueError(f"Tabela sem índice espacial: {tabela} (opções: {', '.join(INDICES_ESPACIAIS)})")
+        filtro, extra = ('AND t.municipio_id = ?', (municipio_id,)) if municipio_id is not None else ('', ())
+        sql = CONSULTA_AREA.format(rtree=INDICES_ESPACIAIS[tabela], tabela=tabela, filtro=filtro)
+        with self.conexao() as conn:
+            return pd.read_sql_query(sql, conn, params=(
+                min_lat, max_lat, min_lon, max_lon, min_lat, max_lat, min_lon, max_lon, *extra
+            ))
+    
+    def obter_pontos_no_raio(self, tabela, latitude, longitude, raio_km, municipio_id=None):
+        """Registros a até raio_km do ponto, com a coluna distancia_km, do mais próximo ao mais distante"""
+        # Retângulo envolvente do círculo pelo R*Tree; a distância exata filtra os cantos
+        delta_lat = np.degrees(raio_km / RAIO_TERRA_KM)
+        delta_lon = delta_lat / max(np.cos(np.radians(latitude)), 0.01)
+        df = self.obter_pontos_na_area(tabela, latitude - delta_lat, longitude - delta_lon,
+                                       latitude + delta_lat, longitude + delta_lon, municipio_id)
+        df['distancia_km'] = distancia_haversine_km(latitude, longitude, df['latitude'].to_numpy(), df['longitude'].to_numpy())
+        return df[df['distancia_km'] <= raio_km].sort_values('distancia_km', kind='stable').reset_index(drop=True)
+    
+    @consulta_em_cache
+    def obter_distancias_mais_proximas(self, municipio_id, origem='escolas', destino='estabelecimentos_saude',
+                                       tipo_destino=None, k=1):
+        """Para cada ponto da origem no município, os k destinos mais próximos (haversine, em km)"""
+        for tabela in (origem, destino):
+            if tabela not in TABELAS_PROXIMIDADE:
+                raise ValueError(f"Tabela sem análise de proximidade: {tabela} (opções: {', '.join(TABELAS_PROXIMIDADE)})")
         
-        df = pd.read_sql_query('''
-            SELECT * FROM dados_demograficos 
-            WHERE municipio_id = ?
-            ORDER BY ano DESC
-        ''', conn, params=(municipio_id,))
+        def pontos(conn, tabela, tipo=None):
+            nome, coluna_tipo = TABELAS_PROXIMIDADE[tabela]
+            filtro, parametros = (f'AND {coluna_tipo} = ?', (municipio_id, tipo)) if tipo else ('', (municipio_id,))
+            return pd.read_sql_query(f'''
+                SELECT id, {nome} AS nome, latitude, longitude FROM {tabela}
+                WHERE municipio_id = ? AND latitude IS NOT NULL AND longitude IS NOT NULL {filtro}
+                ORDER BY id
+            ''', conn, params=parametros)
         
-        conn.close()
-        return df
+        with self.conexao() as conn:
+            df_origem = pontos(conn, origem)
+            df_destino = pontos(conn, destino, tipo_destino)
+        
+        distancias, indices = vizinhos_mais_proximos(df_origem['latitude'], df_origem['longitude'],
+                                                     df_destino['latitude'], df_destino['longitude'], k)
+        if distancias.shape[1] == 0:
+            # Sem destinos: as origens continuam no resultado (contam como não cobertas)
+            return df_origem[['id', 'nome']].assign(ordem=1, destino_id=np.nan, destino_nome=None, distancia_km=np.nan)
+        
+        vizinhos = indices.ravel()
+        return pd.DataFrame({
+            'id': np.repeat(df_origem['id'].to_numpy(), distancias.shape[1]),
+            'nome': np.repeat(df_origem['nome'].to_numpy(), distancias.shape[1]),
+            'ordem': np.tile(np.arange(1, distancias.shape[1] + 1), len(df_origem)),
+            'destino_id': df_destino['id'].to_numpy()[vizinhos],
+            'destino_nome': df_destino['nome'].to_numpy()[vizinhos],
+            'distancia_km': distancias.ravel()
+        })
     
     def salvar_conversa_chat(self, municipio_id, pergunta, resposta, arquivo_pdf=None):
         """Salvar conversa do chatbot"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO chat_conversas (municipio_id, usuario_pergunta, bot_resposta, arquivo_pdf)
-            VALUES (?, ?, ?, ?)
-        ''', (municipio_id, pergunta, resposta, arquivo_pdf))
-        
-        conn.commit()
-        conn.close()
+        with self.conexao() as conn:
+            conn.execute('''
+                INSERT INTO chat_conversas (municipio_id, usuario_pergunta, bot_resposta, arquivo_pdf)
+                VALUES (?, ?, ?, ?)
+            ''', (municipio_id, pergunta, resposta, arquivo_pdf))
+
+def obter_repositorio(db_path=None):
+    """Repositório compartilhado pelo processo (esquema e pool criados uma única vez)"""
+    chave = os.path.abspath(db_path or DB_PATH)
+    repositorio = _REPOSITORIOS.get(chave)
+    if repositorio is None:
+        with _LOCK_REPOSITORIOS:
+            repositorio = _REPOSITORIOS.get(chave)
+            if repositorio is None:
+                repositorio = _REPOSITORIOS[chave] = ProcessMindDB(db_path)
+    return repositorio
 
 # Inicializar banco de dados
 @st.cache_resource
 def init_db():
-    return ProcessMindDB()
+    return obter_repositorio()
+
+@st.cache_resource
+def init_cache_mapas():
+    if MAPA_CACHE_MB <= 0:
+        return None
+    return CacheMapas(int(MAPA_CACHE_MB * 1024 * 1024), MAPA_CACHE_DIR, int(MAPA_CACHE_DISCO_MB * 1024 * 1024))
+
+@st.cache_resource
+def init_cache_respostas():
+    if LLM_CACHE_MB <= 0:
+        return None
+    return CacheRespostasLLM(init_db(), int(LLM_CACHE_MB * 1024 * 1024), LLM_CACHE_VALIDADE_HORAS * 3600)
+
+@st.cache_resource
+def init_cliente_llm():
+    if not OPENAI_DISPONIVEL:
+        return None
+    return ClienteLLMResiliente(client)
 
-db = init_db()
+@st.cache_resource
+def init_chamadas_llm():
+    return ChamadasUnificadas()
+
+@st.cache_resource
+def init_cache_pdfs():
+    return CacheTextoPDF(init_db(), int(PDF_CACHE_MB * 1024 * 1024), int(PDF_CACHE_DISCO_MB * 1024 * 1024))
+
+# Recursos da interface: criados por iniciar_aplicacao() no "streamlit run". Importar o módulo
+# (CLI, testes) não cria o banco padrão nem o diretório de cache dos mapas
+db = cache_mapas = cache_respostas = cliente_llm = chamadas_llm = cache_pdfs = None
+
+def iniciar_aplicacao():
+    """Configurar a página e abrir os recursos compartilhados da interface"""
+    global db, cache_mapas, cache_respostas, cliente_llm, chamadas_llm, cache_pdfs
+    
+    st.set_page_config(
+        page_title="PROCESS MIND - Sistema Integrado",
+        page_icon="🏛️",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    st.markdown(ESTILO_CSS, unsafe_allow_html=True)
+    
+    if RECURSOS_URL:
+        usar_recursos_locais(RECURSOS_URL)
+    
+    db = init_db()
+    cache_mapas = init_cache_mapas()
+    cache_respostas = init_cache_respostas()
+    cliente_llm = init_cliente_llm()
+    chamadas_llm = init_chamadas_llm()
+    cache_pdfs = init_cache_pdfs()
 
 # Funções auxiliares
 def criar_badge(tipo, fonte=None):
@@ -869,7 +2503,53 @@ def chatbot_resposta_simulada(pergunta, contexto_pdf=None, dados_municipio=None)
     else:
         return f"Olá! Sou o assistente do PROCESS MIND para {dados_municipio.get('nome', 'N/A')} - {dados_municipio.get('uf', 'N/A')}. Posso ajudar com informações sobre saúde, educação, segurança e dados demográficos do município. Você também pode enviar documentos PDF para análise."
 
-def criar_mapa_estabelecimentos(df_estabelecimentos, centro_lat, centro_lon):
+def camada_base():
+    """Mapa base: servidor local de tiles (PROCESS_MIND_TILES_URL) ou OpenStreetMap na internet"""
+    if not TILES_URL:
+        return 'OpenStreetMap'
+    # Acima do zoom semeado, o Leaflet amplia os tiles do último nível em vez de pedir tiles inexistentes
+    return folium.TileLayer(TILES_URL, attr=TILES_ATRIBUICAO, max_native_zoom=TILES_ZOOM_MAX, max_zoom=19)
+
+# Marcador montado no navegador a partir de [lat, lon, popup, cor, ícone, tooltip]
+CALLBACK_MARCADOR = """function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({markerColor: row[3], icon: row[4], prefix: 'fa'})
+    });
+    marker.bindPopup(row[2], {maxWidth: 300});
+    marker.bindTooltip(row[5]);
+    return marker;
+}"""
+
+def escapar_campos(df, colunas):
+    """Campos de texto escapados para HTML: nomes e endereços vêm de cadastros importados e vão para popups/tooltips"""
+    df = df.copy()
+    for coluna in colunas:
+        df[coluna] = df[coluna].fillna('').astype(str).map(html.escape)
+    return df
+
+def adicionar_marcadores(m, df, popups, tooltips, cores, icones, limite_marcadores=None):
+    """Adicionar pontos ao mapa: marcadores individuais ou, acima do limite, um cluster montado no navegador"""
+    limite_marcadores = MAPA_LIMITE_MARCADORES if limite_marcadores is None else limite_marcadores
+    pontos = pd.DataFrame({
+        'latitude': df['latitude'], 'longitude': df['longitude'],
+        'popup': popups, 'cor': cores, 'icone': icones, 'tooltip': tooltips
+    }).dropna(subset=['latitude', 'longitude'])
+    
+    if len(pontos) > limite_marcadores:
+        # Um único vetor de dados; o HTML não cresce com um objeto Marker/Popup/Icon por linha
+        FastMarkerCluster(pontos.values.tolist(), callback=CALLBACK_MARCADOR).add_to(m)
+        return m
+    
+    for lat, lon, popup, cor, icone, tooltip in pontos.itertuples(index=False):
+        folium.Marker(
+            location=[lat, lon],
+            popup=folium.Popup(popup, max_width=300),
+            tooltip=tooltip,
+            icon=folium.Icon(color=cor, icon=icone, prefix='fa')
+        ).add_to(m)
+    return m
+
+def criar_mapa_estabelecimentos(df_estabelecimentos, centro_lat, centro_lon, limite_marcadores=None):
     """Criar mapa interativo dos estabelecimentos de saúde"""
     if df_estabelecimentos.empty:
         return None
@@ -878,9 +2558,13 @@ def criar_mapa_estabelecimentos(df_estabelecimentos, centro_lat, centro_lon):
     m = folium.Map(
         location=[centro_lat, centro_lon],
         zoom_start=13,
-        tiles='OpenStreetMap'
+        tiles=camada_base()
     )
     
+    return adicionar_estabelecimentos(m, df_estabelecimentos, limite_marcadores)
+
+def adicionar_estabelecimentos(destino, df_estabelecimentos, limite_marcadores=None):
+    """Marcadores dos estabelecimentos de saúde num mapa ou camada"""
     # Cores por tipo de estabelecimento
     cores = {
         'UBS': 'green',
@@ -896,26 +2580,15 @@ def criar_mapa_estabelecimentos(df_estabelecimentos, centro_lat, centro_lon):
     }
     
     # Adicionar marcadores
-    for _, row in df_estabelecimentos.iterrows():
-        if pd.notna(row['latitude']) and pd.notna(row['longitude']):
-            cor = cores.get(row['tipo_estabelecimento'], 'blue')
-            
-            folium.Marker(
-                location=[row['latitude'], row['longitude']],
-                popup=folium.Popup(f"""
-                    <b>{row['nome_fantasia']}</b><br>
-                    Tipo: {row['tipo_estabelecimento']}<br>
-                    CNES: {row['cnes']}<br>
-                    Gestão: {row['gestao']}<br>
-                    SUS: {'Sim' if row['atende_sus'] else 'Não'}
-                """, max_width=300),
-                tooltip=row['nome_fantasia'],
-                icon=folium.Icon(color=cor, icon='plus', prefix='fa')
-            ).add_to(m)
+    df = escapar_campos(df_estabelecimentos, ['nome_fantasia', 'tipo_estabelecimento', 'cnes', 'gestao'])
+    popups = ('<b>' + df['nome_fantasia'] + '</b><br>Tipo: ' + df['tipo_estabelecimento']
+              + '<br>CNES: ' + df['cnes'] + '<br>Gestão: ' + df['gestao']
+              + '<br>SUS: ' + np.where(df['atende_sus'].astype(bool), 'Sim', 'Não'))
+    cor = df['tipo_estabelecimento'].map(cores).fillna('blue')
     
-    return m
+    return adicionar_marcadores(destino, df, popups, df['nome_fantasia'], cor, 'plus', limite_marcadores)
 
-def criar_mapa_escolas(df_escolas, centro_lat, centro_lon):
+def criar_mapa_escolas(df_escolas, centro_lat, centro_lon, limite_marcadores=None):
     """Criar mapa interativo das escolas"""
     if df_escolas.empty:
         return None
@@ -924,9 +2597,13 @@ def criar_mapa_escolas(df_escolas, centro_lat, centro_lon):
     m = folium.Map(
         location=[centro_lat, centro_lon],
         zoom_start=12,
-        tiles='OpenStreetMap'
+        tiles=camada_base()
     )
     
+    return adicionar_escolas(m, df_escolas, limite_marcadores)
+
+def adicionar_escolas(destino, df_escolas, limite_marcadores=None):
+    """Marcadores das escolas num mapa ou camada"""
     # Cores por dependência administrativa
     cores = {
         'Municipal': 'green',
@@ -936,25 +2613,14 @@ def criar_mapa_escolas(df_escolas, centro_lat, centro_lon):
     }
     
     # Adicionar marcadores
-    for _, row in df_escolas.iterrows():
-        if pd.notna(row['latitude']) and pd.notna(row['longitude']):
-            cor = cores.get(row['dependencia_administrativa'], 'blue')
-            
-            folium.Marker(
-                location=[row['latitude'], row['longitude']],
-                popup=folium.Popup(f"""
-                    <b>{row['nome']}</b><br>
-                    Tipo: {row['tipo_escola']}<br>
-                    Dependência: {row['dependencia_administrativa']}<br>
-                    Localização: {row['localizacao']}
-                """, max_width=300),
-                tooltip=row['nome'],
-                icon=folium.Icon(color=cor, icon='graduation-cap', prefix='fa')
-            ).add_to(m)
+    df = escapar_campos(df_escolas, ['nome', 'tipo_escola', 'dependencia_administrativa', 'localizacao'])
+    popups = ('<b>' + df['nome'] + '</b><br>Tipo: ' + df['tipo_escola']
+              + '<br>Dependência: ' + df['dependencia_administrativa'] + '<br>Localização: ' + df['localizacao'])
+    cor = df['dependencia_administrativa'].map(cores).fillna('blue')
     
-    return m
+    return adicionar_marcadores(destino, df, popups, df['nome'], cor, 'graduation-cap', limite_marcadores)
 
-def criar_mapa_unidades_seguranca(df_unidades, centro_lat, centro_lon):
+def criar_mapa_unidades_seguranca(df_unidades, centro_lat, centro_lon, limite_marcadores=None):
     """Criar mapa interativo das unidades de segurança"""
     if df_unidades.empty:
         return None
@@ -963,9 +2629,13 @@ def criar_mapa_unidades_seguranca(df_unidades, centro_lat, centro_lon):
     m = folium.Map(
         location=[centro_lat, centro_lon],
         zoom_start=13,
-        tiles='OpenStreetMap'
+        tiles=camada_base()
     )
     
+    return adicionar_unidades_seguranca(m, df_unidades, limite_marcadores)
+
+def adicionar_unidades_seguranca(destino, df_unidades, limite_marcadores=None):
+    """Marcadores das unidades de segurança num mapa ou camada"""
     # Cores por tipo de unidade
     cores = {
         'Delegacia': 'red',
@@ -983,24 +2653,13 @@ def criar_mapa_unidades_seguranca(df_unidades, centro_lat, centro_lon):
     }
     
     # Adicionar marcadores
-    for _, row in df_unidades.iterrows():
-        if pd.notna(row['latitude']) and pd.notna(row['longitude']):
-            cor = cores.get(row['tipo_unidade'], 'blue')
-            icone = icones.get(row['tipo_unidade'], 'info-sign')
-            
-            folium.Marker(
-                location=[row['latitude'], row['longitude']],
-                popup=folium.Popup(f"""
-                    <b>{row['nome']}</b><br>
-                    Tipo: {row['tipo_unidade']}<br>
-                    Endereço: {row['endereco']}<br>
-                    Telefone: {row['telefone']}
-                """, max_width=300),
-                tooltip=row['nome'],
-                icon=folium.Icon(color=cor, icon=icone, prefix='fa')
-            ).add_to(m)
+    df = escapar_campos(df_unidades, ['nome', 'tipo_unidade', 'endereco', 'telefone'])
+    popups = ('<b>' + df['nome'] + '</b><br>Tipo: ' + df['tipo_unidade']
+              + '<br>Endereço: ' + df['endereco'] + '<br>Telefone: ' + df['telefone'])
+    cor = df['tipo_unidade'].map(cores).fillna('blue')
+    icone = df['tipo_unidade'].map(icones).fillna('info-sign')
     
-    return m
+    return adicionar_marcadores(destino, df, popups, df['nome'], cor, icone, limite_marcadores)
 
 def criar_heatmap_seguranca(df_seguranca, centro_lat, centro_lon):
     """Criar heatmap de criminalidade"""
@@ -1011,7 +2670,7 @@ def criar_heatmap_seguranca(df_seguranca, centro_lat, centro_lon):
     m = folium.Map(
         location=[centro_lat, centro_lon],
         zoom_start=12,
-        tiles='OpenStreetMap'
+        tiles=camada_base()
     )
     
     # Preparar dados para heatmap
@@ -1025,13 +2684,220 @@ def criar_heatmap_seguranca(df_seguranca, centro_lat, centro_lon):
     
     # Adicionar heatmap
     if heat_data:
-        from folium.plugins import HeatMap
         HeatMap(heat_data, radius=15, blur=10, max_zoom=1).add_to(m)
     
     return m
 
+def exibir_mapa(camada, municipio_id, filtro, construir, largura=700, altura=400):
+    """Exibir um mapa estático (sem eventos de volta ao Python) a partir do cache de HTML"""
+    if MAPA_MODO == 'interativo':
+        # Comportamento anterior: st_folium devolve zoom/limites/cliques e cada movimento reexecuta o script
+        mapa = construir()
+        if mapa is None:
+            return False
+        st_folium(mapa, width=largura, height=altura, key=f'mapa_{camada}')
+        return True
+    
+    # construir() só executa quando o mapa não está em cache
+    chave = (municipio_id, camada, filtro, db.versao_dados(), TILES_URL, RECURSOS_URL)
+    encontrado, html = cache_mapas.obter(chave) if cache_mapas is not None else (False, None)
+    if not encontrado:
+        mapa = construir()
+        if mapa is None:
+            return False
+        html = mapa.get_root().render()
+        if cache_mapas is not None:
+            cache_mapas.guardar(chave, html)
+    if hasattr(st, 'iframe'):
+        st.iframe(html, width=largura, height=altura)
+    else:
+        components.html(html, width=largura, height=altura)
+    return True
+
+# Mapa de calor por grade
+def agregar_grade_criminalidade(df_seguranca, tamanho_celula_m=500, lat_referencia=0.0, tipos=TIPOS_CRIME_PADRAO):
+    """Mesma agregação de obter_grade_criminalidade, vetorizada em numpy sobre um DataFrame já carregado"""
+    tamanho_lat, tamanho_lon = tamanho_celula_graus(tamanho_celula_m, lat_referencia)
+    df = df_seguranca.dropna(subset=['latitude', 'longitude'])
+    pesos = df[list(tipos)].fillna(0).to_numpy(dtype=float).sum(axis=1)
+    celula_lat = ((df['latitude'].to_numpy() + 90.0) // tamanho_lat).astype(np.int64)
+    celula_lon = ((df['longitude'].to_numpy() + 180.0) // tamanho_lon).astype(np.int64)
+    
+    # Chave única por célula; bincount soma os pesos de cada uma de uma vez
+    colunas = int(360.0 / tamanho_lon) + 2
+    celulas, inverso = np.unique(celula_lat * colunas + celula_lon, return_inverse=True)
+    soma = np.bincount(inverso, weights=pesos, minlength=len(celulas))
+    com_peso = soma > 0
+    return celulas_para_coordenadas(celulas[com_peso] // colunas, celulas[com_peso] % colunas,
+                                    soma[com_peso], tamanho_lat, tamanho_lon)
+
+def criar_heatmap_temporal(quadros, centro_lat, centro_lon, tipos=TIPOS_CRIME_PADRAO):
+    """Criar heatmap animado com um quadro por mês a partir dos quadros pré-calculados"""
+    if not quadros or not tipos:
+        return None
+    
+    m = folium.Map(
+        location=[centro_lat, centro_lon],
+        zoom_start=12,
+        tiles=camada_base()
+    )
+    
+    colunas = [2 + list(TIPOS_CRIME).index(tipo) for tipo in tipos]
+    pesos = [celulas[:, colunas].sum(axis=1) for _, _, celulas, _, _ in quadros]
+    maximo = max((peso.max() for peso in pesos if len(peso)), default=0)
+    if maximo <= 0:
+        return None
+    
+    # Mesma escala em todos os quadros, para que a animação mostre a variação entre os meses
+    dados = []
+    for (_, _, celulas, tamanho_lat, tamanho_lon), peso in zip(quadros, pesos):
+        com_peso = peso > 0
+        dados.append(np.column_stack([
+            ((celulas[com_peso, 0] + 0.5) * tamanho_lat - 90.0).round(6),
+            ((celulas[com_peso, 1] + 0.5) * tamanho_lon - 180.0).round(6),
+            (peso[com_peso] / maximo).round(4)
+        ]).tolist())
+    
+    HeatMapWithTime(
+        dados,
+        index=[f"{mes:02d}/{ano}" for ano, mes, _, _, _ in quadros],
+        radius=15, auto_play=False, max_opacity=0.8
+    ).add_to(m)
+    
+    return m
+
+def criar_heatmap_grade(df_celulas, centro_lat, centro_lon):
+    """Criar heatmap de criminalidade a partir das células agregadas (um ponto por célula)"""
+    if df_celulas.empty:
+        return None
+    
+    m = folium.Map(
+        location=[centro_lat, centro_lon],
+        zoom_start=12,
+        tiles=camada_base()
+    )
+    
+    return adicionar_heatmap_grade(m, df_celulas)
+
+def adicionar_heatmap_grade(destino, df_celulas):
+    """Camada de calor das células agregadas num mapa ou camada"""
+    if df_celulas.empty:
+        return destino
+    
+    # Pesos normalizados para 0..1 (escala de intensidade do Leaflet.heat)
+    pontos = np.column_stack([
+        df_celulas['latitude'].round(6), df_celulas['longitude'].round(6),
+        (df_celulas['peso'] / df_celulas['peso'].max()).round(4)
+    ])
+    HeatMap(pontos.tolist(), radius=15, blur=10, max_zoom=1).add_to(destino)
+    
+    return destino
+
+def criar_mapa_integrado(camadas, centro_lat, centro_lon):
+    """Criar um único mapa com uma camada (FeatureGroup) por conjunto de dados: {rótulo: adicionar(camada)}"""
+    m = folium.Map(
+        location=[centro_lat, centro_lon],
+        zoom_start=12,
+        tiles=camada_base()
+    )
+    
+    for rotulo, adicionar in camadas.items():
+        camada = folium.FeatureGroup(name=rotulo).add_to(m)
+        adicionar(camada)
+    folium.LayerControl(collapsed=False).add_to(m)
+    
+    return m
+
+def mostrar_mapa_integrado(chave, municipio_id, lat, lon, ano_inicio, ano_fim, camadas_padrao):
+    """Mapa único com camadas ativáveis; os dados de uma camada só são lidos quando ela está ativa"""
+    # Padrões pela sessão, não por default=/value=: a navegação sob demanda regrava estas chaves (CHAVES_ESTADO_MODULOS)
+    st.session_state.setdefault(f'camadas_{chave}', list(camadas_padrao))
+    st.session_state.setdefault(f'celula_{chave}', 500)
+    st.session_state.setdefault(f'tipos_{chave}', list(TIPOS_CRIME_PADRAO))
+    selecionadas = st.multiselect("Camadas", list(CAMADAS_MAPA), format_func=CAMADAS_MAPA.get, key=f'camadas_{chave}')
+    ativas = tuple(camada for camada in CAMADAS_MAPA if camada in selecionadas)
+    if not ativas:
+        st.info("Selecione ao menos uma camada.")
+        return False
+    
+    construtores = {
+        'estabelecimentos': lambda camada: adicionar_estabelecimentos(camada, db.obter_estabelecimentos_saude(municipio_id)),
+        'escolas': lambda camada: adicionar_escolas(camada, db.obter_escolas(municipio_id)),
+        'unidades_seguranca': lambda camada: adicionar_unidades_seguranca(camada, db.obter_unidades_seguranca(municipio_id))
+    }
+    filtro = ativas
+    if 'heatmap_crimes' in ativas:
+        col1, col2 = st.columns(2)
+        with col1:
+            tamanho_celula = st.select_slider(
+                "Tamanho da célula", options=TAMANHOS_CELULA_METROS,
+                format_func=lambda metros: f"{metros} m", key=f'celula_{chave}'
+            )
+        with col2:
+            tipos = tuple(st.multiselect(
+                "Tipos de ocorrência", list(TIPOS_CRIME), format_func=TIPOS_CRIME.get, key=f'tipos_{chave}'
+            ))
+        construtores['heatmap_crimes'] = lambda camada: adicionar_heatmap_grade(
+            camada, db.obter_grade_criminalidade(municipio_id, ano_inicio, ano_fim, tamanho_celula, lat, tipos)
+        )
+        filtro += (ano_inicio, ano_fim, tamanho_celula, tipos)
+    
+    def construir():
+        return criar_mapa_integrado({CAMADAS_MAPA[camada]: construtores[camada] for camada in ativas}, lat, lon)
+    
+    # Só a listagem da área visível consome os limites do mapa: apenas ela usa o modo interativo
+    tabelas = [TABELAS_CAMADAS[camada] for camada in ativas if camada in TABELAS_CAMADAS]
+    if tabelas and st.toggle("Listar pontos da área visível", key=f'area_visivel_{chave}'):
+        mostrar_mapa_area_visivel(chave, municipio_id, construir, tabelas)
+        return True
+    return exibir_mapa('integrado', municipio_id, filtro, construir)
+
 # Interface principal
+@contextmanager
+def medir_tempo(nome):
+    """Registrar na sessão a duração de um trecho do rerun"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_tempo(nome, (time.perf_counter() - inicio) * 1000)
+
+def registrar_tempo(nome, milissegundos):
+    """Guardar na sessão uma amostra de tempo exibida na tabela de desempenho"""
+    tempos = st.session_state.setdefault('tempos_execucao', {})
+    tempos.setdefault(nome, deque(maxlen=TEMPOS_AMOSTRAS)).append(milissegundos)
+    execucoes = st.session_state.setdefault('execucoes', {})
+    execucoes[nome] = execucoes.get(nome, 0) + 1
+
+def reexecutar_fragmento():
+    """Reexecutar só o fragmento atual; fora de um rerun de fragmento, reexecuta o app inteiro"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+@st.fragment
+@medir_tempo('🗺️ Mapa interativo (fragmento)')
+def mostrar_mapa_area_visivel(chave, municipio_id, construir, tabelas, largura=700, altura=400):
+    """Mapa interativo que devolve só os limites visíveis e lista os pontos dentro deles (R*Tree)"""
+    # Cada movimento do mapa reexecuta apenas este fragmento
+    estado = st_folium(construir(), width=largura, height=altura, returned_objects=['bounds'], key=f'mapa_area_{chave}')
+    limites = (estado or {}).get('bounds') or {}
+    sudoeste, nordeste = limites.get('_southWest') or {}, limites.get('_northEast') or {}
+    if sudoeste.get('lat') is None or nordeste.get('lat') is None:
+        st.caption("Mova ou aproxime o mapa para listar os pontos da área visível.")
+        return
+    
+    for tabela in tabelas:
+        df = db.obter_pontos_na_area(tabela, sudoeste['lat'], sudoeste['lng'], nordeste['lat'], nordeste['lng'], municipio_id)
+        nome, tipo = TABELAS_PROXIMIDADE[tabela]
+        st.markdown(f"**{ROTULOS_TABELAS[tabela]}:** {len(df)} na área visível")
+        if not df.empty:
+            st.dataframe(df[[nome, tipo, 'latitude', 'longitude']], hide_index=True, use_container_width=True)
+
 def main():
+    iniciar_aplicacao()
+    
     # Aviso sobre configuração da API OpenAI
     if not OPENAI_DISPONIVEL:
         st.sidebar.warning("""
@@ -1056,7 +2922,8 @@ def main():
     if not st.session_state.authenticated:
         mostrar_login()
     else:
-        mostrar_dashboard()
+        with medir_tempo('Rerun completo'):
+            mostrar_dashboard()
 
 def mostrar_login():
     """Tela de login"""
@@ -1154,35 +3021,116 @@ def mostrar_dashboard():
         </div>
         """, unsafe_allow_html=True)
         
+        with st.expander("⚡ Desempenho"):
+            if db.cache is not None:
+                estatisticas = db.cache.estatisticas()
+                st.markdown(f"""
+                **Cache de consultas** (versão dos dados: {db.versao_dados()})  
+                Acertos: {estatisticas['acertos']:,} | Falhas: {estatisticas['falhas']:,}  
+                Taxa de acerto: {estatisticas['taxa_acerto']:.0%}  
+                Itens: {estatisticas['itens']} | Memória: {estatisticas['mb_usados']:.1f} / {estatisticas['mb_limite']:.0f} MB  
+                Remoções (LRU): {estatisticas['remocoes']:,}
+                """)
+            else:
+                st.markdown("Cache de consultas desativado (PROCESS_MIND_CACHE_MB=0)")
+            
+            if cache_mapas is not None:
+                estatisticas = cache_mapas.estatisticas()
+                st.markdown(f"""
+                **Cache de mapas**  
+                Acertos: {estatisticas['acertos']:,} (disco: {estatisticas['acertos_disco']:,}) | Falhas: {estatisticas['falhas']:,}  
+                Itens em memória: {estatisticas['itens']} | {estatisticas['mb_usados']:.1f} / {estatisticas['mb_limite']:.0f} MB
+                """)
+            
+            if cache_respostas is not None:
+                estatisticas = cache_respostas.estatisticas()
+                st.markdown(f"""
+                **Cache de respostas do chatbot** (validade: {LLM_CACHE_VALIDADE_HORAS:g} h)  
+                Acertos: {estatisticas['acertos']:,} | Falhas: {estatisticas['falhas']:,} | Taxa de acerto: {estatisticas['taxa_acerto']:.0%}  
+                Expiradas: {estatisticas['expirados']:,} | Ignoradas: {estatisticas['ignorados']:,} | Remoções: {estatisticas['remocoes']:,}  
+                Respostas: {estatisticas['itens']} ({estatisticas['acertos_total']:,} reaproveitamentos) | {estatisticas['mb_usados']:.2f} / {estatisticas['mb_limite']:.0f} MB
+                """)
+                if st.button("🗑️ Limpar cache de respostas", use_container_width=True):
+                    cache_respostas.limpar()
+                    st.rerun()
+            
+            if cliente_llm is not None:
+                estatisticas = cliente_llm.estatisticas()
+                unificacao = chamadas_llm.estatisticas()
+                estados = {'fechado': '🟢 fechado', 'meio_aberto': '🟡 meio aberto', 'aberto': '🔴 aberto'}
+                reabertura = f" (teste em {estatisticas['reabre_em_s']:.0f}s)" if estatisticas['estado'] == 'aberto' else ""
+                st.markdown(f"""
+                **Cliente ChatGPT** (timeout {LLM_TIMEOUT:g}s, até {LLM_TENTATIVAS} tentativas)  
+                Disjuntor: {estados[estatisticas['estado']]}{reabertura} | Falhas seguidas: {estatisticas['falhas_seguidas']}  
+                Chamadas: {estatisticas['chamadas']:,} | Taxa de erro: {estatisticas['taxa_erro']:.0%}  
+                Retentativas: {estatisticas['retentativas']:,} | Curto-circuitos: {estatisticas['curto_circuitos']:,}  
+                Vagas: {estatisticas['em_uso']}/{estatisticas['concorrencia']} em uso | Na fila: {estatisticas['aguardando']} | Desistências: {estatisticas['desistencias']:,}  
+                Espera na fila: média {estatisticas['espera_media_ms']:.0f} ms | p95 {estatisticas['espera_p95_ms']:.0f} ms | máx. {estatisticas['espera_max_ms']:.0f} ms  
+                Pedidos unificados: {unificacao['unificados']:,} de {unificacao['pedidos']:,} ({unificacao['em_andamento']} em andamento)
+                """)
+                if estatisticas['chamadas']:
+                    st.dataframe(pd.DataFrame([
+                        {'Latência': f"≤ {limite / 1000:g} s" if limite != float('inf') else f"> {ClienteLLMResiliente.FAIXAS_LATENCIA_MS[-2] / 1000:g} s",
+                         'Chamadas': total}
+                        for limite, total in estatisticas['histograma'].items()
+                    ]), hide_index=True, use_container_width=True)
+            
+            estatisticas = cache_pdfs.estatisticas()
+            st.markdown(f"""
+            **Cache de PDFs**  
+            Acertos: {estatisticas['acertos_memoria']:,} em memória, {estatisticas['acertos_disco']:,} no banco | Extrações: {estatisticas['extracoes']:,} (retomadas: {estatisticas['retomadas']:,})  
+            Páginas extraídas: {estatisticas['paginas_extraidas']:,} | Documentos: {estatisticas['documentos']} | {estatisticas['mb_memoria']:.1f} MB em memória, {estatisticas['mb_disco']:.1f} / {PDF_CACHE_DISCO_MB:.0f} MB no banco
+            """)
+            
+            tempos = st.session_state.get('tempos_execucao', {})
+            if tempos:
+                st.markdown(f"**Tempo de execução** (navegação: {NAVEGACAO_MODO}, mapas: {MAPA_MODO}, "
+                            f"média dos últimos {TEMPOS_AMOSTRAS} reruns)")
+                execucoes = st.session_state.get('execucoes', {})
+                st.dataframe(pd.DataFrame([
+                    {'Trecho': nome, 'Último (ms)': round(amostras[-1], 1),
+                     'Média (ms)': round(sum(amostras) / len(amostras), 1), 'Execuções': execucoes.get(nome, 0)}
+                    for nome, amostras in tempos.items()
+                ]), hide_index=True, use_container_width=True)
+        
         if st.button("🚪 Logout", use_container_width=True):
             st.session_state.authenticated = False
             st.session_state.usuario = None
             st.rerun()
     
-    # Abas principais
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["🏥 Saúde", "🎓 Educação", "🚔 Segurança", "👥 Demografia", "🤖 ChatBot"])
-    
-    with tab1:
-        mostrar_modulo_saude(usuario['municipio_id'], usuario['latitude'], usuario['longitude'], ano_inicio, ano_fim)
-    
-    with tab2:
-        mostrar_modulo_educacao(usuario['municipio_id'], usuario['latitude'], usuario['longitude'])
-    
-    with tab3:
-        mostrar_modulo_seguranca(usuario['municipio_id'], usuario['latitude'], usuario['longitude'], ano_inicio, ano_fim)
-    
-    with tab4:
-        mostrar_modulo_demografia(usuario['municipio_id'])
+    # Módulos principais
+    modulos = {
+        "🏥 Saúde": lambda: mostrar_modulo_saude(usuario['municipio_id'], usuario['latitude'], usuario['longitude'], ano_inicio, ano_fim),
+        "🎓 Educação": lambda: mostrar_modulo_educacao(usuario['municipio_id'], usuario['latitude'], usuario['longitude']),
+        "🚔 Segurança": lambda: mostrar_modulo_seguranca(usuario['municipio_id'], usuario['latitude'], usuario['longitude'], ano_inicio, ano_fim),
+        "👥 Demografia": lambda: mostrar_modulo_demografia(usuario['municipio_id']),
+        "🤖 ChatBot": lambda: mostrar_chatbot(usuario['municipio_id'], usuario)
+    }
     
-    with tab5:
-        mostrar_chatbot(usuario['municipio_id'], usuario)
+    if NAVEGACAO_MODO == 'abas':
+        # st.tabs executa todos os módulos a cada rerun
+        for aba, (nome, exibir) in zip(st.tabs(list(modulos)), modulos.items()):
+            with aba, medir_tempo(nome):
+                exibir()
+    else:
+        # O Streamlit descarta o estado de widgets não exibidos no rerun; reatribuir o valor o torna
+        # estado comum da sessão, e os filtros de um módulo oculto voltam intactos quando ele é reaberto
+        for chave in list(st.session_state.keys()):
+            if chave.startswith(CHAVES_ESTADO_MODULOS):
+                st.session_state[chave] = st.session_state[chave]
+        
+        # Apenas o módulo selecionado executa; a escolha fica na sessão entre reruns
+        modulo_ativo = st.radio("Módulo", list(modulos), horizontal=True, key='modulo_ativo', label_visibility='collapsed')
+        with medir_tempo(modulo_ativo):
+            modulos[modulo_ativo]()
 
 def mostrar_modulo_saude(municipio_id, lat, lon, ano_inicio, ano_fim):
     """Módulo de Saúde com mapas"""
     st.markdown("## 🏥 Painel de Saúde Pública")
     
-    # Obter dados
-    df_saude = db.obter_dados_saude(municipio_id, ano_inicio, ano_fim)
+    # Obter dados (totais e série mensal vêm dos rollups)
+    kpis_saude = db.obter_kpis_saude(municipio_id, ano_inicio, ano_fim).iloc[0]
+    df_saude = db.obter_saude_mensal(municipio_id, ano_inicio, ano_fim)
     df_estabelecimentos = db.obter_estabelecimentos_saude(municipio_id)
     
     if not df_saude.empty:
@@ -1190,7 +3138,7 @@ def mostrar_modulo_saude(municipio_id, lat, lon, ano_inicio, ano_fim):
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_internacoes = df_saude['internacoes'].sum()
+            total_internacoes = int(kpis_saude['internacoes'])
             st.markdown(f"""
             <div class="metric-card">
                 <h3>🏥 Total Internações</h3>
@@ -1200,7 +3148,7 @@ def mostrar_modulo_saude(municipio_id, lat, lon, ano_inicio, ano_fim):
             """, unsafe_allow_html=True)
         
         with col2:
-            total_obitos = df_saude['obitos'].sum()
+            total_obitos = int(kpis_saude['obitos'])
             st.markdown(f"""
             <div class="metric-card">
                 <h3>💀 Total Óbitos</h3>
@@ -1210,7 +3158,7 @@ def mostrar_modulo_saude(municipio_id, lat, lon, ano_inicio, ano_fim):
             """, unsafe_allow_html=True)
         
         with col3:
-            total_altas = df_saude['altas'].sum()
+            total_altas = int(kpis_saude['altas'])
             st.markdown(f"""
             <div class="metric-card">
                 <h3>✅ Total Altas</h3>
@@ -1248,11 +3196,7 @@ def mostrar_modulo_saude(municipio_id, lat, lon, ano_inicio, ano_fim):
         
         with col2:
             st.markdown("### 🏥 Atendimentos UBS vs Internações")
-            df_mensal = df_saude.groupby(['ano', 'mes']).agg({
-                'atendimentos_ubs': 'sum',
-                'internacoes': 'sum'
-            }).reset_index()
-            df_mensal['periodo'] = df_mensal['ano'].astype(str) + '-' + df_mensal['mes'].astype(str).str.zfill(2)
+            df_mensal = df_saude
             
             fig = make_subplots(specs=[[{"secondary_y": True}]])
             
@@ -1281,9 +3225,7 @@ def mostrar_modulo_saude(municipio_id, lat, lon, ano_inicio, ano_fim):
         st.markdown("### 🗺️ Mapa dos Estabelecimentos de Saúde")
         st.markdown(f"{criar_badge('REAL', 'CNES')}", unsafe_allow_html=True)
         
-        mapa = criar_mapa_estabelecimentos(df_estabelecimentos, lat, lon)
-        if mapa:
-            st_folium(mapa, width=700, height=400)
+        mostrar_mapa_integrado('saude', municipio_id, lat, lon, ano_inicio, ano_fim, ['estabelecimentos'])
         
         # Tabela de estabelecimentos
         st.markdown("### 🏥 Lista de Estabelecimentos")
@@ -1301,6 +3243,42 @@ def mostrar_modulo_saude(municipio_id, lat, lon, ano_inicio, ano_fim):
             },
             use_container_width=True
         )
+        
+        mostrar_cobertura_escolas(municipio_id, {
+            'Estabelecimento de saúde': ('estabelecimentos_saude', None),
+            'UBS': ('estabelecimentos_saude', 'UBS')
+        })
+
+def mostrar_cobertura_escolas(municipio_id, destinos):
+    """Tabela de cobertura: parcela das escolas com o destino mais próximo a até cada raio"""
+    st.markdown("### 📍 Cobertura das Escolas")
+    
+    cobertura = pd.DataFrame({'raio': [f"até {raio:g} km" for raio in RAIOS_COBERTURA_KM]})
+    distancias = {}
+    for rotulo, (tabela, tipo) in destinos.items():
+        df = db.obter_distancias_mais_proximas(municipio_id, 'escolas', tabela, tipo)
+        cobertura[rotulo] = calcular_cobertura(df)['percentual']
+        distancias[rotulo] = df.set_index('id')[['nome', 'destino_nome', 'distancia_km']]
+    
+    st.dataframe(
+        cobertura,
+        column_config={
+            'raio': 'Distância',
+            **{rotulo: st.column_config.ProgressColumn(f"% escolas – {rotulo}", format="%.0f%%", min_value=0, max_value=100)
+               for rotulo in destinos}
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    with st.expander("Distância de cada escola ao destino mais próximo"):
+        df_display = pd.concat(
+            {rotulo: df[['destino_nome', 'distancia_km']] for rotulo, df in distancias.items()}, axis=1
+        )
+        df_display.columns = [f"{rotulo} – {'mais próximo' if coluna == 'destino_nome' else 'km'}"
+                              for rotulo, coluna in df_display.columns]
+        df_display.insert(0, 'Escola', next(iter(distancias.values()))['nome'])
+        st.dataframe(df_display.round(2), hide_index=True, use_container_width=True)
 
 def mostrar_modulo_educacao(municipio_id, lat, lon):
     """Módulo de Educação com mapas"""
@@ -1433,9 +3411,7 @@ def mostrar_modulo_educacao(municipio_id, lat, lon):
         st.markdown("### 🗺️ Mapa das Escolas")
         st.markdown(f"{criar_badge('SIMULADO')}", unsafe_allow_html=True)
         
-        mapa = criar_mapa_escolas(df_escolas, lat, lon)
-        if mapa:
-            st_folium(mapa, width=700, height=400)
+        mostrar_mapa_integrado('educacao', municipio_id, lat, lon, 2023, 2025, ['escolas'])
         
         # Lista de escolas
         st.markdown("### 🏫 Lista de Escolas")
@@ -1484,21 +3460,27 @@ def mostrar_modulo_educacao(municipio_id, lat, lon):
                 showlegend=False
             )
             st.plotly_chart(fig, use_container_width=True)
+        
+        mostrar_cobertura_escolas(municipio_id, {
+            'Estabelecimento de saúde': ('estabelecimentos_saude', None),
+            'UBS': ('estabelecimentos_saude', 'UBS'),
+            'Unidade de segurança': ('unidades_seguranca', None)
+        })
 
 def mostrar_modulo_seguranca(municipio_id, lat, lon, ano_inicio, ano_fim):
     """Módulo de Segurança com heatmap e mapa de unidades"""
     st.markdown("## 🚔 Painel de Segurança Pública")
     
-    # Obter dados
-    df_seguranca = db.obter_dados_seguranca(municipio_id, ano_inicio, ano_fim)
+    # Obter dados (totais e séries vêm dos rollups; pontos brutos só para o mapa de calor)
+    kpis_seguranca = db.obter_kpis_seguranca(municipio_id, ano_inicio, ano_fim).iloc[0]
     df_unidades = db.obter_unidades_seguranca(municipio_id)
     
-    if not df_seguranca.empty:
+    if kpis_seguranca['registros'] > 0:
         # Métricas principais
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_homicidios = df_seguranca['homicidios'].sum()
+            total_homicidios = int(kpis_seguranca['homicidios'])
             st.markdown(f"""
             <div class="metric-card">
                 <h3>⚰️ Homicídios</h3>
@@ -1508,7 +3490,7 @@ def mostrar_modulo_seguranca(municipio_id, lat, lon, ano_inicio, ano_fim):
             """, unsafe_allow_html=True)
         
         with col2:
-            total_roubos = df_seguranca['roubos'].sum()
+            total_roubos = int(kpis_seguranca['roubos'])
             st.markdown(f"""
             <div class="metric-card">
                 <h3>🔫 Roubos</h3>
@@ -1518,7 +3500,7 @@ def mostrar_modulo_seguranca(municipio_id, lat, lon, ano_inicio, ano_fim):
             """, unsafe_allow_html=True)
         
         with col3:
-            total_furtos = df_seguranca['furtos'].sum()
+            total_furtos = int(kpis_seguranca['furtos'])
             st.markdown(f"""
             <div class="metric-card">
                 <h3>🎒 Furtos</h3>
@@ -1528,7 +3510,7 @@ def mostrar_modulo_seguranca(municipio_id, lat, lon, ano_inicio, ano_fim):
             """, unsafe_allow_html=True)
         
         with col4:
-            total_acidentes = df_seguranca['acidentes_transito'].sum()
+            total_acidentes = int(kpis_seguranca['acidentes_transito'])
             st.markdown(f"""
             <div class="metric-card">
                 <h3>🚗 Acidentes Trânsito</h3>
@@ -1542,11 +3524,7 @@ def mostrar_modulo_seguranca(municipio_id, lat, lon, ano_inicio, ano_fim):
         
         with col1:
             st.markdown("### 📈 Evolução da Criminalidade por Região")
-            df_regiao = df_seguranca.groupby(['regiao', 'ano', 'mes']).agg({
-                'homicidios': 'sum',
-                'roubos': 'sum',
-                'furtos': 'sum'
-            }).reset_index()
+            df_regiao = db.obter_seguranca_mensal(municipio_id, ano_inicio, ano_fim)
             df_regiao['periodo'] = df_regiao['ano'].astype(str) + '-' + df_regiao['mes'].astype(str).str.zfill(2)
             df_regiao['total_crimes'] = df_regiao['homicidios'] + df_regiao['roubos'] + df_regiao['furtos']
             
@@ -1562,7 +3540,7 @@ def mostrar_modulo_seguranca(municipio_id, lat, lon, ano_inicio, ano_fim):
                 'Homicídios': total_homicidios,
                 'Roubos': total_roubos,
                 'Furtos': total_furtos,
-                'Violência Doméstica': df_seguranca['violencia_domestica'].sum(),
+                'Violência Doméstica': int(kpis_seguranca['violencia_domestica']),
                 'Acidentes Trânsito': total_acidentes
             }
             
@@ -1581,37 +3559,29 @@ def mostrar_modulo_seguranca(municipio_id, lat, lon, ano_inicio, ano_fim):
             )
             st.plotly_chart(fig, use_container_width=True)
         
-        # Mapas lado a lado
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            # Mapa das unidades de segurança
-            if not df_unidades.empty:
-                st.markdown("### 🏛️ Mapa das Unidades de Segurança")
-                st.markdown(f"{criar_badge('SIMULADO')}", unsafe_allow_html=True)
-                
-                mapa_unidades = criar_mapa_unidades_seguranca(df_unidades, lat, lon)
-                if mapa_unidades:
-                    st_folium(mapa_unidades, width=350, height=400)
+        # Unidades e mapa de calor como camadas de um mesmo mapa
+        st.markdown("### 🗺️ Mapa da Segurança")
+        st.markdown(f"{criar_badge('SIMULADO')}", unsafe_allow_html=True)
         
-        with col2:
-            # Heatmap de criminalidade
-            st.markdown("### 🗺️ Mapa de Calor da Criminalidade")
-            st.markdown(f"{criar_badge('SIMULADO')}", unsafe_allow_html=True)
-            
-            mapa_crimes = criar_heatmap_seguranca(df_seguranca, lat, lon)
-            if mapa_crimes:
-                st_folium(mapa_crimes, width=350, height=400)
+        visualizacao = st.radio("Visualização", ["Período", "Mês a mês"], horizontal=True, key='heatmap_visualizacao')
+        if visualizacao == "Mês a mês":
+            st.session_state.setdefault('heatmap_tipos', list(TIPOS_CRIME_PADRAO))
+            tipos = tuple(st.multiselect(
+                "Tipos de ocorrência", list(TIPOS_CRIME), format_func=TIPOS_CRIME.get, key='heatmap_tipos'
+            ))
+            # Quadros gravados na carga dos dados: nenhuma agregação no momento da exibição
+            if not exibir_mapa('heatmap_mensal', municipio_id, (ano_inicio, ano_fim, tipos),
+                               lambda: criar_heatmap_temporal(
+                                   db.obter_quadros_heatmap(municipio_id, ano_inicio, ano_fim), lat, lon, tipos)):
+                st.info("Nenhuma ocorrência dos tipos selecionados no período.")
+            st.caption(f"Um quadro por mês, em células de {HEATMAP_QUADRO_CELULA_M} m")
+        else:
+            mostrar_mapa_integrado('seguranca', municipio_id, lat, lon, ano_inicio, ano_fim,
+                                   ['unidades_seguranca', 'heatmap_crimes'])
         
         # Análise por região - apenas colunas com dados
         st.markdown("### 📊 Análise por Região")
-        df_regiao_total = df_seguranca.groupby('regiao').agg({
-            'homicidios': 'sum',
-            'roubos': 'sum',
-            'furtos': 'sum',
-            'violencia_domestica': 'sum',
-            'acidentes_transito': 'sum'
-        }).reset_index()
+        df_regiao_total = db.obter_seguranca_por_regiao(municipio_id, ano_inicio, ano_fim)
         
         # Filtrar apenas colunas com valores > 0
         colunas_com_dados = ['regiao']
@@ -1839,17 +3809,38 @@ def mostrar_chatbot(municipio_id, usuario):
         help="Limit 200MB per file • PDF"
     )
     
-    contexto_pdf = None
+    # O texto extraído fica na sessão: o uploader volta vazio quando o módulo deixa de ser exibido
     if uploaded_file is not None:
-        try:
-            pdf_reader = PyPDF2.PdfReader(uploaded_file)
-            contexto_pdf = ""
-            for page in pdf_reader.pages:
-                contexto_pdf += page.extract_text()
-            st.success(f"✅ PDF carregado: {len(contexto_pdf)} caracteres extraídos")
-        except Exception as e:
-            st.error(f"❌ Erro ao processar PDF: {str(e)}")
+        # file_id muda a cada envio: outro PDF com o mesmo nome e tamanho também é lido (o hash evita reextrair o mesmo)
+        arquivo = uploaded_file.file_id
+        if st.session_state.get('pdf_carregado', {}).get('arquivo') != arquivo:
+            try:
+                # Cache por hash do conteúdo: o mesmo documento, enviado por qualquer usuário, é lido uma única vez
+                progresso = st.progress(0.0, text="Extraindo texto do PDF...")
+                hash_pdf, texto = cache_pdfs.extrair(
+                    uploaded_file.getvalue(), uploaded_file.name,
+                    lambda pagina, total: progresso.progress(pagina / total, text=f"Extraindo texto do PDF: página {pagina} de {total}")
+                )
+                progresso.empty()
+                st.session_state.pdf_carregado = {'arquivo': arquivo, 'nome': uploaded_file.name, 'hash': hash_pdf, 'texto': texto}
+            except Exception as e:
+                st.session_state.pop('pdf_carregado', None)
+                st.error(f"❌ Erro ao processar PDF: {str(e)}")
     
+    contexto_pdf = None
+    if 'pdf_carregado' in st.session_state:
+        contexto_pdf = st.session_state.pdf_carregado['texto']
+        st.success(f"✅ PDF carregado: {st.session_state.pdf_carregado['nome']} ({len(contexto_pdf)} caracteres extraídos)")
+        if uploaded_file is None and st.button("📎 Remover PDF"):
+            del st.session_state.pdf_carregado
+            st.rerun()
+    
+    mostrar_painel_chat(municipio_id, usuario, contexto_pdf)
+
+@st.fragment
+@medir_tempo('💬 Chat (fragmento)')
+def mostrar_painel_chat(municipio_id, usuario, contexto_pdf=None):
+    """Histórico, entrada e sugestões do chat, reexecutados isoladamente do restante do app"""
     # Inicializar histórico de chat
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
@@ -1865,32 +3856,20 @@ def mostrar_chatbot(municipio_id, usuario):
     with chat_container:
         for i, (pergunta, resposta) in enumerate(st.session_state.chat_history):
             if pergunta:  # Mensagem do usuário (lado direito, vermelho)
-                st.markdown(f"""
-                <div style="display: flex; justify-content: flex-end; margin: 8px 0;">
-                    <div style="background-color: #ff6b6b; color: white; padding: 8px 12px; border-radius: 12px; max-width: 70%; word-wrap: break-word;">
-                        <div style="display: flex; align-items: center; gap: 6px;">
-                            <span style="background-color: #ff5252; border-radius: 50%; width: 20px; height: 20px; display: flex; align-items: center; justify-content: center; font-size: 10px; flex-shrink: 0;">👤</span>
-                            <div style="font-size: 14px;">{pergunta}</div>
-                        </div>
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+                st.markdown(html_bolha_usuario(pergunta), unsafe_allow_html=True)
             
             if resposta:  # Resposta do assistente (lado esquerdo, amarelo)
-                st.markdown(f"""
-                <div style="display: flex; justify-content: flex-start; margin: 8px 0;">
-                    <div style="background-color: #ffd93d; color: #333; padding: 8px 12px; border-radius: 12px; max-width: 70%; word-wrap: break-word;">
-                        <div style="display: flex; align-items: flex-start; gap: 6px;">
-                            <span style="background-color: #ffcc02; border-radius: 50%; width: 20px; height: 20px; display: flex; align-items: center; justify-content: center; font-size: 10px; flex-shrink: 0;">🤖</span>
-                            <div style="flex: 1; font-size: 14px; line-height: 1.4;">{resposta}</div>
-                        </div>
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+                st.markdown(html_bolha_assistente(resposta), unsafe_allow_html=True)
     
     # Campo de input na parte inferior com funcionalidade Enter
     st.markdown("---")
     
+    # Ignorar o cache força uma nova consulta à API (a resposta nova substitui a guardada)
+    usar_cache = cache_respostas is None or not st.checkbox(
+        "Ignorar respostas em cache", key="chat_ignorar_cache",
+        help="Consultar o ChatGPT mesmo que a pergunta já tenha sido respondida com os mesmos dados"
+    )
+    
     # Usar form para capturar Enter (Ctrl+Enter)
     with st.form(key="chat_form", clear_on_submit=True):
         pergunta = st.text_input(
@@ -1904,13 +3883,10 @@ def mostrar_chatbot(municipio_id, usuario):
     
     # Processar pergunta quando enviada
     if enviar and pergunta.strip():
-        # Preparar dados do município
-        db = ProcessMindDB()
-        
+        # Preparar dados do município (repositório compartilhado, sem recriar o esquema)
         # Obter dados para contexto
-        df_saude = db.obter_dados_saude(municipio_id)
-        df_educacao = db.obter_dados_educacao(municipio_id)
-        df_seguranca = db.obter_dados_seguranca(municipio_id)
+        kpis_saude = db.obter_kpis_saude(municipio_id).iloc[0]
+        kpis_seguranca = db.obter_kpis_seguranca(municipio_id).iloc[0]
         df_estabelecimentos = db.obter_estabelecimentos_saude(municipio_id)
         df_escolas = db.obter_escolas(municipio_id)
         df_unidades = db.obter_unidades_seguranca(municipio_id)
@@ -1921,26 +3897,18 @@ def mostrar_chatbot(municipio_id, usuario):
             'estabelecimentos_saude': len(df_estabelecimentos),
             'escolas': len(df_escolas),
             'unidades_seguranca': len(df_unidades),
-            'internacoes_total': df_saude['internacoes'].sum() if not df_saude.empty else 0,
-            'crimes_total': (df_seguranca['homicidios'].sum() + df_seguranca['roubos'].sum() + df_seguranca['furtos'].sum()) if not df_seguranca.empty else 0
+            'internacoes_total': int(kpis_saude['internacoes']),
+            'crimes_total': int(kpis_seguranca['homicidios'] + kpis_seguranca['roubos'] + kpis_seguranca['furtos'])
         }
         
-        # Gerar resposta
-        with st.spinner("🤖 Analisando sua pergunta..."):
-            resposta = chatbot_resposta_com_gpt(pergunta, contexto_pdf, dados_municipio)
-        
-        # Adicionar ao histórico
-        st.session_state.chat_history.append((pergunta, resposta))
-        
-        # Salvar no banco
-        db.salvar_conversa_chat(usuario['id'], pergunta, resposta)
-        
-        st.rerun()
+        # Gerar resposta (em fluxo, direto no balão), adicionar ao histórico e salvar no banco
+        responder_no_chat(chat_container, pergunta, contexto_pdf, dados_municipio, municipio_id, usar_cache)
+        reexecutar_fragmento()
     
     # Botão para limpar chat
     if st.button("🗑️ Limpar Conversa", type="secondary"):
         st.session_state.chat_history = []
-        st.rerun()
+        reexecutar_fragmento()
     
     # Sugestões de perguntas
     st.markdown("### 💡 Perguntas Sugeridas")
@@ -1960,7 +3928,6 @@ def mostrar_chatbot(municipio_id, usuario):
         with col:
             if st.button(f"💭 {sugestao}", key=f"sugestao_{i}"):
                 # Processar sugestão
-                df_saude = db.obter_dados_saude(municipio_id)
                 df_estabelecimentos = db.obter_estabelecimentos_saude(municipio_id)
                 df_escolas = db.obter_escolas(municipio_id)
                 df_unidades = db.obter_unidades_seguranca(municipio_id)
@@ -1973,12 +3940,96 @@ def mostrar_chatbot(municipio_id, usuario):
                     'unidades_seguranca': len(df_unidades)
                 }
                 
-                resposta = chatbot_resposta_com_gpt(sugestao, None, dados_municipio)
-                st.session_state.chat_history.append((sugestao, resposta))
-                st.rerun()
+                responder_no_chat(chat_container, sugestao, None, dados_municipio, municipio_id, usar_cache)
+                reexecutar_fragmento()
+
+def html_bolha_usuario(pergunta):
+    """Balão da mensagem do usuário (lado direito, vermelho)"""
+    return f"""
+                <div style="display: flex; justify-content: flex-end; margin: 8px 0;">
+                    <div style="background-color: #ff6b6b; color: white; padding: 8px 12px; border-radius: 12px; max-width: 70%; word-wrap: break-word;">
+                        <div style="display: flex; align-items: center; gap: 6px;">
+                            <span style="background-color: #ff5252; border-radius: 50%; width: 20px; height: 20px; display: flex; align-items: center; justify-content: center; font-size: 10px; flex-shrink: 0;">👤</span>
+                            <div style="font-size: 14px;">{pergunta}</div>
+                        </div>
+                    </div>
+                </div>
+                """
 
-def chatbot_resposta_com_gpt(pergunta, contexto_pdf=None, dados_municipio=None):
-    """Resposta do chatbot usando ChatGPT com fallback inteligente"""
+def html_bolha_assistente(resposta):
+    """Balão da resposta do assistente (lado esquerdo, amarelo)"""
+    return f"""
+                <div style="display: flex; justify-content: flex-start; margin: 8px 0;">
+                    <div style="background-color: #ffd93d; color: #333; padding: 8px 12px; border-radius: 12px; max-width: 70%; word-wrap: break-word;">
+                        <div style="display: flex; align-items: flex-start; gap: 6px;">
+                            <span style="background-color: #ffcc02; border-radius: 50%; width: 20px; height: 20px; display: flex; align-items: center; justify-content: center; font-size: 10px; flex-shrink: 0;">🤖</span>
+                            <div style="flex: 1; font-size: 14px; line-height: 1.4;">{resposta}</div>
+                        </div>
+                    </div>
+                </div>
+                """
+
+def responder_no_chat(chat_container, pergunta, contexto_pdf, dados_municipio, municipio_id, usar_cache):
+    """Exibir a pergunta, escrever a resposta no balão à medida que chega e registrá-la no histórico e no banco"""
+    with chat_container:
+        st.markdown(html_bolha_usuario(pergunta), unsafe_allow_html=True)
+        balao = st.empty()
+    
+    def ao_receber(parcial):
+        balao.markdown(html_bolha_assistente(parcial + " ▌"), unsafe_allow_html=True)
+    
+    if LLM_STREAMING:
+        resposta = chatbot_resposta_com_gpt(pergunta, contexto_pdf, dados_municipio, municipio_id, usar_cache, ao_receber)
+    else:
+        with st.spinner("🤖 Analisando sua pergunta..."):
+            resposta = chatbot_resposta_com_gpt(pergunta, contexto_pdf, dados_municipio, municipio_id, usar_cache)
+    balao.markdown(html_bolha_assistente(resposta), unsafe_allow_html=True)
+    
+    # O texto final só é gravado depois de completo
+    st.session_state.chat_history.append((pergunta, resposta))
+    db.salvar_conversa_chat(municipio_id, pergunta, resposta)
+
+def consultar_chatgpt(pergunta, prompt_sistema, ao_receber=None):
+    """Chamar o ChatGPT pelo cliente resiliente; com ao_receber, a resposta chega em fluxo"""
+    mensagens = [
+        {"role": "system", "content": prompt_sistema},
+        {"role": "user", "content": pergunta}
+    ]
+    inicio = time.perf_counter()
+    if ao_receber is not None:
+        partes = []
+        exibido_em = 0.0
+        with cliente_llm.criar(
+            model=LLM_MODELO, messages=mensagens, max_tokens=500, temperature=0.7, stream=True
+        ) as fluxo:
+            for evento in fluxo:
+                trecho = evento.choices[0].delta.content if evento.choices else None
+                if not trecho:
+                    continue
+                if not partes:
+                    registrar_tempo('🤖 ChatGPT: primeiro trecho', (time.perf_counter() - inicio) * 1000)
+                partes.append(trecho)
+                # Cada atualização do balão é uma mensagem ao navegador: no máximo uma a cada 50 ms
+                if time.perf_counter() - exibido_em >= LLM_STREAMING_INTERVALO:
+                    ao_receber(f"🤖 **ChatGPT + Dados Reais**\n\n{''.join(partes)}")
+                    exibido_em = time.perf_counter()
+        resposta_gpt = ''.join(partes).strip()
+    else:
+        response = cliente_llm.criar(
+            model=LLM_MODELO, messages=mensagens, max_tokens=500, temperature=0.7
+        )
+        resposta_gpt = response.choices[0].message.content.strip()
+    registrar_tempo('🤖 ChatGPT: resposta completa', (time.perf_counter() - inicio) * 1000)
+    
+    # Adicionar badge indicando uso do ChatGPT
+    return f"🤖 **ChatGPT + Dados Reais**\n\n{resposta_gpt}"
+
+def chatbot_resposta_com_gpt(pergunta, contexto_pdf=None, dados_municipio=None, municipio_id=None, usar_cache=True,
+                             ao_receber=None):
+    """Resposta do chatbot usando ChatGPT (ou o cache de respostas) com fallback inteligente
+
+    Com ao_receber, a resposta chega em fluxo e o texto parcial é repassado a cada trecho recebido.
+    """
     
     # Preparar contexto dos dados municipais
     contexto_dados = f"""
@@ -2007,9 +4058,16 @@ def chatbot_resposta_com_gpt(pergunta, contexto_pdf=None, dados_municipio=None):
     
     # Se ChatGPT estiver disponível, usar a API
     if OPENAI_DISPONIVEL:
+        chave = CacheRespostasLLM.chave(pergunta, municipio_id, contexto_pdf, contexto_dados)
+        if cache_respostas is not None:
+            encontrado, resposta = cache_respostas.obter(chave, ignorar=not usar_cache)
+            if encontrado:
+                return resposta
+        
         try:
             # Debug: mostrar que está tentando usar ChatGPT
-            st.info("🔄 Consultando ChatGPT...")
+            if ao_receber is None:
+                st.info("🔄 Consultando ChatGPT...")
             
             # Preparar prompt para ChatGPT
             prompt_sistema = f"""Você é um assistente especializado em dados municipais do sistema PROCESS MIND. 
@@ -2022,21 +4080,20 @@ def chatbot_resposta_com_gpt(pergunta, contexto_pdf=None, dados_municipio=None):
             Responda sempre em português brasileiro, seja preciso com os números e cite as fontes (CNES, IBGE, etc.).
             """
             
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": prompt_sistema},
-                    {"role": "user", "content": pergunta}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-            
-            resposta_gpt = response.choices[0].message.content.strip()
+            def consultar(publicar):
+                resposta = consultar_chatgpt(pergunta, prompt_sistema, publicar if ao_receber is not None else None)
+                if cache_respostas is not None:
+                    cache_respostas.guardar(chave, municipio_id, pergunta, resposta)
+                return resposta
             
-            # Adicionar badge indicando uso do ChatGPT
-            return f"🤖 **ChatGPT + Dados Reais**\n\n{resposta_gpt}"
+            # Pedidos idênticos em andamento (mesma chave do cache) aproveitam a mesma chamada
+            return chamadas_llm.executar(chave, consultar, ao_receber)
             
+        except DisjuntorAberto as e:
+            # API marcada como indisponível: resposta local imediata, sem esperar timeout
+            st.info(f"⚡ {e}. Usando resposta local.")
+            return chatbot_resposta_local(pergunta, contexto_pdf, dados_municipio)
+        
         except Exception as e:
             # Se der erro na API, usar fallback
             st.warning(f"⚠️ Erro na API OpenAI: {str(e)[:100]}... Usando resposta local.")
@@ -2138,6 +4195,1177 @@ Posso ajudar com informações sobre:
 
 Faça uma pergunta específica sobre qualquer um desses temas!"""
 
+# Ingestão de dados reais (DATASUS/TABNET)
+# Colunas aceitas nos arquivos mensais, já normalizadas (minúsculas, sem acento)
+COLUNAS_DATASUS = {
+    'codigo_ibge': ['codigo_ibge', 'cod_ibge', 'co_municipio', 'cod_municipio', 'municipio', 'municipio_ibge'],
+    'competencia': ['competencia', 'ano_mes', 'anomes'],
+    'ano': ['ano', 'ano_processamento', 'ano_atendimento'],
+    'mes': ['mes', 'mes_processamento', 'mes_atendimento'],
+    'internacoes': ['internacoes', 'aih_aprovadas', 'qtd_internacoes'],
+    'obitos': ['obitos', 'qtd_obitos'],
+    'altas': ['altas', 'qtd_altas'],
+    'atendimentos_ubs': ['atendimentos_ubs', 'atendimentos'],
+    'cobertura_esf': ['cobertura_esf'],
+    'mortalidade_infantil': ['mortalidade_infantil', 'taxa_mortalidade_infantil']
+}
+METRICAS_SAUDE = ['internacoes', 'obitos', 'altas', 'atendimentos_ubs', 'cobertura_esf', 'mortalidade_infantil']
+CONTAGENS_SAUDE = ['internacoes', 'obitos', 'altas', 'atendimentos_ubs']
+
+def normalizar_texto(texto):
+    """Minúsculas, sem acentos e com espaços simples"""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+def mapear_colunas(colunas, aliases):
+    """Mapear colunas do arquivo para os nomes internos a partir dos aliases aceitos"""
+    mapeamento = {}
+    for coluna in colunas:
+        chave = normalizar_texto(coluna).replace(' ', '_')
+        for interno, opcoes in aliases.items():
+            if chave in opcoes and interno not in mapeamento.values():
+                mapeamento[coluna] = interno
+                break
+    return mapeamento
+
+def listar_arquivos_csv(caminhos):
+    """Expandir diretórios em seus arquivos .csv, em ordem de nome"""
+    arquivos = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            arquivos.extend(sorted(
+                os.path.join(caminho, nome) for nome in os.listdir(caminho) if nome.lower().endswith('.csv')
+            ))
+        else:
+            arquivos.append(caminho)
+    return arquivos
+
+def importar_datasus(db, caminho, tamanho_lote=50000, separador=';', encoding='latin-1', decimal=',', milhar='.'):
+    """Carregar um arquivo mensal do DATASUS em blocos, gravando apenas meses ainda não carregados"""
+    inicio = time.perf_counter()
+    relatorio = {'arquivo': caminho, 'lidas': 0, 'gravadas': 0, 'ja_carregadas': 0, 'sem_municipio': 0}
+    
+    cabecalho = pd.read_csv(caminho, sep=separador, encoding=encoding, nrows=0).columns
+    mapeamento = mapear_colunas(cabecalho, COLUNAS_DATASUS)
+    internas = set(mapeamento.values())
+    if 'codigo_ibge' not in internas or not ({'ano', 'mes'} <= internas or 'competencia' in internas):
+        raise ValueError(f"{caminho}: colunas de município e competência (ano/mês) não encontradas")
+    
+    with db.conexao() as conn:
+        municipios = dict(conn.execute('SELECT codigo_ibge, id FROM municipios'))
+        # Marca d'água: último mês REAL já carregado por município
+        marcas = dict(conn.execute('''
+            SELECT municipio_id, MAX(ano * 100 + mes) FROM dados_saude
+            WHERE tipo_dado = 'REAL' GROUP BY municipio_id
+        '''))
+    
+    colunas_sql = ['municipio_id', 'ano', 'mes'] + METRICAS_SAUDE
+    sql_upsert = f'''
+        INSERT INTO dados_saude ({', '.join(colunas_sql)}, fonte_dados, tipo_dado)
+        VALUES ({', '.join('?' * len(colunas_sql))}, 'DATASUS', 'REAL')
+        ON CONFLICT (municipio_id, ano, mes, tipo_dado) DO UPDATE SET
+            {', '.join(f'{c} = excluded.{c}' for c in METRICAS_SAUDE)},
+            fonte_dados = excluded.fonte_dados,
+            data_atualizacao = CURRENT_TIMESTAMP
+    '''
+    
+    blocos = pd.read_csv(
+        caminho, sep=separador, encoding=encoding, decimal=decimal, thousands=milhar,
+        usecols=list(mapeamento), dtype={coluna: str for coluna, interno in mapeamento.items() if interno == 'codigo_ibge'},
+        na_values=['-', '...'], chunksize=tamanho_lote
+    )
+    for bloco in blocos:
+        bloco = bloco.rename(columns=mapeamento)
+        relatorio['lidas'] += len(bloco)
+        
+        # Códigos de 6 ou 7 dígitos (com dígito verificador), inclusive "230530 GUARACIABA DO NORTE"
+        codigo = bloco['codigo_ibge'].astype(str).str.extract(r'(\d{6})', expand=False)
+        bloco['municipio_id'] = codigo.map(municipios)
+        if 'competencia' in bloco:
+            competencia = pd.to_numeric(bloco['competencia'].astype(str).str.replace(r'\D', '', regex=True), errors='coerce')
+            bloco['ano'], bloco['mes'] = competencia // 100, competencia % 100
+        bloco['ano'] = pd.to_numeric(bloco['ano'], errors='coerce')
+        bloco['mes'] = pd.to_numeric(bloco['mes'], errors='coerce')
+        
+        validas = bloco['municipio_id'].notna() & bloco['ano'].notna() & bloco['mes'].between(1, 12)
+        relatorio['sem_municipio'] += int((~validas).sum())
+        bloco = bloco[validas]
+        
+        periodo = bloco['ano'] * 100 + bloco['mes']
+        novas = periodo > bloco['municipio_id'].map(marcas).fillna(0)
+        relatorio['ja_carregadas'] += int((~novas).sum())
+        bloco = bloco[novas]
+        if bloco.empty:
+            continue
+        
+        for metrica in METRICAS_SAUDE:
+            if metrica not in bloco:
+                bloco[metrica] = None
+            elif metrica in CONTAGENS_SAUDE:
+                # No TABNET, "-" representa zero
+                bloco[metrica] = bloco[metrica].fillna(0)
+        bloco[['municipio_id', 'ano', 'mes']] = bloco[['municipio_id', 'ano', 'mes']].astype(int)
+        linhas = list(bloco[colunas_sql].astype(object).where(bloco[colunas_sql].notna(), None).itertuples(index=False, name=None))
+        
+        # Um bloco por transação: memória e tempo de bloqueio limitados pelo tamanho do lote
+        with db.conexao() as conn:
+            conn.executemany(sql_upsert, linhas)
+            # Meses com dado real deixam de exibir a série simulada
+            conn.executemany('''
+                DELETE FROM dados_saude
+                WHERE municipio_id = ? AND ano = ? AND mes = ? AND tipo_dado = 'SIMULADO'
+            ''', [linha[:3] for linha in linhas])
+        relatorio['gravadas'] += len(linhas)
+    
+    relatorio['segundos'] = time.perf_counter() - inicio
+    relatorio['linhas_por_segundo'] = relatorio['lidas'] / relatorio['segundos'] if relatorio['segundos'] > 0 else 0.0
+    return relatorio
+
+# Cadastros nacionais (CNES/INEP) com upsert pela chave natural
+CADASTROS = {
+    'cnes': {
+        'tabela': 'estabelecimentos_saude',
+        'chave': 'cnes',
+        'digitos_chave': 7,
+        'fonte_dados': 'CNES_REAL',
+        'colunas': {
+            'cnes': ['cnes', 'co_cnes'],
+            'codigo_ibge': ['co_municipio_gestor', 'co_municipio', 'codigo_ibge', 'co_ibge', 'municipio'],
+            'nome_fantasia': ['no_fantasia', 'nome_fantasia', 'estabelecimento'],
+            'tipo_estabelecimento': ['ds_tipo_unidade', 'tipo_unidade', 'tipo_estabelecimento'],
+            'natureza_juridica': ['ds_natureza_juridica', 'natureza_juridica'],
+            'gestao': ['tp_gestao', 'gestao'],
+            'atende_sus': ['st_atende_sus', 'atende_sus', 'sus'],
+            'endereco': ['no_logradouro', 'endereco', 'logradouro'],
+            'latitude': ['nu_latitude', 'latitude', 'lat'],
+            'longitude': ['nu_longitude', 'longitude', 'lon']
+        },
+        'codigos': {
+            'gestao': {'M': 'Municipal', 'E': 'Estadual', 'D': 'Dupla', 'S': 'Sem gestão'}
+        }
+    },
+    'inep': {
+        'tabela': 'escolas',
+        'chave': 'codigo_inep',
+        'digitos_chave': 8,
+        'fonte_dados': 'INEP_REAL',
+        'colunas': {
+            'codigo_inep': ['co_entidade', 'codigo_inep', 'cod_inep', 'codigo_escola'],
+            'codigo_ibge': ['co_municipio', 'codigo_ibge', 'co_ibge', 'municipio'],
+            'nome': ['no_entidade', 'nome', 'escola', 'nome_escola'],
+            'tipo_escola': ['tipo_escola', 'etapa', 'etapa_ensino'],
+            'dependencia_administrativa': ['tp_dependencia', 'dependencia_administrativa', 'dependencia'],
+            'localizacao': ['tp_localizacao', 'localizacao'],
+            'endereco': ['ds_endereco', 'endereco'],
+            'latitude': ['nu_latitude', 'latitude', 'lat'],
+            'longitude': ['nu_longitude', 'longitude', 'lon']
+        },
+        'codigos': {
+            'dependencia_administrativa': {'1': 'Federal', '2': 'Estadual', '3': 'Municipal', '4': 'Privada'},
+            'localizacao': {'1': 'Urbana', '2': 'Rural'}
+        }
+    }
+}
+
+def _valor_comparavel(valor):
+    """Normalizar valores do banco e do arquivo para detectar alterações reais"""
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return None
+    if isinstance(valor, (bool, np.bool_)):
+        return int(valor)
+    if isinstance(valor, (float, np.floating)):
+        return round(float(valor), 6)
+    if isinstance(valor, np.integer):
+        return int(valor)
+    return valor
+
+def importar_cadastro(db, tipo, caminho, tamanho_lote=20000, separador=';', encoding='latin-1'):
+    """Upsert em lote de um arquivo de cadastro, gravando só registros novos ou alterados"""
+    spec = CADASTROS[tipo]
+    tabela, chave = spec['tabela'], spec['chave']
+    inicio = time.perf_counter()
+    relatorio = {'arquivo': caminho, 'lidas': 0, 'inseridas': 0, 'atualizadas': 0, 'inalteradas': 0, 'sem_municipio': 0}
+    
+    cabecalho = pd.read_csv(caminho, sep=separador, encoding=encoding, nrows=0).columns
+    mapeamento = mapear_colunas(cabecalho, spec['colunas'])
+    internas = set(mapeamento.values())
+    if not {chave, 'codigo_ibge'} <= internas:
+        raise ValueError(f"{caminho}: colunas '{chave}' e de município não encontradas")
+    
+    # Apenas as colunas presentes no arquivo são comparadas e atualizadas
+    colunas = ['municipio_id'] + [c for c in spec['colunas'] if c in internas and c not in (chave, 'codigo_ibge')]
+    sql_insert = f'''
+        INSERT INTO {tabela} ({chave}, {', '.join(colunas)}, fonte_dados)
+        VALUES (?, {', '.join('?' * len(colunas))}, '{spec['fonte_dados']}')
+    '''
+    sql_update = f'''
+        UPDATE {tabela} SET {', '.join(f'{c} = ?' for c in colunas)}, fonte_dados = '{spec['fonte_dados']}',
+            data_atualizacao = CURRENT_TIMESTAMP
+        WHERE {chave} = ?
+    '''
+    
+    with db.conexao() as conn:
+        municipios = dict(conn.execute('SELECT codigo_ibge, id FROM municipios'))
+    
+    blocos = pd.read_csv(caminho, sep=separador, encoding=encoding, usecols=list(mapeamento),
+                         dtype=str, keep_default_na=False, chunksize=tamanho_lote)
+    for bloco in blocos:
+        bloco = bloco.rename(columns=mapeamento)
+        relatorio['lidas'] += len(bloco)
+        
+        bloco[chave] = bloco[chave].str.strip().str.zfill(spec['digitos_chave'])
+        bloco['municipio_id'] = bloco['codigo_ibge'].str.extract(r'(\d{6})', expand=False).map(municipios)
+        validas = bloco['municipio_id'].notna() & (bloco[chave].str.strip('0') != '')
+        relatorio['sem_municipio'] += int((~validas).sum())
+        bloco = bloco[validas].drop_duplicates(subset=chave, keep='last')
+        if bloco.empty:
+            continue
+        
+        bloco['municipio_id'] = bloco['municipio_id'].astype(int)
+        for coluna, codigos in spec['codigos'].items():
+            if coluna in bloco:
+                bloco[coluna] = bloco[coluna].str.strip().map(lambda v: codigos.get(v.upper(), v))
+        for coluna in ('latitude', 'longitude'):
+            if coluna in bloco:
+                bloco[coluna] = pd.to_numeric(bloco[coluna].str.replace(',', '.'), errors='coerce')
+        if 'atende_sus' in bloco:
+            bloco['atende_sus'] = bloco['atende_sus'].str.strip().str.upper().isin(['S', 'SIM', '1', 'TRUE'])
+        for coluna in colunas:
+            if bloco[coluna].dtype == object:
+                bloco[coluna] = bloco[coluna].str.strip().replace('', None)
+        
+        registros = {
+            linha[0]: tuple(_valor_comparavel(v) for v in linha[1:])
+            for linha in bloco[[chave] + colunas].astype(object).itertuples(index=False, name=None)
+        }
+        
+        # Estado atual das chaves do bloco (consultas em fatias para respeitar o limite de parâmetros)
+        existentes = {}
+        chaves = list(registros)
+        with db.conexao() as conn:
+            for i in range(0, len(chaves), 900):
+                fatia = chaves[i:i + 900]
+                for linha in conn.execute(
+                    f"SELECT {chave}, {', '.join(colunas)} FROM {tabela} WHERE {chave} IN ({', '.join('?' * len(fatia))})",
+                    fatia
+                ):
+                    existentes[linha[0]] = tuple(_valor_comparavel(v) for v in linha[1:])
+            
+            novos = [(k, *v) for k, v in registros.items() if k not in existentes]
+            alterados = [(*v, k) for k, v in registros.items() if k in existentes and existentes[k] != v]
+            conn.executemany(sql_insert, novos)
+            conn.executemany(sql_update, alterados)
+        
+        relatorio['inseridas'] += len(novos)
+        relatorio['atualizadas'] += len(alterados)
+        relatorio['inalteradas'] += len(registros) - len(novos) - len(alterados)
+    
+    relatorio['segundos'] = time.perf_counter() - inicio
+    relatorio['linhas_por_segundo'] = relatorio['lidas'] / relatorio['segundos'] if relatorio['segundos'] > 0 else 0.0
+    return relatorio
+
+# Geração de dados sintéticos para testes de carga
+UFS = ['AC', 'AL', 'AM', 'AP', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MG', 'MS', 'MT', 'PA',
+       'PB', 'PE', 'PI', 'PR', 'RJ', 'RN', 'RO', 'RR', 'RS', 'SC', 'SE', 'SP', 'TO']
+REGIOES_SINTETICAS = ['Centro', 'Norte', 'Sul', 'Leste', 'Oeste']
+PREFIXO_SINTETICO = 'S'
+
+def _linhas(*colunas):
+    """Converter colunas NumPy/listas em tuplas de tipos nativos para o executemany"""
+    return list(zip(*[coluna.tolist() if hasattr(coluna, 'tolist') else coluna for coluna in colunas]))
+
+def _periodos(ano_inicio, ano_fim):
+    """Pares (ano, mês) do período, respeitando o limite de julho no último ano"""
+    anos, meses = [], []
+    for ano in range(ano_inicio, ano_fim + 1):
+        max_mes = 7 if ano == ano_fim else 12
+        anos.extend([ano] * max_mes)
+        meses.extend(range(1, max_mes + 1))
+    return np.array(anos), np.array(meses)
+
+def gerar_dados_sinteticos(db, municipios=1000, ano_inicio=2023, ano_fim=2025, semente=42, tamanho_lote=50000):
+    """Gerar municípios e séries sintéticas em lotes NumPy, gravando tudo numa única transação"""
+    rng = np.random.default_rng(semente)
+    contagens = {}
+    inicio = time.perf_counter()
+    
+    def inserir(cursor, tabela, colunas, linhas):
+        cursor.executemany(
+            f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})", linhas
+        )
+        contagens[tabela] = contagens.get(tabela, 0) + len(linhas)
+    
+    with db.conexao() as conn:
+        cursor = conn.cursor()
+        
+        # Substituir uma geração anterior (códigos IBGE sintéticos começam com o prefixo)
+        ids_antigos = 'SELECT id FROM municipios WHERE codigo_ibge LIKE ?'
+        for tabela in ('dados_saude', 'estabelecimentos_saude', 'dados_educacao', 'escolas',
+                       'dados_seguranca', 'unidades_seguranca', 'dados_demograficos'):
+            cursor.execute(f'DELETE FROM {tabela} WHERE municipio_id IN ({ids_antigos})', (f'{PREFIXO_SINTETICO}%',))
+        cursor.execute('DELETE FROM municipios WHERE codigo_ibge LIKE ?', (f'{PREFIXO_SINTETICO}%',))
+        
+        # Municípios
+        populacao = np.clip(rng.lognormal(9.7, 1.1, municipios), 800, 12_000_000).astype(int)
+        area = rng.uniform(50, 5000, municipios).round(1)
+        latitude = rng.uniform(-33.0, 4.5, municipios).round(4)
+        longitude = rng.uniform(-73.0, -35.0, municipios).round(4)
+        codigos = [f'{PREFIXO_SINTETICO}{i:06d}' for i in range(1, municipios + 1)]
+        inserir(cursor, 'municipios',
+                ['nome', 'codigo_ibge', 'uf', 'populacao', 'area_km2', 'densidade_demografica',
+                 'pib_per_capita', 'idhm', 'latitude', 'longitude'],
+                _linhas([f'Município Sintético {i:06d}' for i in range(1, municipios + 1)], codigos,
+                        rng.choice(UFS, municipios), populacao, area, (populacao / area).round(1),
+                        rng.uniform(8000, 60000, municipios).round(0), rng.uniform(0.5, 0.85, municipios).round(3),
+                        latitude, longitude))
+        
+        cursor.execute('SELECT id FROM municipios WHERE codigo_ibge LIKE ? ORDER BY codigo_ibge',
+                       (f'{PREFIXO_SINTETICO}%',))
+        ids = np.array([linha[0] for linha in cursor.fetchall()])
+        fator = populacao / 40000
+        anos, meses = _periodos(ano_inicio, ano_fim)
+        anos_educacao = np.arange(ano_inicio - 3, ano_fim)
+        
+        # Lotes de municípios para limitar a memória das séries mensais/regionais
+        linhas_por_municipio = len(anos) * len(REGIOES_SINTETICAS)
+        municipios_por_lote = max(1, tamanho_lote // linhas_por_municipio)
+        
+        for inicio_lote in range(0, municipios, municipios_por_lote):
+            lote = slice(inicio_lote, inicio_lote + municipios_por_lote)
+            ids_lote, fator_lote = ids[lote], fator[lote]
+            lat_lote, lon_lote = latitude[lote], longitude[lote]
+            n = len(ids_lote)
+            
+            # Saúde: município x mês
+            muni = np.repeat(ids_lote, len(anos))
+            f = np.repeat(fator_lote, len(anos))
+            total = len(muni)
+            internacoes = (rng.uniform(15, 35, total) * f).astype(int)
+            inserir(cursor, 'dados_saude',
+                    ['municipio_id', 'ano', 'mes', 'internacoes', 'obitos', 'altas', 'atendimentos_ubs',
+                     'cobertura_esf', 'mortalidade_infantil', 'fonte_dados'],
+                    _linhas(muni, np.tile(anos, n), np.tile(meses, n), internacoes,
+                            (rng.uniform(1, 4, total) * f).astype(int),
+                            (internacoes * rng.uniform(0.85, 0.95, total)).astype(int),
+                            (rng.uniform(800, 1500, total) * f).astype(int),
+                            rng.uniform(85, 100, total), rng.uniform(12, 18, total), ['SINTETICO'] * total))
+            
+            # Segurança: município x mês x região
+            regioes_total = len(REGIOES_SINTETICAS)
+            muni = np.repeat(ids_lote, len(anos) * regioes_total)
+            f = np.repeat(fator_lote, len(anos) * regioes_total)
+            total = len(muni)
+            inserir(cursor, 'dados_seguranca',
+                    ['municipio_id', 'ano', 'mes', 'homicidios', 'roubos', 'furtos', 'violencia_domestica',
+                     'acidentes_transito', 'regiao', 'latitude', 'longitude', 'fonte_dados'],
+                    _linhas(muni, np.tile(np.repeat(anos, regioes_total), n), np.tile(np.repeat(meses, regioes_total), n),
+                            np.maximum(0, (rng.uniform(0, 2, total) * f).astype(int)),
+                            np.maximum(1, (rng.uniform(3, 8, total) * f).astype(int)),
+                            np.maximum(2, (rng.uniform(5, 15, total) * f).astype(int)),
+                            np.maximum(1, (rng.uniform(2, 6, total) * f).astype(int)),
+                            np.maximum(2, (rng.uniform(4, 12, total) * f).astype(int)),
+                            np.tile(REGIOES_SINTETICAS, n * len(anos)),
+                            (np.repeat(lat_lote, len(anos) * regioes_total) + rng.uniform(-0.02, 0.02, total)).round(5),
+                            (np.repeat(lon_lote, len(anos) * regioes_total) + rng.uniform(-0.02, 0.02, total)).round(5),
+                            ['SINTETICO'] * total))
+            
+            # Educação e demografia: município x ano
+            muni = np.repeat(ids_lote, len(anos_educacao))
+            f = np.repeat(fator_lote, len(anos_educacao))
+            total = len(muni)
+            matriculas = (rng.uniform(6000, 8000, total) * f).astype(int)
+            inserir(cursor, 'dados_educacao',
+                    ['municipio_id', 'ano', 'matriculas_total', 'matriculas_infantil', 'matriculas_fundamental',
+                     'matriculas_medio', 'escolas_total', 'docentes_total', 'ideb_anos_iniciais', 'ideb_anos_finais',
+                     'taxa_aprovacao', 'taxa_abandono', 'fonte_dados'],
+                    _linhas(muni, np.tile(anos_educacao, n), matriculas, (matriculas * 0.25).astype(int),
+                            (matriculas * 0.65).astype(int), (matriculas * 0.10).astype(int),
+                            np.maximum(1, (rng.uniform(25, 45, total) * f).astype(int)),
+                            np.maximum(1, (rng.uniform(300, 500, total) * f).astype(int)),
+                            rng.uniform(4.5, 6.2, total), rng.uniform(3.8, 5.5, total),
+                            rng.uniform(85, 95, total), rng.uniform(2, 8, total), ['SINTETICO'] * total))
+            
+            pop_total = (np.repeat(populacao[lote], len(anos_educacao)) * rng.uniform(0.97, 1.03, total)).astype(int)
+            urbana = (pop_total * rng.uniform(0.4, 0.95, total)).astype(int)
+            masculina = (pop_total * rng.uniform(0.47, 0.51, total)).astype(int)
+            inserir(cursor, 'dados_demograficos',
+                    ['municipio_id', 'ano', 'populacao_total', 'populacao_urbana', 'populacao_rural',
+                     'populacao_masculina', 'populacao_feminina', 'nascimentos', 'obitos', 'fonte_dados', 'tipo_dado'],
+                    _linhas(muni, np.tile(anos_educacao, n), pop_total, urbana, pop_total - urbana,
+                            masculina, pop_total - masculina, (pop_total * rng.uniform(0.010, 0.016, total)).astype(int),
+                            (pop_total * rng.uniform(0.005, 0.008, total)).astype(int),
+                            ['SINTETICO'] * total, ['SIMULADO'] * total))
+            
+            # Cadastros com coordenadas: quantidade proporcional à população
+            for tabela, colunas, por_habitante, minimo in (
+                ('escolas', ['municipio_id', 'codigo_inep', 'nome', 'tipo_escola', 'dependencia_administrativa',
+                             'localizacao', 'latitude', 'longitude', 'fonte_dados'], 1 / 1500, 3),
+                ('estabelecimentos_saude', ['municipio_id', 'cnes', 'nome_fantasia', 'tipo_estabelecimento',
+                                            'natureza_juridica', 'gestao', 'atende_sus', 'latitude', 'longitude',
+                                            'fonte_dados'], 1 / 3000, 2),
+                ('unidades_seguranca', ['municipio_id', 'nome', 'tipo_unidade', 'endereco', 'telefone',
+                                        'latitude', 'longitude', 'fonte_dados'], 1 / 20000, 1)
+            ):
+                quantidades = np.maximum(minimo, rng.poisson(populacao[lote] * por_habitante))
+                muni = np.repeat(ids_lote, quantidades)
+                total = len(muni)
+                sequencia = np.arange(total) - np.repeat(np.cumsum(quantidades) - quantidades, quantidades) + 1
+                indice_municipio = np.repeat(np.arange(inicio_lote, inicio_lote + n) + 1, quantidades)
+                codigos = [f'{PREFIXO_SINTETICO}{m:06d}{s:05d}' for m, s in zip(indice_municipio.tolist(), sequencia.tolist())]
+                lat = (np.repeat(lat_lote, quantidades) + rng.uniform(-0.05, 0.05, total)).round(5)
+                lon = (np.repeat(lon_lote, quantidades) + rng.uniform(-0.05, 0.05, total)).round(5)
+                
+                if tabela == 'escolas':
+                    linhas = _linhas(muni, codigos, [f'ESCOLA SINTÉTICA {c}' for c in codigos],
+                                     rng.choice(['Creche', 'Pré-escola', 'Ensino Fundamental', 'Ensino Médio'], total),
+                                     rng.choice(['Municipal', 'Estadual', 'Federal', 'Privada'], total, p=[0.6, 0.3, 0.02, 0.08]),
+                                     rng.choice(['Urbana', 'Rural'], total), lat, lon, ['SINTETICO'] * total)
+                elif tabela == 'estabelecimentos_saude':
+                    linhas = _linhas(muni, codigos, [f'ESTABELECIMENTO SINTÉTICO {c}' for c in codigos],
+                                     rng.choice(['UBS', 'Hospital', 'CAPS', 'CEO'], total, p=[0.7, 0.1, 0.1, 0.1]),
+                                     ['ADMINISTRAÇÃO PÚBLICA'] * total, ['Municipal'] * total, [True] * total,
+                                     lat, lon, ['SINTETICO'] * total)
+                else:
+                    linhas = _linhas(muni, [f'UNIDADE SINTÉTICA {c}' for c in codigos],
+                                     rng.choice(['Delegacia', 'Posto PM', 'Bombeiros', 'Guarda Municipal'], total),
+                                     [f'Rua Principal, {s}00, Centro' for s in sequencia.tolist()],
+                                     [f'(00) 9999-{s:04d}' for s in sequencia.tolist()], lat, lon, ['SINTETICO'] * total)
+                inserir(cursor, tabela, colunas, linhas)
+        
+        # Quadros do heatmap animado dos meses tocados pela geração (inclusive os removidos)
+        recalcular_quadros_heatmap(cursor)
+    
+    duracao = time.perf_counter() - inicio
+    total_linhas = sum(contagens.values())
+    return {
+        'linhas': contagens,
+        'total_linhas': total_linhas,
+        'segundos': duracao,
+        'linhas_por_segundo': total_linhas / duracao if duracao > 0 else 0.0
+    }
+
+# Tiles offline (MBTiles) e servidor local
+ESQUEMA_MBTILES = '''
+    CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS tiles (
+        zoom_level INTEGER NOT NULL,
+        tile_column INTEGER NOT NULL,
+        tile_row INTEGER NOT NULL,
+        tile_data BLOB NOT NULL,
+        PRIMARY KEY (zoom_level, tile_column, tile_row)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS recursos (caminho TEXT PRIMARY KEY, dados BLOB NOT NULL) WITHOUT ROWID;
+'''
+TIPOS_TILE = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp', 'pbf': 'application/x-protobuf'}
+ROTA_TILE = re.compile(r'^/(\d+)/(\d+)/(\d+)(?:\.\w+)?$')
+
+# JS/CSS dos mapas (Leaflet e plugins) vêm de CDNs; servir-tiles também os serve a partir do MBTiles
+CLASSES_MAPA = (folium.Map, FastMarkerCluster, HeatMap, HeatMapWithTime)
+PREFIXO_RECURSOS = '/recursos/'
+REFERENCIA_CSS = re.compile(r'url\(\s*[\'"]?([^\'")]+?)[\'"]?\s*\)')
+TIPOS_RECURSO = {
+    '.js': 'application/javascript', '.css': 'text/css', '.png': 'image/png', '.svg': 'image/svg+xml',
+    '.gif': 'image/gif', '.woff2': 'font/woff2', '.woff': 'font/woff', '.ttf': 'font/ttf',
+    '.eot': 'application/vnd.ms-fontobject'
+}
+
+def tile_xy(latitude, longitude, zoom):
+    """Coluna e linha (esquema XYZ) do tile que contém o ponto"""
+    n = 2 ** zoom
+    latitude = max(min(latitude, 85.0511), -85.0511)
+    lat_rad = math.radians(latitude)
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def area_municipio(latitude, longitude, raio_km=TILES_RAIO_KM):
+    """Retângulo (min_lat, min_lon, max_lat, max_lon) ao redor da sede do município"""
+    delta_lat = raio_km / RAIO_TERRA_KM * 180 / math.pi
+    delta_lon = delta_lat / max(math.cos(math.radians(latitude)), 0.01)
+    return latitude - delta_lat, longitude - delta_lon, latitude + delta_lat, longitude + delta_lon
+
+def tiles_da_area(min_lat, min_lon, max_lat, max_lon, zoom_min, zoom_max):
+    """Tiles (z, x, y) que cobrem o retângulo em cada nível de zoom"""
+    for zoom in range(zoom_min, zoom_max + 1):
+        x_min, y_min = tile_xy(max_lat, min_lon, zoom)
+        x_max, y_max = tile_xy(min_lat, max_lon, zoom)
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                yield zoom, x, y
+
+def abrir_mbtiles(arquivo, somente_leitura=False):
+    """Abrir (ou criar) o arquivo MBTiles"""
+    if somente_leitura:
+        return sqlite3.connect(f'file:{arquivo}?mode=ro', uri=True, check_same_thread=False)
+    conn = sqlite3.connect(arquivo)
+    conn.executescript(ESQUEMA_MBTILES)
+    return conn
+
+def baixar_url(url, timeout=20):
+    """Baixar um arquivo; devolve os bytes ou None em caso de falha"""
+    pedido = urllib.request.Request(url, headers={'User-Agent': 'PROCESS-MIND/1.0 (cache offline de tiles)'})
+    try:
+        with urllib.request.urlopen(pedido, timeout=timeout) as resposta:
+            return resposta.read()
+    except (OSError, ValueError):
+        return None
+
+def baixar_tile(origem, zoom, x, y, timeout=20):
+    """Baixar um tile da origem; devolve os bytes ou None em caso de falha"""
+    return baixar_url(origem.format(z=zoom, x=x, y=y, s='a'), timeout)
+
+class LimitadorTaxa:
+    """Intervalo mínimo entre requisições, compartilhado pelas threads de download"""
+    
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self._proxima = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def aguardar(self):
+        with self._lock:
+            agora = time.monotonic()
+            espera = self._proxima - agora
+            self._proxima = max(agora, self._proxima) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+def caminho_recurso(url):
+    """Caminho local (/recursos/<host>/<caminho>) de um JS/CSS/fonte do CDN; mantém as referências relativas dos CSS"""
+    partes = urllib.parse.urlsplit(url)
+    return f'{PREFIXO_RECURSOS}{partes.netloc}{partes.path}'
+
+def urls_recursos_mapa(classes=CLASSES_MAPA):
+    """URLs dos JS/CSS que o folium inclui nos mapas"""
+    return sorted({url for classe in classes for atributo in ('default_js', 'default_css')
+                   for _, url in getattr(classe, atributo, [])})
+
+def usar_recursos_locais(base_url, classes=CLASSES_MAPA):
+    """Apontar os JS/CSS dos mapas para o servidor local (servir-tiles) em vez dos CDNs"""
+    base_url = base_url.rstrip('/')
+    for classe in classes:
+        for atributo in ('default_js', 'default_css'):
+            setattr(classe, atributo, [
+                (nome, url if url.startswith(base_url) else base_url + caminho_recurso(url))
+                for nome, url in getattr(classe, atributo, [])
+            ])
+
+def semear_recursos_mapa(conn, timeout=20):
+    """Baixar para o MBTiles os JS/CSS dos mapas e as fontes/imagens referenciadas pelos CSS"""
+    pendentes, vistos = urls_recursos_mapa(), set()
+    baixados = falhas = 0
+    while pendentes:
+        url = pendentes.pop()
+        caminho = caminho_recurso(url)
+        if caminho in vistos:
+            continue
+        vistos.add(caminho)
+        
+        linha = conn.execute('SELECT dados FROM recursos WHERE caminho = ?', (caminho,)).fetchone()
+        dados = linha[0] if linha else baixar_url(url, timeout)
+        if dados is None:
+            falhas += 1
+            continue
+        if linha is None:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO recursos VALUES (?, ?)', (caminho, dados))
+            baixados += 1
+        
+        if caminho.endswith('.css'):
+            for referencia in REFERENCIA_CSS.findall(dados.decode('utf-8', 'replace')):
+                if not referencia.startswith(('data:', '#')):
+                    pendentes.append(urllib.parse.urljoin(url, referencia))
+    return {'recursos': len(vistos), 'baixados': baixados, 'falhas': falhas}
+
+def semear_tiles(arquivo, municipios, zoom_min=8, zoom_max=TILES_ZOOM_MAX, raio_km=TILES_RAIO_KM,
+                 origem=None, trabalhadores=2, tamanho_lote=200, por_segundo=TILES_POR_SEGUNDO, maximo=TILES_MAXIMO):
+    """Baixar para o MBTiles os tiles da área de cada município (lista de (nome, latitude, longitude))"""
+    # Sem origem padrão: a política de uso do tile.openstreetmap.org proíbe download em massa
+    origem = origem or TILES_ORIGEM
+    if not origem:
+        raise ValueError("Informe a origem dos tiles (--origem ou PROCESS_MIND_TILES_ORIGEM): "
+                         "um servidor próprio ou um provedor que permita download em massa")
+    inicio = time.perf_counter()
+    pendentes, limites = set(), None
+    for _, latitude, longitude in municipios:
+        area = area_municipio(latitude, longitude, raio_km)
+        limites = area if limites is None else (min(limites[0], area[0]), min(limites[1], area[1]),
+                                                max(limites[2], area[2]), max(limites[3], area[3]))
+        pendentes.update(tiles_da_area(*area, zoom_min, zoom_max))
+    total = len(pendentes)
+    
+    conn = abrir_mbtiles(arquivo)
+    # MBTiles usa o esquema TMS: a linha cresce do sul para o norte
+    existentes = {
+        (zoom, x, 2 ** zoom - 1 - linha)
+        for zoom, x, linha in conn.execute(
+            'SELECT zoom_level, tile_column, tile_row FROM tiles WHERE zoom_level BETWEEN ? AND ?', (zoom_min, zoom_max)
+        )
+    }
+    pendentes -= existentes
+    if maximo and len(pendentes) > maximo:
+        conn.close()
+        raise ValueError(f"{len(pendentes):,} tiles a baixar excedem o máximo de {maximo:,}: reduza o zoom, o raio ou "
+                         f"os municípios (ou aumente --maximo, se a origem permitir)")
+    
+    limitador = LimitadorTaxa(por_segundo)
+    
+    def baixar(tile):
+        limitador.aguardar()
+        return baixar_tile(origem, *tile)
+    
+    baixados = falhas = total_bytes = 0
+    lote = []
+    with ThreadPoolExecutor(max_workers=max(1, trabalhadores)) as executor:
+        ordenados = sorted(pendentes)
+        for (zoom, x, y), dados in zip(ordenados, executor.map(baixar, ordenados)):
+            if dados is None:
+                falhas += 1
+                continue
+            lote.append((zoom, x, 2 ** zoom - 1 - y, dados))
+            baixados += 1
+            total_bytes += len(dados)
+            if len(lote) >= tamanho_lote:
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)', lote)
+                lote = []
+    
+    formato = origem.rsplit('.', 1)[-1].split('?')[0].lower()
+    metadados = {
+        'name': 'PROCESS MIND - mapa base offline',
+        'format': formato if formato in TIPOS_TILE else 'png',
+        'type': 'baselayer',
+        'minzoom': str(zoom_min),
+        'maxzoom': str(zoom_max),
+        'attribution': TILES_ATRIBUICAO
+    }
+    if limites is not None:
+        metadados['bounds'] = f'{limites[1]:.6f},{limites[0]:.6f},{limites[3]:.6f},{limites[2]:.6f}'
+    with conn:
+        if lote:
+            conn.executemany('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)', lote)
+        conn.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?)', metadados.items())
+    recursos = semear_recursos_mapa(conn)
+    conn.close()
+    
+    return {
+        'municipios': len(municipios),
+        'tiles': total,
+        'ja_existentes': total - len(pendentes),
+        'baixados': baixados,
+        'falhas': falhas,
+        'mb': total_bytes / 1024 ** 2,
+        'recursos': recursos,
+        'segundos': time.perf_counter() - inicio
+    }
+
+class ManipuladorTiles(BaseHTTPRequestHandler):
+    """Responde GET /{z}/{x}/{y}.png com o tile e GET /recursos/... com o JS/CSS lidos do MBTiles"""
+    
+    def do_GET(self):
+        caminho = self.path.split('?')[0]
+        if caminho.startswith(PREFIXO_RECURSOS):
+            extensao = os.path.splitext(caminho)[1].lower()
+            self.responder(self.server.ler_recurso(caminho), TIPOS_RECURSO.get(extensao, 'application/octet-stream'))
+            return
+        
+        rota = ROTA_TILE.match(caminho)
+        if not rota:
+            self.send_error(404)
+            return
+        
+        zoom, x, y = (int(valor) for valor in rota.groups())
+        self.responder(self.server.ler_tile(zoom, x, 2 ** zoom - 1 - y), self.server.tipo_conteudo)
+    
+    def responder(self, linha, tipo_conteudo):
+        if linha is None:
+            self.send_error(404)
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', tipo_conteudo)
+        self.send_header('Content-Length', str(len(linha)))
+        self.send_header('Cache-Control', 'public, max-age=604800')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(linha)
+    
+    def log_message(self, formato, *args):
+        # Os navegadores pedem dezenas de tiles por movimento do mapa: sem log por requisição
+        pass
+
+class ServidorTiles(ThreadingHTTPServer):
+    """Servidor HTTP de tiles a partir de um arquivo MBTiles (uma conexão somente leitura por thread)"""
+    
+    daemon_threads = True
+    
+    def __init__(self, arquivo, host='0.0.0.0', porta=8081):
+        if not os.path.exists(arquivo):
+            raise ValueError(f"Arquivo de tiles não encontrado: {arquivo} (use o comando semear-tiles)")
+        self.arquivo = arquivo
+        self._local = threading.local()
+        conn = abrir_mbtiles(arquivo, somente_leitura=True)
+        formato = conn.execute("SELECT value FROM metadata WHERE name = 'format'").fetchone()
+        conn.close()
+        self.tipo_conteudo = TIPOS_TILE.get(formato[0] if formato else 'png', 'image/png')
+        super().__init__((host, porta), ManipuladorTiles)
+    
+    def ler_tile(self, zoom, coluna, linha):
+        """Bytes do tile (coordenadas TMS) ou None"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = abrir_mbtiles(self.arquivo, somente_leitura=True)
+        resultado = conn.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', (zoom, coluna, linha)
+        ).fetchone()
+        return resultado[0] if resultado else None
+    
+    def ler_recurso(self, caminho):
+        """Bytes do JS/CSS/fonte semeado (ou None; arquivos antigos não têm a tabela recursos)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = abrir_mbtiles(self.arquivo, somente_leitura=True)
+        try:
+            resultado = conn.execute('SELECT dados FROM recursos WHERE caminho = ?', (caminho,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return resultado[0] if resultado else None
+
+# Benchmarks e ferramentas de linha de comando
+def resumir_tempos(tempos):
+    """Resumo estatístico (em ms) de uma lista de tempos em segundos"""
+    if not tempos:
+        return {'amostras': 0, 'media_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+    tempos_ms = np.asarray(tempos) * 1000
+    return {
+        'amostras': len(tempos_ms),
+        'media_ms': float(tempos_ms.mean()),
+        'p50_ms': float(np.percentile(tempos_ms, 50)),
+        'p95_ms': float(np.percentile(tempos_ms, 95)),
+        'p99_ms': float(np.percentile(tempos_ms, 99))
+    }
+
+def _rerun_sem_pool(db_path, municipio_id):
+    """Leituras de um rerun do dashboard abrindo uma conexão por consulta"""
+    consultas = [
+        (CONSULTAS['obter_dados_saude'], (municipio_id, 2023, 2025)),
+        (CONSULTAS['obter_estabelecimentos_saude'], (municipio_id,)),
+        (CONSULTAS['obter_dados_educacao'], (municipio_id,)),
+        (CONSULTAS['obter_escolas'], (municipio_id,)),
+        (CONSULTAS['obter_dados_seguranca'], (municipio_id, 2023, 2025)),
+        (CONSULTAS['obter_unidades_seguranca'], (municipio_id,)),
+        (CONSULTAS['obter_dados_demograficos'], (municipio_id,))
+    ]
+    for sql, params in consultas:
+        conn = sqlite3.connect(db_path)
+        pd.read_sql_query(sql, conn, params=params)
+        conn.close()
+
+def _rerun_com_pool(db, municipio_id):
+    """Leituras de um rerun do dashboard usando os métodos do ProcessMindDB"""
+    db.obter_dados_saude(municipio_id, 2023, 2025)
+    db.obter_estabelecimentos_saude(municipio_id)
+    db.obter_dados_educacao(municipio_id)
+    db.obter_escolas(municipio_id)
+    db.obter_dados_seguranca(municipio_id, 2023, 2025)
+    db.obter_unidades_seguranca(municipio_id)
+    db.obter_dados_demograficos(municipio_id)
+
+def benchmark_pool_conexoes(db_path=DB_PATH, sessoes=20, reruns=10, tamanho_pool=DB_POOL_TAMANHO):
+    """Comparar a latência de leitura por rerun com e sem pool, com várias sessões simultâneas"""
+    db = ProcessMindDB(db_path, tamanho_pool=tamanho_pool, cache_mb=0)
+    with db.conexao() as conn:
+        municipios = [linha[0] for linha in conn.execute('SELECT id FROM municipios ORDER BY id')]
+    
+    def medir(rerun):
+        tempos = []
+        
+        def sessao(indice):
+            municipio_id = municipios[indice % len(municipios)]
+            for _ in range(reruns):
+                inicio = time.perf_counter()
+                rerun(municipio_id)
+                tempos.append(time.perf_counter() - inicio)
+        
+        with ThreadPoolExecutor(max_workers=sessoes) as executor:
+            list(executor.map(sessao, range(sessoes)))
+        return resumir_tempos(tempos)
+    
+    resultados = {
+        'sem_pool': medir(lambda municipio_id: _rerun_sem_pool(db_path, municipio_id)),
+        'com_pool': medir(lambda municipio_id: _rerun_com_pool(db, municipio_id))
+    }
+    resultados['com_pool']['estatisticas_pool'] = dict(db.pool.estatisticas)
+    db.pool.fechar()
+    return resultados
+
+def verificar_planos_consulta(db, consultas=None):
+    """Rodar EXPLAIN QUERY PLAN em cada consulta e apontar varreduras completas ou ordenações temporárias"""
+    consultas = consultas or CONSULTAS
+    resultados = []
+    with db.conexao() as conn:
+        for nome, sql in consultas.items():
+            parametros = (1,) * sql.count('?')
+            plano = [linha[3] for linha in conn.execute(f'EXPLAIN QUERY PLAN {sql}', parametros)]
+            problemas = [
+                passo for passo in plano
+                if passo.startswith('SCAN') or 'TEMP B-TREE' in passo
+            ]
+            resultados.append({'consulta': nome, 'plano': plano, 'problemas': problemas})
+    return resultados
+
+def benchmark_concorrencia_pragma(db_path=DB_PATH, perfis=None, leitores=8, duracao=5.0):
+    """Medir a latência de leitura com N leitores e um escritor contínuo para cada perfil de PRAGMA"""
+    perfis = perfis or list(PERFIS_PRAGMA)
+    resultados = {}
+    
+    for perfil in perfis:
+        # Cada perfil roda numa cópia isolada, pois journal_mode é persistente no arquivo
+        with tempfile.TemporaryDirectory() as diretorio:
+            copia = os.path.join(diretorio, 'benchmark.db')
+            with sqlite3.connect(db_path) as origem, sqlite3.connect(copia) as destino:
+                origem.backup(destino)
+            
+            db = ProcessMindDB(copia, tamanho_pool=leitores + 1, perfil_pragma=perfil, cache_mb=0)
+            with db.conexao() as conn:
+                municipios = [linha[0] for linha in conn.execute('SELECT id FROM municipios ORDER BY id')]
+            
+            parar = threading.Event()
+            tempos = []
+            contadores = {'escritas': 0, 'erros': 0}
+            
+            def escritor():
+                while not parar.is_set():
+                    try:
+                        db.salvar_conversa_chat(municipios[0], 'benchmark', 'resposta ' * 50)
+                        contadores['escritas'] += 1
+                    except sqlite3.OperationalError:
+                        contadores['erros'] += 1
+            
+            def leitor(indice):
+                municipio_id = municipios[indice % len(municipios)]
+                while not parar.is_set():
+                    inicio = time.perf_counter()
+                    try:
+                        db.obter_dados_saude(municipio_id, 2023, 2025)
+                        db.obter_dados_seguranca(municipio_id, 2023, 2025)
+                        tempos.append(time.perf_counter() - inicio)
+                    except sqlite3.OperationalError:
+                        contadores['erros'] += 1
+            
+            threads = [threading.Thread(target=escritor)]
+            threads += [threading.Thread(target=leitor, args=(i,)) for i in range(leitores)]
+            for thread in threads:
+                thread.start()
+            time.sleep(duracao)
+            parar.set()
+            for thread in threads:
+                thread.join()
+            db.pool.fechar()
+            
+            resultados[perfil] = {**resumir_tempos(tempos), **contadores}
+    
+    return resultados
+
+def benchmark_heatmap(pontos=(10000, 100000), tamanho_celula_m=500, semente=42):
+    """Tempo de construção e tamanho do HTML do heatmap: pontos brutos x grade (numpy e SQL)"""
+    rng = np.random.default_rng(semente)
+    centro_lat, centro_lon = -4.1667, -40.75
+    resultados = []
+    with tempfile.TemporaryDirectory() as diretorio:
+        db = ProcessMindDB(os.path.join(diretorio, 'benchmark.db'), cache_mb=0)
+        for indice, total in enumerate(pontos):
+            municipio_id = 900000 + indice
+            df = pd.DataFrame({
+                'municipio_id': municipio_id,
+                'ano': rng.integers(2023, 2026, total),
+                'mes': rng.integers(1, 13, total),
+                **{coluna: rng.poisson(1.0, total) for coluna in TIPOS_CRIME},
+                'regiao': 'Centro',
+                'latitude': centro_lat + rng.normal(0, 0.05, total),
+                'longitude': centro_lon + rng.normal(0, 0.05, total)
+            })
+            with db.conexao() as conn:
+                conn.executemany(
+                    f"INSERT INTO dados_seguranca ({', '.join(df.columns)}) VALUES ({', '.join('?' * len(df.columns))})",
+                    df.itertuples(index=False, name=None)
+                )
+            
+            construtores = {
+                'pontos brutos': lambda: criar_heatmap_seguranca(df, centro_lat, centro_lon),
+                'grade (numpy)': lambda: criar_heatmap_grade(
+                    agregar_grade_criminalidade(df, tamanho_celula_m, centro_lat), centro_lat, centro_lon),
+                'grade (SQL)': lambda: criar_heatmap_grade(
+                    db.obter_grade_criminalidade(municipio_id, 2023, 2025, tamanho_celula_m, centro_lat), centro_lat, centro_lon)
+            }
+            for modo, construir in construtores.items():
+                inicio = time.perf_counter()
+                html = construir().get_root().render()
+                resultados.append({
+                    'pontos': total, 'modo': modo,
+                    'segundos': time.perf_counter() - inicio, 'html_mb': len(html.encode('utf-8')) / 1024 ** 2
+                })
+        db.pool.fechar()
+    return resultados
+
+def benchmark_mapas(pontos=(1000, 10000, 100000), semente=42):
+    """Tempo de construção e tamanho do HTML do mapa de estabelecimentos: marcadores individuais x cluster"""
+    rng = np.random.default_rng(semente)
+    centro_lat, centro_lon = -4.1667, -40.75
+    resultados = []
+    for total in pontos:
+        df = pd.DataFrame({
+            'nome_fantasia': [f'ESTABELECIMENTO SINTÉTICO {i}' for i in range(total)],
+            'tipo_estabelecimento': rng.choice(['UBS', 'Hospital', 'CAPS', 'CEO'], total),
+            'cnes': [f'{i:07d}' for i in range(total)],
+            'gestao': 'Municipal',
+            'atende_sus': True,
+            'latitude': centro_lat + rng.normal(0, 1.5, total),
+            'longitude': centro_lon + rng.normal(0, 1.5, total)
+        })
+        for modo, limite in (('marcadores', total), ('cluster', 0)):
+            inicio = time.perf_counter()
+            html = criar_mapa_estabelecimentos(df, centro_lat, centro_lon, limite).get_root().render()
+            resultados.append({
+                'pontos': total, 'modo': modo,
+                'segundos': time.perf_counter() - inicio, 'html_mb': len(html.encode('utf-8')) / 1024 ** 2
+            })
+    return resultados
+
+def imprimir_resumo_tempos(titulo, resumos):
+    """Imprimir uma tabela de resumos de tempos no terminal"""
+    print(f"\n{titulo}")
+    print(f"{'cenário':<24}{'amostras':>10}{'média':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for nome, resumo in resumos.items():
+        print(f"{nome:<24}{resumo['amostras']:>10}{resumo['media_ms']:>10.2f}{resumo['p50_ms']:>10.2f}"
+              f"{resumo['p95_ms']:>10.2f}{resumo['p99_ms']:>10.2f}")
+
+def cli_benchmark_pool(args):
+    """Comando: benchmark do pool de conexões"""
+    resultados = benchmark_pool_conexoes(args.db, args.sessoes, args.reruns, args.tamanho_pool)
+    imprimir_resumo_tempos(
+        f"Latência de leitura por rerun ({args.sessoes} sessões x {args.reruns} reruns)", resultados
+    )
+    print(f"Pool: {resultados['com_pool']['estatisticas_pool']}")
+    return 0
+
+def cli_benchmark_pragma(args):
+    """Comando: leitores concorrentes contra um escritor para cada perfil de PRAGMA"""
+    perfis = args.perfis.split(',') if args.perfis else None
+    resultados = benchmark_concorrencia_pragma(args.db, perfis, args.leitores, args.duracao)
+    imprimir_resumo_tempos(
+        f"Latência de leitura com {args.leitores} leitores e 1 escritor ({args.duracao:.0f}s por perfil)", resultados
+    )
+    for perfil, resultado in resultados.items():
+        print(f"{perfil}: {resultado['escritas']} escritas, {resultado['erros']} erros de bloqueio")
+    return 0
+
+def cli_benchmark_mapas(args):
+    """Comando: construção e tamanho dos mapas de pontos por modo de renderização"""
+    print(f"{'pontos':>10}  {'modo':<12}{'construção (s)':>16}{'HTML (MB)':>12}")
+    for resultado in benchmark_mapas(args.pontos, args.semente):
+        print(f"{resultado['pontos']:>10}  {resultado['modo']:<12}{resultado['segundos']:>16.2f}{resultado['html_mb']:>12.2f}")
+    print(f"\nLimite atual para cluster: {MAPA_LIMITE_MARCADORES} pontos (PROCESS_MIND_MAPA_LIMITE_MARCADORES)")
+    return 0
+
+def cli_benchmark_heatmap(args):
+    """Comando: construção e tamanho do heatmap por modo de agregação"""
+    print(f"{'pontos':>10}  {'modo':<16}{'construção (s)':>16}{'HTML (MB)':>12}  (células de {args.celula} m)")
+    for resultado in benchmark_heatmap(args.pontos, args.celula, args.semente):
+        print(f"{resultado['pontos']:>10}  {resultado['modo']:<16}{resultado['segundos']:>16.2f}{resultado['html_mb']:>12.2f}")
+    return 0
+
+def cli_gerar_sinteticos(args):
+    """Comando: gerar dados sintéticos em volume para testes de carga"""
+    db = ProcessMindDB(args.db)
+    relatorio = gerar_dados_sinteticos(db, args.municipios, args.ano_inicio, args.ano_fim,
+                                       args.semente, args.tamanho_lote)
+    for tabela, linhas in relatorio['linhas'].items():
+        print(f"{tabela:<26}{linhas:>12,} linhas")
+    print(f"\nTotal: {relatorio['total_linhas']:,} linhas em {relatorio['segundos']:.1f}s "
+          f"({relatorio['linhas_por_segundo']:,.0f} linhas/s)")
+    return 0
+
+def cli_importar_datasus(args):
+    """Comando: importar arquivos mensais do DATASUS/TABNET"""
+    db = ProcessMindDB(args.db)
+    for arquivo in listar_arquivos_csv(args.caminhos):
+        relatorio = importar_datasus(db, arquivo, args.tamanho_lote, args.separador, args.encoding)
+        print(f"{arquivo}: {relatorio['lidas']:,} lidas, {relatorio['gravadas']:,} gravadas, "
+              f"{relatorio['ja_carregadas']:,} já carregadas, {relatorio['sem_municipio']:,} sem município/competência "
+              f"({relatorio['linhas_por_segundo']:,.0f} linhas/s)")
+    return 0
+
+def cli_importar_cadastro(args):
+    """Comando: importar cadastros nacionais do CNES ou do INEP"""
+    db = ProcessMindDB(args.db)
+    for arquivo in listar_arquivos_csv(args.caminhos):
+        relatorio = importar_cadastro(db, args.tipo, arquivo, args.tamanho_lote, args.separador, args.encoding)
+        print(f"{arquivo}: {relatorio['lidas']:,} lidas, {relatorio['inseridas']:,} inseridas, "
+              f"{relatorio['atualizadas']:,} atualizadas, {relatorio['inalteradas']:,} inalteradas, "
+              f"{relatorio['sem_municipio']:,} sem município ({relatorio['linhas_por_segundo']:,.0f} linhas/s)")
+    return 0
+
+def cli_migrar(args):
+    """Comando: aplicar migrações pendentes e mostrar a versão do esquema"""
+    with sqlite3.connect(args.db) as conn:
+        versao_anterior = conn.execute('PRAGMA user_version').fetchone()[0]
+    
+    db = ProcessMindDB(args.db)
+    for versao, descricao, _ in MIGRACOES:
+        if versao > versao_anterior:
+            print(f"Aplicada migração {versao}: {descricao}")
+    print(f"Esquema: versão {versao_anterior} -> {db.versao_esquema()}")
+    return 0
+
+def cli_verificar_planos(args):
+    """Comando: regressão de planos de consulta (falha se houver varredura ou ordenação temporária)"""
+    db = ProcessMindDB(args.db)
+    falhas = 0
+    for resultado in verificar_planos_consulta(db):
+        situacao = 'FALHA' if resultado['problemas'] else 'ok'
+        falhas += bool(resultado['problemas'])
+        print(f"[{situacao:>5}] {resultado['consulta']}")
+        for passo in resultado['plano']:
+            print(f"          {passo}")
+    print(f"\n{falhas} consulta(s) com regressão de plano")
+    return 1 if falhas else 0
+
+def cli_semear_tiles(args):
+    """Comando: baixar para o MBTiles os tiles da área de cada município"""
+    with sqlite3.connect(args.db) as conn:
+        consulta = 'SELECT nome, latitude, longitude FROM municipios WHERE latitude IS NOT NULL AND longitude IS NOT NULL'
+        if args.municipios:
+            consulta += f" AND id IN ({','.join('?' * len(args.municipios))})"
+        municipios = conn.execute(consulta, args.municipios or []).fetchall()
+    if not municipios:
+        print("Nenhum município com coordenadas encontrado")
+        return 1
+    
+    try:
+        relatorio = semear_tiles(args.arquivo, municipios, args.zoom_min, args.zoom_max, args.raio,
+                                 args.origem, args.trabalhadores, por_segundo=args.por_segundo, maximo=args.maximo)
+    except ValueError as erro:
+        print(erro)
+        return 1
+    recursos = relatorio['recursos']
+    print(f"{relatorio['municipios']} município(s), {relatorio['tiles']:,} tiles (zoom {args.zoom_min}-{args.zoom_max}, "
+          f"raio de {args.raio:g} km)")
+    print(f"{relatorio['ja_existentes']:,} já existentes, {relatorio['baixados']:,} baixados ({relatorio['mb']:.1f} MB), "
+          f"{relatorio['falhas']:,} falhas em {relatorio['segundos']:.1f}s -> {args.arquivo}")
+    print(f"JS/CSS dos mapas: {recursos['recursos']} arquivo(s), {recursos['baixados']} baixado(s), {recursos['falhas']} falha(s)")
+    return 1 if relatorio['falhas'] or recursos['falhas'] else 0
+
+def cli_servir_tiles(args):
+    """Comando: servidor HTTP local dos tiles do MBTiles"""
+    servidor = ServidorTiles(args.arquivo, args.host, args.porta)
+    print(f"Servindo {args.arquivo} em http://{args.host}:{args.porta}/{{z}}/{{x}}/{{y}}.png")
+    print("Aponte os mapas com PROCESS_MIND_TILES_URL=http://<host>:<porta>/{z}/{x}/{y}.png e "
+          "PROCESS_MIND_RECURSOS_URL=http://<host>:<porta> (Ctrl+C encerra)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+    return 0
+
+def executar_cli(argv):
+    """Ponto de entrada das ferramentas de linha de comando"""
+    parser = argparse.ArgumentParser(
+        prog='process_mind_melhorado.py',
+        description='Ferramentas operacionais do PROCESS MIND (use "streamlit run" para a interface)'
+    )
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    
+    sub = subparsers.add_parser('benchmark-pool', help='Latência por rerun com e sem pool de conexões')
+    sub.add_argument('--db', default=DB_PATH, help='Caminho do banco SQLite')
+    sub.add_argument('--sessoes', type=int, default=20, help='Sessões simultâneas simuladas')
+    sub.add_argument('--reruns', type=int, default=10, help='Reruns por sessão')
+    sub.add_argument('--tamanho-pool', type=int, default=DB_POOL_TAMANHO, help='Conexões no pool')
+    sub.set_defaults(func=cli_benchmark_pool)
+    
+    sub = subparsers.add_parser('benchmark-pragma', help='Leitores x escritor para cada perfil de PRAGMA')
+    sub.add_argument('--db', default=DB_PATH, help='Caminho do banco SQLite (copiado para cada perfil)')
+    sub.add_argument('--perfis', help=f"Perfis separados por vírgula (padrão: {','.join(PERFIS_PRAGMA)})")
+    sub.add_argument('--leitores', type=int, default=8, help='Threads leitoras')
+    sub.add_argument('--duracao', type=float, default=5.0, help='Segundos por perfil')
+    sub.set_defaults(func=cli_benchmark_pragma)
+    
+    sub = subparsers.add_parser('benchmark-mapas', help='Construção e tamanho do HTML dos mapas: marcadores x cluster')
+    sub.add_argument('--pontos', type=int, nargs='+', default=[1000, 10000, 100000], help='Quantidades de pontos testadas')
+    sub.add_argument('--semente', type=int, default=42, help='Semente do gerador aleatório')
+    sub.set_defaults(func=cli_benchmark_mapas)
+    
+    sub = subparsers.add_parser('benchmark-heatmap', help='Construção e tamanho do heatmap: pontos brutos x grade')
+    sub.add_argument('--pontos', type=int, nargs='+', default=[10000, 100000], help='Quantidades de ocorrências testadas')
+    sub.add_argument('--celula', type=int, default=500, help='Lado da célula da grade, em metros')
+    sub.add_argument('--semente', type=int, default=42, help='Semente do gerador aleatório')
+    sub.set_defaults(func=cli_benchmark_heatmap)
+    
+    sub = subparsers.add_parser('gerar-sinteticos', help='Gerar municípios e séries sintéticas em volume')
+    sub.add_argument('--db', default=DB_PATH, help='Caminho do banco SQLite')
+    sub.add_argument('--municipios', type=int, default=1000, help='Quantidade de municípios sintéticos')
+    sub.add_argument('--ano-inicio', type=int, default=2023, help='Primeiro ano das séries mensais')
+    sub.add_argument('--ano-fim', type=int, default=2025, help='Último ano (até julho)')
+    sub.add_argument('--semente', type=int, default=42, help='Semente do gerador aleatório')
+    sub.add_argument('--tamanho-lote', type=int, default=50000, help='Linhas por lote de geração')
+    sub.set_defaults(func=cli_gerar_sinteticos)
+    
+    sub = subparsers.add_parser('importar-datasus', help='Importar CSVs mensais de internações (DATASUS/TABNET)')
+    sub.add_argument('caminhos', nargs='+', help='Arquivos CSV ou diretórios com arquivos CSV')
+    sub.add_argument('--db', default=DB_PATH, help='Caminho do banco SQLite')
+    sub.add_argument('--tamanho-lote', type=int, default=50000, help='Linhas lidas e gravadas por bloco')
+    sub.add_argument('--separador', default=';', help='Separador de campos do CSV')
+    sub.add_argument('--encoding', default='latin-1', help='Codificação do arquivo')
+    sub.set_defaults(func=cli_importar_datasus)
+    
+    sub = subparsers.add_parser('importar-cadastro', help='Importar cadastro nacional do CNES ou do INEP')
+    sub.add_argument('tipo', choices=sorted(CADASTROS), help='Cadastro a importar')
+    sub.add_argument('caminhos', nargs='+', help='Arquivos CSV ou diretórios com arquivos CSV')
+    sub.add_argument('--db', default=DB_PATH, help='Caminho do banco SQLite')
+    sub.add_argument('--tamanho-lote', type=int, default=20000, help='Registros comparados e gravados por bloco')
+    sub.add_argument('--separador', default=';', help='Separador de campos do CSV')
+    sub.add_argument('--encoding', default='latin-1', help='Codificação do arquivo')
+    sub.set_defaults(func=cli_importar_cadastro)
+    
+    sub = subparsers.add_parser('migrar', help='Aplicar migrações de esquema pendentes')
+    sub.add_argument('--db', default=DB_PATH, help='Caminho do banco SQLite')
+    sub.set_defaults(func=cli_migrar)
+    
+    sub = subparsers.add_parser('semear-tiles', help='Baixar os tiles do mapa base de cada município para um MBTiles')
+    sub.add_argument('--db', default=DB_PATH, help='Caminho do banco SQLite')
+    sub.add_argument('--arquivo', default=TILES_ARQUIVO, help='Arquivo MBTiles de destino')
+    sub.add_argument('--municipios', type=int, nargs='+', help='IDs dos municípios (padrão: todos)')
+    sub.add_argument('--zoom-min', type=int, default=8, help='Menor nível de zoom')
+    sub.add_argument('--zoom-max', type=int, default=TILES_ZOOM_MAX, help='Maior nível de zoom')
+    sub.add_argument('--raio', type=float, default=TILES_RAIO_KM, help='Raio ao redor da sede do município, em km')
+    sub.add_argument('--origem', default=TILES_ORIGEM or None, required=not TILES_ORIGEM,
+                     help='URL {z}/{x}/{y} do servidor de tiles de origem (deve permitir download em massa)')
+    sub.add_argument('--trabalhadores', type=int, default=2, help='Downloads simultâneos')
+    sub.add_argument('--por-segundo', type=float, default=TILES_POR_SEGUNDO, help='Máximo de tiles pedidos por segundo')
+    sub.add_argument('--maximo', type=int, default=TILES_MAXIMO, help='Recusar a semeadura acima deste número de tiles')
+    sub.set_defaults(func=cli_semear_tiles)
+    
+    sub = subparsers.add_parser('servir-tiles', help='Servidor HTTP local dos tiles do MBTiles')
+    sub.add_argument('--arquivo', default=TILES_ARQUIVO, help='Arquivo MBTiles')
+    sub.add_argument('--host', default='0.0.0.0', help='Endereço de escuta')
+    sub.add_argument('--porta', type=int, default=8081, help='Porta HTTP')
+    sub.set_defaults(func=cli_servir_tiles)
+    
+    sub = subparsers.add_parser('verificar-planos', help='EXPLAIN QUERY PLAN das consultas de leitura')
+    sub.add_argument('--db', default=DB_PATH, help='Caminho do banco SQLite')
+    sub.set_defaults(func=cli_verificar_planos)
+    
+    args = parser.parse_args(argv)
+    return args.func(args)
+
 if __name__ == "__main__":
+    from streamlit import runtime
+    
+    # Fora do "streamlit run", argumentos selecionam uma ferramenta de linha de comando
+    if len(sys.argv) > 1 and not runtime.exists():
+        sys.exit(executar_cli(sys.argv[1:]))
     main()
 
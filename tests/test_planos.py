@@ -0,0 +1,21 @@
+"""Regressão de planos de consulta: nenhuma consulta de leitura pode voltar a varrer tabela ou ordenar em B-tree temporária"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import process_mind_melhorado as pm
+
+
+def test_planos_sem_regressao(tmp_path):
+    db = pm.ProcessMindDB(str(tmp_path / 'planos.db'), cache_mb=0)
+    pm.gerar_dados_sinteticos(db, municipios=20, ano_inicio=2024, ano_fim=2024, semente=1)
+    with db.conexao() as conn:
+        conn.execute('ANALYZE')
+    
+    regressoes = {
+        resultado['consulta']: resultado['problemas']
+        for resultado in pm.verificar_planos_consulta(db)
+        if resultado['problemas']
+    }
+    assert not regressoes
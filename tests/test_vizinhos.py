@@ -0,0 +1,33 @@
+"""Vizinhos mais próximos: a KD-tree sobre a esfera devolve os mesmos vizinhos e distâncias da força bruta haversine"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import process_mind_melhorado as pm
+
+
+def _pontos(rng, quantidade, lat, lon, espalhamento):
+    return lat + rng.uniform(-espalhamento, espalhamento, quantidade), lon + rng.uniform(-espalhamento, espalhamento, quantidade)
+
+
+def test_kdtree_igual_a_forca_bruta(monkeypatch):
+    assert pm.SCIPY_DISPONIVEL, "scipy (requirements.txt) é necessário para a KD-tree"
+    rng = np.random.default_rng(7)
+    # Um município (escala de km) e pontos espalhados pelo país (escala de milhares de km)
+    casos = [
+        (*_pontos(rng, 400, -4.17, -40.75, 0.2), *_pontos(rng, 150, -4.17, -40.75, 0.2)),
+        (*_pontos(rng, 300, -15.0, -50.0, 20.0), *_pontos(rng, 200, -15.0, -50.0, 20.0)),
+    ]
+    
+    for origem_lat, origem_lon, destino_lat, destino_lon in casos:
+        for k in (1, 3):
+            distancias_kdtree, indices_kdtree = pm.vizinhos_mais_proximos(origem_lat, origem_lon, destino_lat, destino_lon, k)
+            with monkeypatch.context() as contexto:
+                contexto.setattr(pm, 'SCIPY_DISPONIVEL', False)
+                distancias_bruta, indices_bruta = pm.vizinhos_mais_proximos(origem_lat, origem_lon, destino_lat, destino_lon, k)
+            
+            np.testing.assert_array_equal(indices_kdtree, indices_bruta)
+            np.testing.assert_allclose(distancias_kdtree, distancias_bruta, rtol=1e-9, atol=1e-6)